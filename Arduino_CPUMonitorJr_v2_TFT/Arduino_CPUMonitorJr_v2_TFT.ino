@@ -78,6 +78,12 @@ bool clearGraphData = true;
 
 double currentCPUValue[MAX_NUMBER_OF_PROCESSORS];
 
+// used to assemble chunked cpu readings (transaction code 4) from computers with more than 255 CPUs
+double chunkedCPUTotal[MAX_NUMBER_OF_PROCESSORS];
+uint32_t chunkedCPUCount[MAX_NUMBER_OF_PROCESSORS];
+uint32_t chunkedCPUNextIndex = 0;
+uint32_t chunkedCPUSeriesTotal = 0;
+
 uint32_t currentNumberOfProcessors;
 
 double currentCPUAverage;
@@ -94,6 +100,21 @@ String currentLANAddress = "";
 
 String currentExternalAddress = "";
 
+// busiest services / containers on the computer (transaction code 6), busiest first
+const int MAX_TOP_CGROUPS = 16;
+uint8_t currentNumberOfTopCgroups = 0;
+String topCgroupName[MAX_TOP_CGROUPS];
+float topCgroupCPU[MAX_TOP_CGROUPS];
+float topCgroupMemory[MAX_TOP_CGROUPS];
+
+// cpu clock speeds and thermal throttling (transaction code 7)
+uint16_t currentCPUMHz[MAX_NUMBER_OF_PROCESSORS];
+uint8_t currentCPUThrottleEvents[MAX_NUMBER_OF_PROCESSORS];
+uint16_t currentNumberOfCPUClockSpeeds = 0;
+uint16_t maximumCPUMHz = 0;
+uint32_t throttleEventsSinceConnected = 0;
+unsigned long lastTimeCPUWasThrottled = 0;
+
 // Time stuff
 const char* ntpServer = TIME_SERVER;
 const long gmtOffset_sec = 3600 * TIME_ZONE;
@@ -156,6 +177,11 @@ const bool showMilitaryTime = false;  // if true will show 24 hour formatted tim
 const int32_t TFT_Width = 320;   // TFT show Width
 const int32_t TFT_Height = 170;  // TFT show Height
 
+// historical line graph readings, newest first; one per pixel across the graph (its width less a 2 pixel boarder on each side)
+const int maxGraphReadings = TFT_Width - 2 * 2;
+int graphReadings[maxGraphReadings] = { 0 };
+const int graphMillisecondsPerReading = 35;  // the line graph moves one pixel per pass of the main loop, which takes about 35ms
+
 bool showTheSettingsScreen = false;
 bool showTheAboutScreen = false;
 
@@ -445,6 +471,32 @@ void updateConnectedComputer() {
       sprite.drawString(currentExternalAddress, xOffset, yOffset + 20, 2);
 }
 
+void updateTopCgroup() {
+
+  // Dimensions of this show object are 124x8 (below the computer name and IP address)
+
+  // Top left most pixel
+  const int32_t xOffset = 0;
+  const int32_t yOffset = 50;
+
+  // at 6 pixels a character, what fits beside the percentage
+  const unsigned int maximumNameLength = 13;
+
+  // only sent when enabled on the computer (transaction code 6)
+  if (currentNumberOfTopCgroups == 0) return;
+
+  String name = topCgroupName[0];
+  if (name.length() > maximumNameLength)
+    name = name.substring(0, maximumNameLength - 1) + "~";
+
+  sprite.setTextColor(TFT_WHITE, TFT_BLACK);
+
+  // align text to Top Left
+  sprite.setTextDatum(TL_DATUM);
+
+  sprite.drawString(name + " " + String(topCgroupCPU[0], 1) + "%", xOffset, yOffset, 1);
+}
+
 void updateTemperature() {
 
   // Dimensions of this show object are 56X56
@@ -660,9 +712,9 @@ void updateGraph() {
   const int32_t boarder = 2;   // boarder beyond frame and graph
   const int32_t spacing = 10;  // grid spacing
 
-  // graph readings storage array
-  const int maxReadings = objectW - 2 * boarder;
-  static int readings[maxReadings] = { 0 };
+  // graph readings storage array (global so it can be refilled from the computer's history, see transaction code 5)
+  const int maxReadings = maxGraphReadings;
+  int* readings = graphReadings;
 
   if (clearGraphData) {
     for (int i = 0; i < maxReadings; i++)
@@ -721,6 +773,41 @@ void updateGraph() {
 }
 
 
+void updateCPUClockSpeed() {
+
+  // Shown in the top right corner of the graph
+
+  // Top right most pixel
+  const int32_t xOffset = TFT_Width - 4;
+  const int32_t yOffset = 63;
+
+  // how long the throttled indicator stays up after the last throttle event
+  const unsigned long showThrottledFor = 5000;
+
+  // only sent when enabled on the computer (transaction code 7)
+  if (currentNumberOfCPUClockSpeeds == 0) return;
+
+  uint32_t totalMHz = 0;
+  for (uint16_t i = 0; i < currentNumberOfCPUClockSpeeds; i++)
+    totalMHz += currentCPUMHz[i];
+
+  String sClockSpeed = String(float(totalMHz / currentNumberOfCPUClockSpeeds) / float(1000), 1);
+  if (maximumCPUMHz > 0)
+    sClockSpeed.concat("/" + String(float(maximumCPUMHz) / float(1000), 1));
+  sClockSpeed.concat(" GHz");
+
+  // align text to Top Right
+  sprite.setTextDatum(TR_DATUM);
+
+  if ((lastTimeCPUWasThrottled != 0) && ((millis() - lastTimeCPUWasThrottled) < showThrottledFor)) {
+    sprite.setTextColor(TFT_WHITE, TFT_RED);
+    sprite.drawString("throttled (" + String(throttleEventsSinceConnected) + ") " + sClockSpeed, xOffset, yOffset, 1);
+  } else {
+    sprite.setTextColor(TFT_WHITE, TFT_BLACK);
+    sprite.drawString(sClockSpeed, xOffset, yOffset, 1);
+  };
+}
+
 void drawDisplay() {
 
   sprite.pushSprite(0, 0);
@@ -937,6 +1024,267 @@ void onWsEvent(AsyncWebSocket* server, AsyncWebSocketClient* client, AwsEventTyp
           //if (DEBUG_IS_ON) Serial.println(String(currentAverageTempReading) + " " + String(currentPercentOfMemoryUsed) + " " + String(currentCPUAverage));
         };
 
+        break;
+
+      case 3:  // memory, temperature and changed cpu loads stream (delta of the last case 2 stream)
+
+        /*
+          byte 0 = is a '3' to represent this is a delta memory, temperature and cpu data stream
+          byte 1 to byte 7 = as for case 2 (memory, temperatures and number of cpus)
+          byte 8 and on = bitmap of changed cpus, one bit per cpu (bit 0 of byte 8 = cpu 0, bit 1 of byte 8 = cpu 1, ...)
+          after the bitmap = cpu busy of each changed cpu, in cpu order
+        */
+
+        {
+
+          // a delta only applies on top of a full (case 2) stream with the same number of CPUs;
+          // otherwise wait for the next full stream which the computer sends periodically
+          size_t bitmapLength = (currentNumberOfProcessors + 7) / 8;
+
+          if (!currentReadingsAreAvailable || data[7] != currentNumberOfProcessors || len < 8 + bitmapLength)
+            break;
+
+          currentPercentOfMemoryUsed = data[1] + (float(data[2]) / float(10));
+
+          currentAverageTempReading = data[3] + (float(data[4]) / float(10));
+          if (!showTemperatureInCelsius)
+            currentAverageTempReading = currentAverageTempReading * 9 / 5 + 32;
+
+          currentMaximumTempReading = data[5] + (float(data[6]) / float(10));
+          if (!showTemperatureInCelsius)
+            currentMaximumTempReading = currentMaximumTempReading * 9 / 5 + 32;
+
+          size_t valueIndex = 8 + bitmapLength;
+
+          for (uint32_t i = 0; i < currentNumberOfProcessors && valueIndex < len; i++)
+            if (data[8 + i / 8] & (1 << (i % 8)))
+              currentCPUValue[i] = data[valueIndex++];
+
+          // calculate average CPU value to populate the Line Graph
+          double workingTotal = 0;
+          for (uint32_t i = 0; i < currentNumberOfProcessors; i++)
+            workingTotal += currentCPUValue[i];
+
+          currentCPUAverage = workingTotal / currentNumberOfProcessors;
+        };
+
+        break;
+
+      case 4:  // memory, temperature and cpu loads stream, in chunks (computers with more than 255 CPUs)
+
+        /*
+          byte 0  = is a '4' to represent this is a chunked memory, temperature and cpu data stream
+          byte 1 to byte 6 = as for case 2 (memory and temperatures)
+          byte 7  = total number of cpus, low byte
+          byte 8  = total number of cpus, high byte
+          byte 9  = first cpu in this chunk, low byte
+          byte 10 = first cpu in this chunk, high byte
+          byte 11 = number of cpus in this chunk
+          byte 12 and on = cpu busy of each cpu in this chunk
+          chunks arrive in cpu order; the readings are shown once the last chunk has arrived
+        */
+
+        {
+
+          if (len < 12)
+            break;
+
+          uint32_t totalCPUs = data[7] + (data[8] << 8);
+          uint32_t firstCPU = data[9] + (data[10] << 8);
+          uint32_t chunkCPUs = data[11];
+
+          // reject a malformed chunk: its cpus must lie within the total number of cpus
+          if (totalCPUs == 0 || len < 12 + chunkCPUs || firstCPU + chunkCPUs > totalCPUs)
+            break;
+
+          // when there are more cpus than bars, each bar shows the average of a group of neighbouring cpus;
+          // bars never exceeds MAX_NUMBER_OF_PROCESSORS (the size of the chunked arrays), and as every cpu
+          // in the chunk is below totalCPUs, each bar index below is below bars
+          uint32_t bars = (totalCPUs < MAX_NUMBER_OF_PROCESSORS) ? totalCPUs : MAX_NUMBER_OF_PROCESSORS;
+
+          if (firstCPU == 0) {
+            for (uint32_t b = 0; b < bars; b++) {
+              chunkedCPUTotal[b] = 0;
+              chunkedCPUCount[b] = 0;
+            };
+            chunkedCPUNextIndex = 0;
+            chunkedCPUSeriesTotal = totalCPUs;
+          };
+
+          // if a chunk went missing, or belongs to a series with another number of cpus, wait for the start of the next series
+          if (firstCPU != chunkedCPUNextIndex || totalCPUs != chunkedCPUSeriesTotal)
+            break;
+
+          for (uint32_t i = 0; i < chunkCPUs; i++) {
+            uint32_t b = (firstCPU + i) * bars / totalCPUs;
+            chunkedCPUTotal[b] += data[12 + i];
+            chunkedCPUCount[b]++;
+          };
+
+          chunkedCPUNextIndex = firstCPU + chunkCPUs;
+
+          if (chunkedCPUNextIndex < totalCPUs)
+            break;
+
+          currentPercentOfMemoryUsed = data[1] + (float(data[2]) / float(10));
+
+          currentAverageTempReading = data[3] + (float(data[4]) / float(10));
+          if (!showTemperatureInCelsius)
+            currentAverageTempReading = currentAverageTempReading * 9 / 5 + 32;
+
+          currentMaximumTempReading = data[5] + (float(data[6]) / float(10));
+          if (!showTemperatureInCelsius)
+            currentMaximumTempReading = currentMaximumTempReading * 9 / 5 + 32;
+
+          double workingTotal = 0;
+          currentNumberOfProcessors = bars;
+          for (uint32_t b = 0; b < bars; b++) {
+            workingTotal += chunkedCPUTotal[b];
+            currentCPUValue[b] = (chunkedCPUCount[b] > 0) ? chunkedCPUTotal[b] / chunkedCPUCount[b] : 0;
+          };
+
+          // calculate average CPU value (across all cpus) to populate the Line Graph
+          currentCPUAverage = workingTotal / totalCPUs;
+
+          currentReadingsAreAvailable = true;
+        };
+
+        break;
+
+      case 5:  // average cpu load history stream (sent after a connection is made, to refill the line graph)
+
+        /*
+          byte 0 = is a '5' to represent this is an average cpu load history stream
+          byte 1 = number of readings, low byte
+          byte 2 = number of readings, high byte
+          byte 3 and on = three bytes for each reading, oldest first:
+                          average cpu busy, then the milliseconds the reading was current for (low byte, high byte)
+        */
+
+        {
+
+          if (len < 3)
+            break;
+
+          uint32_t numberOfReadings = data[1] + (data[2] << 8);
+
+          if (len < 3 + 3 * numberOfReadings)
+            break;
+
+          // starting with the newest reading, draw each one across as many pixels as the graph would have moved while it was current
+          int pixel = 0;
+
+          for (int32_t r = numberOfReadings - 1; r >= 0 && pixel < maxGraphReadings; r--) {
+
+            uint32_t milliseconds = data[3 + 3 * r + 1] + (data[3 + 3 * r + 2] << 8);
+            uint32_t pixels = (milliseconds + graphMillisecondsPerReading / 2) / graphMillisecondsPerReading;
+            if (pixels == 0)
+              pixels = 1;
+
+            for (uint32_t p = 0; p < pixels && pixel < maxGraphReadings; p++)
+              graphReadings[pixel++] = data[3 + 3 * r];
+          };
+
+          // keep the refilled graph (rather than clearing it when the readings are next shown)
+          clearGraphData = false;
+        };
+
+        break;
+
+      case 6:  // busiest cgroups stream (services and containers; sent after the cpu loads when enabled on the computer)
+
+        /*
+          byte 0 = is a '6' to represent this is a busiest cgroups stream
+          byte 1 = number of cgroups, busiest first
+          byte 2 and on = for each cgroup:
+                          percent of cpu used whole number, then decimal
+                          percent of memory used whole number, then decimal
+                          length of the name, then the name
+        */
+
+        {
+
+          if (len < 2)
+            break;
+
+          uint8_t count = 0;
+          size_t i = 2;
+
+          for (uint8_t c = 0; c < data[1] && count < MAX_TOP_CGROUPS; c++) {
+
+            if (i + 5 > len || i + 5 + data[i + 4] > len)
+              break;
+
+            topCgroupCPU[count] = data[i] + (float(data[i + 1]) / float(10));
+            topCgroupMemory[count] = data[i + 2] + (float(data[i + 3]) / float(10));
+
+            topCgroupName[count] = "";
+            for (uint8_t n = 0; n < data[i + 4]; n++)
+              topCgroupName[count].concat(String((char)data[i + 5 + n]));
+
+            i += 5 + data[i + 4];
+            count++;
+          };
+
+          currentNumberOfTopCgroups = count;
+
+          // this can be turned on, however may cause problems if data is coming in too fast
+          // if (DEBUG_IS_ON) for (uint8_t c = 0; c < count; c++) Serial.println(topCgroupName[c] + " " + String(topCgroupCPU[c]) + "% " + String(topCgroupMemory[c]) + "%");
+        };
+
+        break;
+
+      case 7:  // cpu clock speed and thermal throttling stream (sent after the cpu loads when enabled on the computer)
+
+        /*
+          byte 0 = is a '7' to represent this is a cpu clock speed and thermal throttling stream
+          byte 1 = total number of cpus, low byte
+          byte 2 = total number of cpus, high byte
+          byte 3 = index of the first cpu in this stream, low byte
+          byte 4 = index of the first cpu in this stream, high byte
+          byte 5 = number of cpus in this stream
+          byte 6 = maximum clock speed in MHz, low byte
+          byte 7 = maximum clock speed in MHz, high byte
+          byte 8 = package throttle events since the last stream, low byte
+          byte 9 = package throttle events since the last stream, high byte
+          byte 10 and on = three bytes for each cpu: clock speed in MHz (low byte, high byte), then its throttle events since the last stream
+        */
+
+        {
+
+          if (len < 10)
+            break;
+
+          uint32_t firstCPU = data[3] + (data[4] << 8);
+          uint32_t streamCPUs = data[5];
+
+          if (len < 10 + 3 * streamCPUs)
+            break;
+
+          uint32_t totalCPUs = data[1] + (data[2] << 8);
+          currentNumberOfCPUClockSpeeds = (totalCPUs < MAX_NUMBER_OF_PROCESSORS) ? totalCPUs : MAX_NUMBER_OF_PROCESSORS;
+
+          maximumCPUMHz = data[6] + (data[7] << 8);
+
+          uint32_t throttleEvents = 0;
+          if (firstCPU == 0)
+            throttleEvents = data[8] + (data[9] << 8);
+
+          for (uint32_t i = 0; i < streamCPUs; i++) {
+            throttleEvents += data[12 + 3 * i];
+            if (firstCPU + i < MAX_NUMBER_OF_PROCESSORS) {
+              currentCPUMHz[firstCPU + i] = data[10 + 3 * i] + (data[11 + 3 * i] << 8);
+              currentCPUThrottleEvents[firstCPU + i] = data[12 + 3 * i];
+            };
+          };
+
+          throttleEventsSinceConnected += throttleEvents;
+          if (throttleEvents > 0)
+            lastTimeCPUWasThrottled = millis();
+
+          if (DEBUG_IS_ON && throttleEvents > 0) Serial.println("CPU throttled: " + String(throttleEvents) + " event(s)");
+        };
+
         break;
     }
   }
@@ -959,6 +1307,8 @@ void checkWebSocket() {
   if (SecondsSinceLastTimeDataWasReceivedOrRequestedFromComputer > AdvertiseThreshold) {
     currentReadingsAreAvailable = false;
     clearGraphData = true;
+    currentNumberOfTopCgroups = 0;
+    currentNumberOfCPUClockSpeeds = 0;
     lastTimeDataWasReceivedFromComputer = millis();
     if (DEBUG_IS_ON) Serial.println("checkWebSocket() Advertise");
     Advertise();
@@ -1420,12 +1770,16 @@ void loop() {
 
     updateConnectedComputer();
 
+    updateTopCgroup();
+
     updateTemperature();
 
     updatePercentOfMemoryUsed();
 
     updateGraph();
 
+    updateCPUClockSpeed();
+
   } else {
 
     updateNotConnectedMessage();
@@ -1,19 +1,38 @@
 #!/usr/bin/env python3
+import argparse
 import asyncio
+import bisect
 import contextlib
+import csv
+import fnmatch
+import hashlib
+import hmac
+import json
 import logging
 import logging.handlers
+import math
 import os
+import queue
+import random
 import sys
 import signal
 import socket
+import struct
+import threading
 import time
+from array import array
+from collections import deque
 from datetime import datetime, timedelta
 from decimal import Decimal, ROUND_HALF_UP
-from typing import Tuple, List, Optional
+from typing import Deque, Dict, Tuple, List, Optional
 
 import psutil
 import websockets
+
+try:
+    import numpy as np  # optional: vectorizes the high-rate sample aggregation
+except ImportError:
+    np = None
 # =============================================================================
 #
 # CPUMonitorJr (for Linux) v2
@@ -43,9 +62,20 @@ import websockets
 # -----------------------------------------------------------------------------
 # - The frequency at which data is sent to the ESP32 is controlled by the
 #   environment variable CPUMONITORJR_INTERVAL (seconds).
-#   - Changing this requires restarting the Python process.
+#   - Changing this requires restarting the Python process, unless it is
+#     changed through the control socket (see below).
 #   - Default is 1.0 seconds. A value below 0.2 seconds drives too much overhead,
 #     so the minimal enforced value is 0.2 seconds.
+#   - Frames are sent on fixed deadlines, so the period does not drift with
+#     sampling or send time. Send SIGUSR1 to log timing statistics.
+#   - Adaptive cadence: with CPUMONITORJR_ADAPTIVE=1 the interval moves between
+#     CPUMONITORJR_ADAPTIVE_MIN (default CPUMONITORJR_INTERVAL) and
+#     CPUMONITORJR_ADAPTIVE_MAX (default 5.0) seconds. It stretches while no
+#     core load, memory or temperature value changes by more than
+#     CPUMONITORJR_ADAPTIVE_THRESHOLD (default 5.0 percentage points or °C)
+#     between frames and drops back to the minimum as soon as one does. A
+#     display whose sends are slow or whose socket buffer backs up is skipped
+#     for a growing number of ticks until it catches up.
 #
 # - The computer running this program and the ESP32 must use the same UDP port.
 #   - On the computer side (this program), set CPUMONITORJR_UDP_PORT.
@@ -55,38 +85,519 @@ import websockets
 #   - Default log file path is OS-specific, overridable by CPUMONITORJR_LOG_FILE.
 #     * Linux:    /var/log/CPUMonitorJr/CPUMonitorJr.log
 #   - Syslog is attempted on Linux if available; missing syslog is non-fatal.
+#   - With CPUMONITORJR_LOG_JOURNALD=1 records go to the systemd journal's
+#     native socket (with their priority) instead of syslog.
+#   - Records are handed to a background thread through a bounded queue
+#     (CPUMONITORJR_LOG_QUEUE_SIZE records, default 1000), so file, syslog
+#     and journal I/O (including log rotation) never runs on the send loop.
+#     When the queue is full, records are dropped and counted rather than
+#     waited for. Set CPUMONITORJR_LOG_QUEUE_SIZE=0 to write synchronously.
+#
+# - The external IP shown on the display is looked up in the background from
+#   CPUMONITORJR_EXTERNAL_IP_URL (default https://api.ipify.org; set it empty
+#   to disable the lookup on air-gapped hosts) and cached for
+#   CPUMONITORJR_EXTERNAL_IP_TTL seconds (default 3600).
+#
+# - Each display is connected by its own background task. An unreachable
+#   display is retried with jittered exponential backoff (0.5 s doubling to
+#   60 s) while sampling and every other display carry on; SIGUSR1 also logs
+#   each display's connection counters.
+#
+# - Metrics: set CPUMONITORJR_METRICS_PORT to serve the agent's own timings
+#   (sample, encode, send, connect and tick lateness histograms, discovery
+#   and reconnect counters, the current displays) in OpenMetrics text format
+#   at http://127.0.0.1:<port>/metrics. CPUMONITORJR_METRICS_ADDRESS changes
+#   the bind address; CPUMONITORJR_METRICS_SOCKET serves the same over a Unix
+#   socket instead (curl --unix-socket <path> http://localhost/metrics).
+#
+# - Control socket: set CPUMONITORJR_CONTROL_SOCKET (cpumonitorjr.service uses
+#   /run/cpumonitorjr/control) to change a running agent without restarting
+#   it or dropping its display connections:
+#     python3 cpumonitorjr.py ctl [--socket <path>] <command>
+#   "interval <s>" and "sampling <n> [avg|peak|p<NN>]" change the send
+#   interval and the high-rate sampling, "sampler proc|psutil" switches the
+#   sampler, "pin <ip>[:port]" adds a display that never expires (and
+#   "unpin <ip>" undoes it), "resend" resends the time and computer info, and
+#   "status", "sample" and "stats" show the settings, the newest sample and
+#   the timing statistics. The UDP port and the other settings still need a
+#   restart.
+#
+# - Discovery: an ESP32 advertises "CPUMonitorJr;<IP>;" and its websocket is
+#   reached on port 80. An optional third field, "CPUMonitorJr;<IP>;<PORT>",
+#   names another websocket port (the fleet simulator in cpumonitorjr_sim.py
+#   uses this to run many displays on one machine).
+#   - Discovery packets are rate limited (token bucket), repeats of the same
+#     advertisement within 5 s are ignored, and an advertisement is only
+#     accepted from the address it advertises (set
+#     CPUMONITORJR_DISCOVERY_CHECK_SOURCE=0 to accept relayed ones).
+#   - A display that is not connected and has not advertised itself for
+#     CPUMONITORJR_TARGET_EXPIRY seconds (default 300) is forgotten.
+#
+# - Several hosts on one display: run every node with
+#   CPUMONITORJR_AGGREGATOR=<aggregator host>[:port] (default port 44448).
+#   A node does not look for displays; each tick it sends its sample in one
+#   small UDP packet to the aggregator. The aggregator runs with
+#   CPUMONITORJR_AGGREGATOR_PORT=44448 and serves the displays as usual,
+#   showing its own and its nodes' stats according to
+#   CPUMONITORJR_AGGREGATOR_VIEW:
+#   - "rotate" (default): one host at a time, each for CPUMONITORJR_ROTATE_SEC
+#     seconds (default 10), with that host's name and LAN IP
+#   - "summary": one bar per host (its average CPU load) under "<N> hosts"
+#   Set the same CPUMONITORJR_NODE_KEY on the aggregator and its nodes to
+#   have the node packets signed (HMAC-SHA256) and unsigned ones ignored. A
+#   node silent for 30 seconds is dropped from the display.
+#
+# - Benchmarking only: CPUMONITORJR_PROC_ROOT points the native sampler at
+#   another procfs (e.g. a synthetic one with many CPUs),
+#   CPUMONITORJR_SYSFS_CPU_ROOT the clock speed reader at another
+#   /sys/devices/system/cpu, and
+#   CPUMONITORJR_FRAME_TIMESTAMPS=1 appends the sample's CLOCK_MONOTONIC time
+#   (8 bytes, little-endian nanoseconds) to every stats frame so a simulated
+#   display on the same machine can measure sample-to-receive latency.
+#
+# - systemd: cpumonitorjr.service is Type=notify. The agent reports READY
+#   once its UDP socket is bound, keeps a STATUS= line (connected displays
+#   and frame rate, see systemctl status) current and, with WatchdogSec= set,
+#   pings the watchdog only while the send timer completes its ticks and the
+#   sampler delivers samples, so a hung connect or sensor read gets the
+#   service restarted. Enabling cpumonitorjr.socket instead starts the
+#   agent on the first discovery packet and hands it the already bound
+#   UDP socket. Outside systemd all of this is a no-op.
 #
 # - Optional active discovery broadcast (disabled by default). If enabled via
 #   CPUMONITORJR_SEND_DISCOVERY=1, a small UDP broadcast message is sent
 #   periodically to help an ESP32 that listens for discovery probes.
+#
+# - Sampling: on Linux the stats are read natively from /proc and hwmon using
+#   file handles kept open between samples. Set CPUMONITORJR_SAMPLER=psutil to
+#   use psutil instead (psutil is always used on other platforms).
+#
+# - High-rate sampling: set CPUMONITORJR_SAMPLES_PER_INTERVAL (default 1) to
+#   sample several times per send interval. The samples are folded into each
+#   frame according to CPUMONITORJR_AGGREGATE: "avg" (default), "peak", or a
+#   percentile such as "p95". NumPy is used for this when it is installed.
+#
+# - Hosts with more than 255 logical CPUs are sent as a series of chunked
+#   stats frames (frame type 4) of at most CPUMONITORJR_MAX_CORES_PER_FRAME
+#   CPUs each (default 240); the display folds them into its bars.
+#
+# - Delta frames: with CPUMONITORJR_DELTA_FRAMES=1 the stats frame is sent as a
+#   delta (only the CPUs whose value changed) with a full keyframe every
+#   CPUMONITORJR_KEYFRAME_EVERY frames (default 10) and after each reconnect.
+#   This requires an ESP32 sketch that understands frame type 3.
+#
+# - Graph backfill: the average CPU load of the last 316 frames (the width of
+#   the display's line graph) is kept in memory and sent to a display in one
+#   history frame (frame type 5) after it (re)connects, so its graph does not
+#   restart empty. Set CPUMONITORJR_HISTORY_BACKFILL=0 to turn this off.
+#
+# - Recorder: set CPUMONITORJR_RECORD_FILE (e.g.
+#   /var/log/CPUMonitorJr/samples.rec) to keep every stats sample (time,
+#   memory, average and max temperature, the loads of the bars in the stats
+#   frame layout) in a ring file of at most CPUMONITORJR_RECORD_MAX_MB megabytes
+#   (default 64, about two million samples of a 16 CPU host). Samples are
+#   written every 10 seconds and the file is only synced at shutdown, so a
+#   crash loses at most the last few seconds. When the number of CPUs
+#   changes (CPUs going on/offline, another core grouping) the recording so
+#   far is kept as <path>.1 and a new one is started. Read it back with
+#     python3 cpumonitorjr.py export --file <path> [--from <time>] [--to <time>]
+#       [--last 2h] [--every 60] [--agg avg|peak] [--format csv|json]
+#   Its columns are named after what was recorded: cpu0, cpu1, ... or
+#   core0, ccx0, socket0, container0, ... with a core grouping or container
+#   limits.
+#
+# - cgroups: with CPUMONITORJR_CGROUP_TOP=<N> (up to 16) the N busiest
+#   cgroups under the cgroup v2 mount (CPUMONITORJR_CGROUP_ROOT, default
+#   /sys/fs/cgroup), e.g. systemd services and containers, are sent after
+#   every stats frame in a top cgroups frame (frame type 6) with their CPU
+#   and memory use. CPUMONITORJR_CGROUP_DEPTH (default 2) sets how far down
+#   the tree to look. When the agent itself runs in a container the memory
+#   percent and the CPU bars are then those of the container itself: memory
+#   against memory.max, and the container's own CPU use (its cpu.stat) with
+#   one bar per CPU of its limit (cpu.max, or the cpuset's CPUs), filled in
+#   turn, so 2.5 CPUs busy of a 4 CPU quota shows as 100, 100, 50 and 0%.
+#   Set CPUMONITORJR_CGROUP_LIMITS=on to force this (also without a top
+#   list) or "off" to show the host totals.
+#
+# - Clock speeds: with CPUMONITORJR_FREQ_FRAMES=1 every CPU's current clock
+#   speed (cpufreq scaling_cur_freq) and the thermal throttle events since
+#   the previous frame (thermal_throttle core and package counts) are sent
+#   after every stats frame in a frequency frame (frame type 7), so a busy
+#   CPU that has been throttled down is visible. The sysfs files are opened
+#   once at startup. In a container with its own limits (see cgroups above)
+#   only the CPUs of its cpuset are sent. This requires an ESP32 sketch that
+#   understands frame type 7.
+#
+# - CPU grouping: CPUMONITORJR_CORE_GROUPING=core shows one bar per physical
+#   core (SMT siblings averaged), "ccx" one bar per shared L3 cache and
+#   "socket" one bar per physical package. The default "cpu" shows one bar per
+#   logical CPU. The topology is read from sysfs once at startup.
+#
+# - Temperatures: on Linux the CPU sensors (coretemp, k10temp, zenpower,
+#   cpu_thermal; thermal zones or acpitz as a fallback) are discovered once at
+#   startup and only those are read each tick. Sensors are named
+#   "<chip>/<label>" (e.g. "coretemp/Package id 0") and can be chosen with
+#   comma separated, case-insensitive wildcard patterns in
+#   CPUMONITORJR_TEMP_INCLUDE and CPUMONITORJR_TEMP_EXCLUDE.
 # =============================================================================
 
 def _default_log_path() -> str:
     return "/var/log/CPUMonitorJr/CPUMonitorJr.log"
 
 LOG_FILE = os.getenv("CPUMONITORJR_LOG_FILE", _default_log_path())
+LOG_QUEUE_SIZE = max(0, int(os.getenv("CPUMONITORJR_LOG_QUEUE_SIZE", "1000")))  # 0 logs synchronously
+LOG_JOURNALD = os.getenv("CPUMONITORJR_LOG_JOURNALD", "0") in ("1", "true", "True")
+JOURNALD_SOCKET = "/run/systemd/journal/socket"
 UDP_LISTEN_PORT = int(os.getenv("CPUMONITORJR_UDP_PORT", "44447"))  # must match ESP32 UDP_PORT
 WS_INTERVAL_SEC = float(os.getenv("CPUMONITORJR_INTERVAL", "1.0"))  
-EXTERNAL_IP_URL = "https://api.ipify.org"
+EXTERNAL_IP_URL = os.getenv("CPUMONITORJR_EXTERNAL_IP_URL", "https://api.ipify.org")  # empty disables the lookup
+EXTERNAL_IP_TTL_SEC = float(os.getenv("CPUMONITORJR_EXTERNAL_IP_TTL", "3600"))
+EXTERNAL_IP_RETRY_SEC = 300.0  # how long a failed external lookup is cached
+EXTERNAL_IP_UNAVAILABLE = "External address not available"
+ADDRESS_POLL_SEC = 10.0  # how often local interfaces are checked for changes
 MIN_INTERVAL_SEC = 0.2  # enforced 200 ms minimum
 ACTIVE_DISCOVERY = os.getenv("CPUMONITORJR_SEND_DISCOVERY", "0") in ("1", "true", "True")
+SAMPLER_KIND = os.getenv("CPUMONITORJR_SAMPLER", "auto").lower()  # auto | proc | psutil
+PROC_ROOT = os.getenv("CPUMONITORJR_PROC_ROOT", "/proc")
+FRAME_TIMESTAMPS = os.getenv("CPUMONITORJR_FRAME_TIMESTAMPS", "0") in ("1", "true", "True")  # benchmarking only
+DEFAULT_WS_PORT = 80  # the ESP32 sketch's AsyncWebServer port
+DISCOVERY_CHECK_SOURCE = os.getenv("CPUMONITORJR_DISCOVERY_CHECK_SOURCE", "1") in ("1", "true", "True")
+DISCOVERY_RATE = 10.0  # discovery packets per second accepted on average ...
+DISCOVERY_BURST = 20  # ... and in a burst
+DISCOVERY_DEDUP_SEC = 5.0  # identical advertisements from one source within this window are ignored
+DISCOVERY_MAX_SOURCES = 1024  # size bound of the per-source table
+TARGET_EXPIRY_SEC = float(os.getenv("CPUMONITORJR_TARGET_EXPIRY", "300"))
+TARGET_EXPIRY_CHECK_SEC = 30.0
+DELTA_FRAMES = os.getenv("CPUMONITORJR_DELTA_FRAMES", "0") in ("1", "true", "True")  # needs a sketch with delta support
+KEYFRAME_EVERY = max(1, int(os.getenv("CPUMONITORJR_KEYFRAME_EVERY", "10")))
+MAX_CORES_PER_FRAME = max(1, min(255, int(os.getenv("CPUMONITORJR_MAX_CORES_PER_FRAME", "240"))))  # chunk size above 255 CPUs
+SAMPLES_PER_INTERVAL = int(os.getenv("CPUMONITORJR_SAMPLES_PER_INTERVAL", "1"))
+AGGREGATE_MODE = os.getenv("CPUMONITORJR_AGGREGATE", "avg").lower()  # avg | peak | p<NN>
+SAMPLE_LEAD_SEC = 0.005  # margin by which an interval's last sample finishes before its send tick
+CORE_GROUPING = os.getenv("CPUMONITORJR_CORE_GROUPING", "cpu").lower()  # cpu | core | ccx | socket
+HISTORY_BACKFILL = os.getenv("CPUMONITORJR_HISTORY_BACKFILL", "1") in ("1", "true", "True")
+HISTORY_LENGTH = 316  # pixels across the display's line graph
+CGROUP_TOP = max(0, min(16, int(os.getenv("CPUMONITORJR_CGROUP_TOP", "0"))))  # 0 disables the cgroup frame
+CGROUP_ROOT = os.getenv("CPUMONITORJR_CGROUP_ROOT", "/sys/fs/cgroup")
+CGROUP_DEPTH = int(os.getenv("CPUMONITORJR_CGROUP_DEPTH", "2"))
+CGROUP_LIMITS = os.getenv("CPUMONITORJR_CGROUP_LIMITS", "auto").lower()  # auto | on | off
+CGROUP_RESCAN_SEC = 10.0  # how often the cgroup tree is rescanned for new and removed cgroups
+CGROUP_NAME_LENGTH = 24
+FREQ_FRAMES = os.getenv("CPUMONITORJR_FREQ_FRAMES", "0") in ("1", "true", "True")  # needs a sketch with frame type 7
+SYSFS_CPU_ROOT = os.getenv("CPUMONITORJR_SYSFS_CPU_ROOT", "/sys/devices/system/cpu")
+RECORD_FILE = os.getenv("CPUMONITORJR_RECORD_FILE", "")  # empty disables the recorder
+RECORD_MAX_MB = float(os.getenv("CPUMONITORJR_RECORD_MAX_MB", "64"))
+RECORD_FLUSH_SEC = 10.0  # how often recorded samples are written out
+AGGREGATOR_ADDRESS = os.getenv("CPUMONITORJR_AGGREGATOR", "")  # host[:port]; makes this agent a node
+AGGREGATOR_PORT = int(os.getenv("CPUMONITORJR_AGGREGATOR_PORT", "0") or 0)  # 0: not an aggregator
+DEFAULT_AGGREGATOR_PORT = 44448
+AGGREGATOR_VIEW = os.getenv("CPUMONITORJR_AGGREGATOR_VIEW", "rotate").lower()  # rotate | summary
+ROTATE_SEC = float(os.getenv("CPUMONITORJR_ROTATE_SEC", "10"))
+NODE_KEY = os.getenv("CPUMONITORJR_NODE_KEY", "").encode()  # shared secret signing node packets
+NODE_EXPIRY_SEC = 30.0  # a node not heard from for this long leaves the rotation
+MAX_NODES = 255
+SD_LISTEN_FDS_START = 3  # first file descriptor passed by systemd socket activation
+STATUS_EVERY_SEC = 10.0  # how often the systemd STATUS= line is refreshed
+WATCHDOG_STALL_TICKS = 3  # send periods without a completed tick before the watchdog ping is withheld
+TEMP_INCLUDE = os.getenv("CPUMONITORJR_TEMP_INCLUDE", "")  # e.g. "coretemp/package*,k10temp/tctl"
+TEMP_EXCLUDE = os.getenv("CPUMONITORJR_TEMP_EXCLUDE", "")  # e.g. "coretemp/core*"
 
 if WS_INTERVAL_SEC < MIN_INTERVAL_SEC:
     WS_INTERVAL_SEC = MIN_INTERVAL_SEC
 
+ADAPTIVE = os.getenv("CPUMONITORJR_ADAPTIVE", "0") in ("1", "true", "True")
+ADAPTIVE_MIN_INTERVAL_SEC = max(MIN_INTERVAL_SEC, float(os.getenv("CPUMONITORJR_ADAPTIVE_MIN", str(WS_INTERVAL_SEC))))
+ADAPTIVE_MAX_INTERVAL_SEC = max(ADAPTIVE_MIN_INTERVAL_SEC, float(os.getenv("CPUMONITORJR_ADAPTIVE_MAX", "5.0")))
+ADAPTIVE_THRESHOLD = float(os.getenv("CPUMONITORJR_ADAPTIVE_THRESHOLD", "5.0"))  # percentage points / °C
+BACKPRESSURE_SEND_FRACTION = 0.5  # a send slower than this fraction of the period means the display is behind
+BACKPRESSURE_BUFFERED_BYTES = 8192  # unsent bytes in the socket buffer that mean the display is behind
+METRICS_PORT = int(os.getenv("CPUMONITORJR_METRICS_PORT", "0") or 0)  # 0 disables the HTTP endpoint
+METRICS_ADDRESS = os.getenv("CPUMONITORJR_METRICS_ADDRESS", "127.0.0.1")
+METRICS_SOCKET = os.getenv("CPUMONITORJR_METRICS_SOCKET", "")  # empty disables the Unix socket endpoint
+CONTROL_SOCKET = os.getenv("CPUMONITORJR_CONTROL_SOCKET", "")  # empty disables the control socket
+DEFAULT_CONTROL_SOCKET = "/run/cpumonitorjr/control"  # where cpumonitorjr.service puts it
+CONNECT_TIMEOUT_SEC = 5.0
+RECONNECT_BACKOFF_MIN_SEC = 0.5  # first retry delay after a failed connect; doubles per failure
+RECONNECT_BACKOFF_MAX_SEC = 60.0
+
+# Connection circuit states (see DisplayTarget.circuit)
+CIRCUIT_CLOSED = "closed"  # connected, or free to connect
+CIRCUIT_OPEN = "open"  # last connect failed; waiting out the backoff delay
+CIRCUIT_HALF_OPEN = "half-open"  # backoff over; one trial connect in progress
+
 # =============================================================================
-TARGET_ESP32_IP: Optional[str] = None
-IP_LOCK = asyncio.Lock()
 SHUTDOWN = asyncio.Event()
-SEND_TIME_NOW = True
-SEND_NAME_AND_IPS_NOW = True
-LAST_TIME_SENT_AT = datetime.min
-# Track connection state to match VB.NET's first-time send behavior
-FIRST_CONNECTION_TO_IP = True
 
-# Persistent websocket state
-WS = None  # type: Optional[websockets.WebSocketClientProtocol]
-WS_IP: Optional[str] = None
+
+# -----------------------------------------------------------------------------
+# Display targets (one per ESP32 that has advertised itself)
+# -----------------------------------------------------------------------------
+class DisplayTarget:
+    """
+    State for one ESP32 display.
+
+    Each display keeps its own persistent websocket, its own copy of the
+    VB.NET time/info handshake flags and its own send queue, so that one slow
+    or unreachable display never holds up the others.
+    """
+
+    def __init__(self, ip: str, port: int = DEFAULT_WS_PORT):
+        self.ip = ip
+        self.port = port
+        self.last_advertised = time.monotonic()
+        self.pinned = False  # added or pinned through the control socket; never expired
+        self.ws = None  # type: Optional[websockets.WebSocketClientProtocol]
+        self.send_time_now = True
+        self.send_name_and_ips_now = True
+        self.last_time_sent_at = datetime.min
+        # Track connection state to match VB.NET's first-time send behavior
+        self.first_connection_to_ip = True
+        # Holds at most the latest stats frame; older unsent frames are replaced
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self.task: Optional[asyncio.Task] = None
+        # Delta frame state: per-core bytes of the last frame the display applied
+        self.last_cores: Optional[bytes] = None
+        self.frames_since_keyframe = 0
+        # Adaptive mode backpressure: ticks to skip after each send
+        self.skip_ticks = 0
+        self.skip_left = 0
+        # Send the load history after the handshake of each (re)connect
+        self.send_history_now = True
+        # Connection supervisor state: the send path only reads these
+        self.connector: Optional[asyncio.Task] = None
+        self.circuit = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.connect_attempts = 0
+        self.connect_failures = 0
+        self.connects = 0
+        self.connect_latency_total = 0.0
+        self.last_connect_latency = 0.0
+        self.retry_in = 0.0
+        self.wake = asyncio.Event()  # cuts the supervisor's backoff short
+
+    def can_send(self) -> bool:
+        """True when the websocket is up; never blocks and never connects."""
+        return self.circuit == CIRCUIT_CLOSED and self.ws is not None and not self.ws.closed
+
+    def connect_succeeded(self, latency: float):
+        self.circuit = CIRCUIT_CLOSED
+        self.consecutive_failures = 0
+        self.connects += 1
+        self.connect_latency_total += latency
+        self.last_connect_latency = latency
+
+    def connect_failed(self) -> float:
+        """Open the circuit and return the jittered backoff delay before the next attempt."""
+        self.circuit = CIRCUIT_OPEN
+        self.connect_failures += 1
+        self.consecutive_failures += 1
+        delay = min(RECONNECT_BACKOFF_MAX_SEC, RECONNECT_BACKOFF_MIN_SEC * 2 ** min(self.consecutive_failures - 1, 16))
+        # Spread retries over the upper half of the window so displays that
+        # dropped together do not all retry together
+        self.retry_in = random.uniform(delay / 2, delay)
+        return self.retry_in
+
+    def readvertised(self) -> bool:
+        """
+        The display advertised itself again, so it is up (e.g. it rebooted):
+        end a backoff now with a half-open trial connect and restart the
+        backoff from its minimum. Returns True if a backoff was cut short.
+        """
+        self.last_advertised = time.monotonic()
+        if self.circuit != CIRCUIT_OPEN:
+            return False
+        self.circuit = CIRCUIT_HALF_OPEN
+        self.consecutive_failures = 0
+        self.retry_in = 0.0
+        self.wake.set()
+        return True
+
+    def connection_stats(self) -> Dict[str, object]:
+        return {
+            "circuit": self.circuit,
+            "connected": self.can_send(),
+            "connects": self.connects,
+            "attempts": self.connect_attempts,
+            "failures": self.connect_failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_connect_ms": round(self.last_connect_latency * 1000, 3),
+            "avg_connect_ms": round(self.connect_latency_total / self.connects * 1000, 3) if self.connects else 0.0,
+        }
+
+    def offer(self, stats_frames: List[bytes], taken_at: float = 0.0):
+        """Queue one tick's stats frame(s), replacing any the display has not taken yet."""
+        if self.skip_left > 0:
+            # Backing off; this display has not kept up with recent frames
+            self.skip_left -= 1
+            return
+        if self.queue.full():
+            try:
+                self.queue.get_nowait()
+            except asyncio.QueueEmpty:
+                pass
+        self.queue.put_nowait((stats_frames, taken_at))
+
+    def encode_stats(self, stats_frame: bytes) -> bytes:
+        """
+        Return what to send this display for a full stats frame: the frame
+        itself, or a delta frame against the last frame it received when
+        delta frames are enabled. A full frame (keyframe) is sent after a
+        (re)connect, when the core count changes, every KEYFRAME_EVERY frames
+        and whenever the delta would not be smaller.
+        """
+        if not DELTA_FRAMES or stats_frame[0] != 2:
+            return stats_frame
+        cores = stats_frame[8:]
+        frame = None
+        if (self.last_cores is not None and len(self.last_cores) == len(cores)
+                and self.frames_since_keyframe < KEYFRAME_EVERY - 1):
+            frame = build_delta_frame(stats_frame, self.last_cores)
+            if len(frame) >= len(stats_frame):
+                frame = None
+        if frame is None:
+            frame = stats_frame
+            self.frames_since_keyframe = 0
+        else:
+            self.frames_since_keyframe += 1
+        self.last_cores = cores
+        return frame
+
+    def note_send(self, seconds: float, buffered: int, period: float):
+        """
+        Adaptive mode backpressure: after a stats send that took too long or
+        left too many bytes unsent, double the number of ticks this display
+        skips (up to the maximum interval); after a healthy send, step back
+        towards sending every tick.
+        """
+        if seconds > period * BACKPRESSURE_SEND_FRACTION or buffered > BACKPRESSURE_BUFFERED_BYTES:
+            most = max(0, int(ADAPTIVE_MAX_INTERVAL_SEC / period) - 1)
+            self.skip_ticks = min(most, max(1, self.skip_ticks * 2))
+        elif self.skip_ticks:
+            self.skip_ticks -= 1
+        self.skip_left = self.skip_ticks
+
+
+# Registry of known displays, keyed by IP address
+TARGETS: Dict[str, DisplayTarget] = {}
+
+
+# -----------------------------------------------------------------------------
+# Metrics (the agent's own hot-path timings and counters)
+# -----------------------------------------------------------------------------
+class Histogram:
+    """
+    Fixed-bucket histogram. observe() is one bisect and three increments, so
+    it is cheap enough to call on every sample, frame and send; buckets are
+    only made cumulative when the metrics are rendered.
+    """
+
+    # 25 us .. 5 s
+    SECONDS = (25e-6, 50e-6, 100e-6, 250e-6, 500e-6, 1e-3, 2.5e-3, 5e-3, 10e-3, 25e-3, 50e-3,
+               100e-3, 250e-3, 500e-3, 1.0, 2.5, 5.0)
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: Tuple[float, ...] = SECONDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def render(self, lines: List[str], name: str, labels: str = ""):
+        sep = "," if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels}{sep}le="{bound!r}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels}{sep}le="+Inf"}} {self.count}')
+        braces = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_count{braces} {self.count}")
+        lines.append(f"{name}_sum{braces} {self.sum!r}")
+
+
+class Metrics:
+    """
+    The agent's instrumentation. Histograms and counters are updated in
+    place by the sampler thread (sample durations) and the event loop
+    (everything else); render() produces OpenMetrics text, reading the
+    display and scheduler state directly at scrape time.
+    """
+
+    SAMPLE_SOURCES = ("cpu", "mem", "temps")
+    DISCOVERY_RESULTS = ("accepted", "duplicate", "rate_limited", "wrong_source", "malformed")
+
+    def __init__(self):
+        self.sample_seconds = {source: Histogram() for source in self.SAMPLE_SOURCES}
+        self.encode_seconds = Histogram()
+        self.send_seconds = Histogram()
+        self.connect_seconds = Histogram()
+        self.tick_lateness_seconds = Histogram()
+        self.discovery_packets = {result: 0 for result in self.DISCOVERY_RESULTS}
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        def family(name: str, kind: str, help_text: str, unit: str = ""):
+            lines.append(f"# TYPE {name} {kind}")
+            if unit:
+                lines.append(f"# UNIT {name} {unit}")
+            lines.append(f"# HELP {name} {help_text}")
+
+        family("cpumonitorjr_sample_duration_seconds", "histogram", "Time to read one sample, per source.", "seconds")
+        for source, hist in self.sample_seconds.items():
+            hist.render(lines, "cpumonitorjr_sample_duration_seconds", f'source="{source}"')
+        family("cpumonitorjr_encode_duration_seconds", "histogram", "Time to group and encode one tick's stats frames.", "seconds")
+        self.encode_seconds.render(lines, "cpumonitorjr_encode_duration_seconds")
+        family("cpumonitorjr_send_duration_seconds", "histogram", "Time to send one tick's stats frames to a display.", "seconds")
+        self.send_seconds.render(lines, "cpumonitorjr_send_duration_seconds")
+        family("cpumonitorjr_connect_duration_seconds", "histogram", "Time to open a display's websocket.", "seconds")
+        self.connect_seconds.render(lines, "cpumonitorjr_connect_duration_seconds")
+        family("cpumonitorjr_tick_lateness_seconds", "histogram", "Send timer wake-up time past its deadline.", "seconds")
+        self.tick_lateness_seconds.render(lines, "cpumonitorjr_tick_lateness_seconds")
+
+        family("cpumonitorjr_ticks", "counter", "Send timer ticks.")
+        lines.append(f"cpumonitorjr_ticks_total {SCHEDULER.ticks}")
+        family("cpumonitorjr_missed_ticks", "counter", "Send timer deadlines skipped because a tick overran.")
+        lines.append(f"cpumonitorjr_missed_ticks_total {SCHEDULER.missed}")
+        family("cpumonitorjr_send_interval_seconds", "gauge", "Current send interval.", "seconds")
+        lines.append(f"cpumonitorjr_send_interval_seconds {SCHEDULER.period!r}")
+        family("cpumonitorjr_discovery_packets", "counter", "UDP discovery packets received.")
+        for result, count in self.discovery_packets.items():
+            lines.append(f'cpumonitorjr_discovery_packets_total{{result="{result}"}} {count}')
+
+        targets = list(TARGETS.values())
+        family("cpumonitorjr_displays", "gauge", "Displays that have advertised themselves.")
+        lines.append(f"cpumonitorjr_displays {len(targets)}")
+        family("cpumonitorjr_display_connected", "gauge", "1 if the display's websocket is up, per display and circuit state.")
+        for t in targets:
+            lines.append(f'cpumonitorjr_display_connected{{display="{t.ip}",circuit="{t.circuit}"}} {int(t.can_send())}')
+        family("cpumonitorjr_connects", "counter", "Successful websocket connects, per display.")
+        for t in targets:
+            lines.append(f'cpumonitorjr_connects_total{{display="{t.ip}"}} {t.connects}')
+        family("cpumonitorjr_connect_failures", "counter", "Failed websocket connects, per display.")
+        for t in targets:
+            lines.append(f'cpumonitorjr_connect_failures_total{{display="{t.ip}"}} {t.connect_failures}')
+
+        if NODE_AGGREGATOR is not None:
+            family("cpumonitorjr_node_packets", "counter", "Node sample packets received by this aggregator.")
+            for result, count in NODE_AGGREGATOR.packets.items():
+                lines.append(f'cpumonitorjr_node_packets_total{{result="{result}"}} {count}')
+            family("cpumonitorjr_nodes", "gauge", "Nodes reporting to this aggregator.")
+            lines.append(f"cpumonitorjr_nodes {len(NODE_AGGREGATOR.nodes)}")
+
+        family("cpumonitorjr_log_records_dropped", "counter", "Log records dropped because the log queue was full.")
+        lines.append(f"cpumonitorjr_log_records_dropped_total {_LOG_QUEUE_HANDLER.dropped if _LOG_QUEUE_HANDLER else 0}")
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+METRICS = Metrics()
 
 
 def _is_nologging_flag_present() -> bool:
@@ -97,6 +608,94 @@ def _is_nologging_flag_present() -> bool:
         return False
 
 
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Hands records to the logging thread through a bounded queue. The caller
+    never blocks: when the queue is full the record is dropped and counted,
+    and the next record that fits is preceded by a note of how many were lost.
+
+    Records are queued unformatted (their arguments are only merged into the
+    message on the logging thread), so callers pass immutable arguments.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+        self._reported = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            lost = self.dropped - self._reported
+            if lost:
+                self.queue.put_nowait(logging.makeLogRecord({
+                    "name": record.name, "levelno": logging.WARNING, "levelname": "WARNING",
+                    "msg": "%d log record(s) dropped, the log queue was full", "args": (lost,)}))
+                self._reported += lost
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JournaldHandler(logging.Handler):
+    """Writes records to the systemd journal over its native datagram socket."""
+
+    PRIORITIES = {logging.CRITICAL: 2, logging.ERROR: 3, logging.WARNING: 4, logging.INFO: 6, logging.DEBUG: 7}
+
+    def __init__(self, path: str = JOURNALD_SOCKET, identifier: str = "CPUMonitorJr"):
+        super().__init__()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        try:
+            self._sock.connect(path)
+        except OSError:
+            self._sock.close()
+            raise
+        self._identifier = identifier
+
+    @staticmethod
+    def _field(key: str, value: str) -> bytes:
+        data = value.encode("utf-8", errors="replace")
+        if b"\n" in data:
+            # Multi-line values use the binary form: KEY, newline, le64 length, value
+            return key.encode() + b"\n" + len(data).to_bytes(8, "little") + data + b"\n"
+        return key.encode() + b"=" + data + b"\n"
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            priority = self.PRIORITIES.get(record.levelno, 6)
+            self._sock.send(self._field("MESSAGE", self.format(record))
+                            + self._field("PRIORITY", str(priority))
+                            + self._field("SYSLOG_IDENTIFIER", self._identifier))
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        self._sock.close()
+        super().close()
+
+
+def _probe_syslog(address: str):
+    """
+    Raise OSError unless the syslog socket accepts a connection (as a
+    datagram or a stream socket, like SysLogHandler). SysLogHandler itself
+    does not fail when the socket is missing; it then prints a traceback for
+    every record.
+    """
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as probe:
+            probe.connect(address)
+    except OSError:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+            probe.connect(address)
+
+
+# The logging thread and its queue handler (None when logging synchronously)
+_LOG_LISTENER: Optional[logging.handlers.QueueListener] = None
+_LOG_QUEUE_HANDLER: Optional[DroppingQueueHandler] = None
+
+
 def setup_logging(enabled: bool = True):
     """Configure logging.
 
@@ -106,10 +705,14 @@ def setup_logging(enabled: bool = True):
     When enabled is True:
       - Ensure the log directory exists.
       - Ensure the log file exists (create if missing).
-      - Configure a rotating file handler and optional syslog handler.
+      - Configure a rotating file handler and an optional syslog (or journald) handler,
+        run by a background thread unless CPUMONITORJR_LOG_QUEUE_SIZE=0.
     """
+    global _LOG_LISTENER, _LOG_QUEUE_HANDLER
+
     logger = logging.getLogger("CPUMonitorJr")
     # Clear any existing handlers to avoid duplicates if reconfigured
+    stop_logging()
     logger.handlers = []
 
     if not enabled:
@@ -128,26 +731,84 @@ def setup_logging(enabled: bool = True):
     logger.propagate = False
     logger.setLevel(logging.INFO)
 
+    handlers: List[logging.Handler] = []
+    problems: List[str] = []
+
     fh = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=10*1024*1024, backupCount=5)
     fh.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s", "%Y-%m-%d %H:%M:%S"))
-    logger.addHandler(fh)
+    handlers.append(fh)
 
-    # Try syslog if present (Linux). Safe to ignore on Windows or when not available.
-    if os.name != "nt":
+    # Journald if asked for, otherwise syslog if present (Linux). Safe to ignore when not available.
+    if LOG_JOURNALD:
         try:
+            jh = JournaldHandler()
+            jh.setFormatter(logging.Formatter("%(message)s"))
+            handlers.append(jh)
+        except OSError as e:
+            problems.append(f"Journald not available, continuing without it: {e}")
+    elif os.name != "nt":
+        try:
+            _probe_syslog("/dev/log")
             sh = logging.handlers.SysLogHandler(address="/dev/log")
             sh.setFormatter(logging.Formatter("CPUMonitorJr: %(message)s"))
-            logger.addHandler(sh)
+            handlers.append(sh)
         except Exception as e:
             # If syslog isn't available, continue without it but record once in the file log
-            logger.warning(f"Syslog not available, continuing without syslog: {e}")
+            problems.append(f"Syslog not available, continuing without syslog: {e}")
+
+    if LOG_QUEUE_SIZE:
+        _LOG_QUEUE_HANDLER = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+        _LOG_LISTENER = logging.handlers.QueueListener(_LOG_QUEUE_HANDLER.queue, *handlers)
+        _LOG_LISTENER.start()
+        logger.addHandler(_LOG_QUEUE_HANDLER)
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+
+    for problem in problems:
+        logger.warning(problem)
     return logger
 
 
+def stop_logging():
+    """Stop the logging thread, after it has written every queued record."""
+    global _LOG_LISTENER, _LOG_QUEUE_HANDLER
+    if _LOG_LISTENER is not None:
+        _LOG_LISTENER.stop()
+        for handler in _LOG_LISTENER.handlers:
+            handler.close()
+        _LOG_LISTENER = None
+    if _LOG_QUEUE_HANDLER is not None:
+        logging.getLogger("CPUMonitorJr").removeHandler(_LOG_QUEUE_HANDLER)
+        _LOG_QUEUE_HANDLER = None
+
+
 # -----------------------------------------------------------------------------
 # Helpers for rounding (MidpointRounding.AwayFromZero)
 # -----------------------------------------------------------------------------
+def _round_tenths(x: float) -> Optional[int]:
+    """
+    x rounded half up to one decimal, as a whole number of tenths, in plain
+    integer arithmetic. Returns None when x*10 is within 0.0001 of a
+    midpoint, huge or not finite: there only the decimal rounding of str(x)
+    below gives the same answer as VB (e.g. 0.15, stored as 0.1499..., must
+    round to 0.2).
+    """
+    scaled = x * 10.0
+    if -1e7 < scaled < 1e7:
+        tenths = math.floor(scaled)
+        frac = scaled - tenths
+        if frac < 0.4999:
+            return tenths
+        if frac > 0.5001:
+            return tenths + 1
+    return None
+
+
 def round_half_up_1dp(x: float) -> float:
+    tenths = _round_tenths(x)
+    if tenths is not None:
+        return tenths / 10
     return float(Decimal(str(x)).quantize(Decimal("0.1"), rounding=ROUND_HALF_UP))
 
 
@@ -158,6 +819,10 @@ def _whole_dec(x: float) -> Tuple[int, int]:
       whole = int(one-decimal value) % 256
       dec   = int(one-decimal value * 10) - whole * 10
     """
+    tenths = _round_tenths(x)
+    if tenths is not None:
+        whole = tenths // 10 if tenths >= 0 else -(-tenths // 10)
+        return whole % 256, tenths % 10
     x1 = round_half_up_1dp(x)
     whole = int(x1) % 256
     dec = int(round(x1 * 10)) - whole * 10
@@ -168,13 +833,14 @@ def _whole_dec(x: float) -> Tuple[int, int]:
 # -----------------------------------------------------------------------------
 # Network address helpers (computer name, LAN IP, external IP)
 # -----------------------------------------------------------------------------
-def get_lan_ip() -> str:
+def get_lan_ip(if_addrs: Optional[Dict] = None) -> str:
     """
     Get the first non-loopback IPv4 address (skip docker-like interfaces).
     VB chose the first IPv4 for the hostname; this aligns closely.
+    if_addrs may pass in an already fetched psutil.net_if_addrs() result.
     """
     try:
-        for iface, addrs in psutil.net_if_addrs().items():
+        for iface, addrs in (if_addrs if if_addrs is not None else psutil.net_if_addrs()).items():
             for a in addrs:
                 if getattr(a, "family", None) == socket.AF_INET and a.address != "127.0.0.1":
                     if iface.lower().startswith(("docker", "br-", "veth")):
@@ -188,13 +854,16 @@ def get_lan_ip() -> str:
 def get_external_ip(timeout=2.5) -> str:
     """
     VB used WebClient to https://api.ipify.org; do the same via urllib here.
+    Blocking; returns EXTERNAL_IP_UNAVAILABLE on any failure.
     """
     import urllib.request
+    if not EXTERNAL_IP_URL:
+        return EXTERNAL_IP_UNAVAILABLE
     try:
         with urllib.request.urlopen(EXTERNAL_IP_URL, timeout=timeout) as resp:
-            return resp.read().decode("ascii").strip()
+            return resp.read().decode("ascii").strip() or EXTERNAL_IP_UNAVAILABLE
     except Exception:
-        return "External address not available"
+        return EXTERNAL_IP_UNAVAILABLE
 
 
 # -----------------------------------------------------------------------------
@@ -238,15 +907,179 @@ def _temps_from_wmi_windows() -> List[float]:
         return []
 
 
-def get_cpu_temperatures() -> Tuple[float, float]:
+# -----------------------------------------------------------------------------
+# CPU thermal sensor index
+# -----------------------------------------------------------------------------
+def _sensor_patterns(value: str) -> List[str]:
+    return [p.strip().lower() for p in value.split(",") if p.strip()]
+
+
+def _read_sysfs_text(path: str) -> str:
+    try:
+        with open(path, "r", encoding="ascii", errors="ignore") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+class ThermalSensorIndex:
     """
-    Returns (average_temp_c, max_temp_c) rounded half-up to one decimal place.
-    Follows VB intent of aggregating a set of temperature sensors.
+    Index of the CPU temperature inputs.
+
+    Discovery runs once: it lists /sys/class/hwmon (and /sys/class/thermal as
+    a fallback), reading only the static name/label/type attributes, and keeps
+    the temperature inputs of CPU sensors open. Each sensor is identified as
+    "<chip>/<label>" (for example "coretemp/Package id 0" or "k10temp/Tctl"),
+    or "thermal/<type>" for thermal zones, and matched case-insensitively
+    against the include/exclude patterns. Without include patterns the first
+    tier in DEFAULT_TIERS that has any sensor is used, so NVMe, drivetemp,
+    wifi and ACPI readings never get mixed into the CPU average and maximum.
+
+    read() only touches the indexed inputs. The index is rebuilt when a read
+    fails or when a hwmon or thermal device is added or removed (checked every
+    HOTPLUG_CHECK_SEC by listing the class directories).
     """
-    readings = _temps_from_psutil()
-    if not readings:
-        readings = _temps_from_wmi_windows()
 
+    DEFAULT_TIERS = (
+        ("coretemp/*", "k10temp/*", "zenpower/*", "cpu_thermal/*", "cpu-thermal/*"),
+        ("thermal/x86_pkg_temp", "thermal/cpu*", "thermal/soc*"),
+        ("acpitz/*", "thermal/acpitz"),
+    )
+    HOTPLUG_CHECK_SEC = 30.0
+
+    def __init__(self, hwmon_root: str = "/sys/class/hwmon", thermal_root: str = "/sys/class/thermal",
+                 include: str = TEMP_INCLUDE, exclude: str = TEMP_EXCLUDE):
+        self._hwmon_root = hwmon_root
+        self._thermal_root = thermal_root
+        self._include = _sensor_patterns(include)
+        self._exclude = _sensor_patterns(exclude)
+        self._fds: List[int] = []
+        self.names: List[str] = []
+        self._readings: List[float] = []
+        self._signature: Tuple[List[str], List[str]] = ([], [])
+        self._next_hotplug_check = 0.0
+        self._stale = False
+        self.rebuild()
+
+    def _list_devices(self) -> Tuple[List[str], List[str]]:
+        devices = []
+        for root in (self._hwmon_root, self._thermal_root):
+            try:
+                devices.append(sorted(os.listdir(root)))
+            except OSError:
+                devices.append([])
+        return devices[0], devices[1]
+
+    def _candidates(self, hwmon: List[str], zones: List[str]) -> List[Tuple[str, str]]:
+        """Return (name, input path) for every temperature sensor, without reading any of them."""
+        found: List[Tuple[str, str]] = []
+        for chip in hwmon:
+            chip_dir = os.path.join(self._hwmon_root, chip)
+            chip_name = _read_sysfs_text(os.path.join(chip_dir, "name")) or chip
+            for base in (chip_dir, os.path.join(chip_dir, "device")):
+                try:
+                    entries = sorted(os.listdir(base))
+                except OSError:
+                    continue
+                for entry in entries:
+                    if entry.startswith("temp") and entry.endswith("_input"):
+                        sensor = entry[:-len("_input")]
+                        label = _read_sysfs_text(os.path.join(base, sensor + "_label")) or sensor
+                        found.append((f"{chip_name}/{label}", os.path.join(base, entry)))
+        for zone in zones:
+            if zone.startswith("thermal_zone"):
+                zone_dir = os.path.join(self._thermal_root, zone)
+                zone_type = _read_sysfs_text(os.path.join(zone_dir, "type")) or zone
+                found.append((f"thermal/{zone_type}", os.path.join(zone_dir, "temp")))
+        return found
+
+    @staticmethod
+    def _matches(name: str, patterns) -> bool:
+        name = name.lower()
+        return any(fnmatch.fnmatchcase(name, p) for p in patterns)
+
+    def rebuild(self):
+        """(Re)discover the CPU sensors and open their input files."""
+        logger = logging.getLogger("CPUMonitorJr")
+        self.close()
+        self._stale = False
+        self._signature = self._list_devices()
+        self._next_hotplug_check = time.monotonic() + self.HOTPLUG_CHECK_SEC
+        candidates = self._candidates(*self._signature)
+
+        if self._include:
+            selected = [c for c in candidates if self._matches(c[0], self._include)]
+        else:
+            selected = []
+            for tier in self.DEFAULT_TIERS:
+                selected = [c for c in candidates if self._matches(c[0], tier)]
+                if selected:
+                    break
+        selected = [c for c in selected if not self._matches(c[0], self._exclude)]
+
+        for name, path in selected:
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                int(os.pread(fd, 32, 0))
+            except (OSError, ValueError):
+                # Leave sensors that cannot be read out of the index
+                os.close(fd)
+                continue
+            self._fds.append(fd)
+            self.names.append(name)
+
+        if self.names:
+            logger.info(f"CPU temperature sensors: {', '.join(self.names)}")
+        else:
+            logger.info("No CPU temperature sensors found")
+
+    def _hotplugged(self) -> bool:
+        now = time.monotonic()
+        if now < self._next_hotplug_check:
+            return False
+        self._next_hotplug_check = now + self.HOTPLUG_CHECK_SEC
+        return self._list_devices() != self._signature
+
+    def read(self) -> List[float]:
+        """
+        Read the indexed inputs in degrees C. The returned list is reused
+        between calls.
+        """
+        if self._stale or self._hotplugged():
+            self.rebuild()
+        readings = self._readings
+        readings.clear()
+        failed = False
+        for fd in self._fds:
+            try:
+                readings.append(int(os.pread(fd, 32, 0)) / 1000.0)
+            except (OSError, ValueError):
+                failed = True
+        if failed:
+            # A sensor went away (module unload, device removal); rediscover
+            # before the next read
+            self._stale = True
+        return readings
+
+    def close(self):
+        for fd in self._fds:
+            with contextlib.suppress(OSError):
+                os.close(fd)
+        self._fds = []
+        self.names = []
+
+
+_THERMAL_INDEX: Optional[ThermalSensorIndex] = None
+
+
+def aggregate_temperatures(readings: List[float]) -> Tuple[float, float]:
+    """
+    Returns (average_temp_c, max_temp_c) rounded half-up to one decimal place,
+    or (0.0, 0.0) when there are no readings.
+    """
     if not readings:
         return 0.0, 0.0
 
@@ -255,300 +1088,2465 @@ def get_cpu_temperatures() -> Tuple[float, float]:
     return avg, mx
 
 
-# -----------------------------------------------------------------------------
-# Frame builders (match VB's byte-level protocol)
-# -----------------------------------------------------------------------------
-def build_time_frame(now: datetime) -> bytes:
+def get_cpu_temperatures() -> Tuple[float, float]:
     """
-    Time frame layout (VB comment):
-      byte 0 = 0 (time stream)
-      byte 1 = year (current year - 2000)
-      byte 2 = month
-      byte 3 = day
-      byte 4 = day of week (Sunday = 0)
-      byte 5 = hour
-      byte 6 = minute
-      byte 7 = second
+    Returns (average_temp_c, max_temp_c) rounded half-up to one decimal place.
+    Follows VB intent of aggregating a set of temperature sensors.
     """
-    dow = (now.weekday() + 1) % 7  # Python Mon=0..Sun=6 -> Sunday=0
-    y = max(0, min(255, now.year - 2000))
-    return bytes([0, y, now.month, now.day, dow, now.hour, now.minute, now.second])
+    global _THERMAL_INDEX
+    if sys.platform.startswith("linux") and os.path.isdir("/sys/class"):
+        # Read only the indexed CPU sensors rather than every sensor psutil knows
+        if _THERMAL_INDEX is None:
+            _THERMAL_INDEX = ThermalSensorIndex()
+        return aggregate_temperatures(_THERMAL_INDEX.read())
+
+    readings = _temps_from_psutil()
+    if not readings:
+        readings = _temps_from_wmi_windows()
+
+    return aggregate_temperatures(readings)
+
+
+# -----------------------------------------------------------------------------
+# Samplers (memory percent, per-core load and temperatures for one stats frame)
+# -----------------------------------------------------------------------------
+def observe_sample_durations(mem: float, cpu: float, temps: float):
+    hists = METRICS.sample_seconds
+    hists["mem"].observe(mem)
+    hists["cpu"].observe(cpu)
+    hists["temps"].observe(temps)
 
 
-def build_computer_info_frame() -> bytes:
+class PsutilSampler:
     """
-    Computer info frame layout (VB comment):
-      byte 0               = 1 (Computer name and IP address stream)
-      byte 1 ... byte n    = Computer name (ASCII)
-      byte n + 1           = ';'
-      byte n + 2 ... byte m= LAN IP Address (ASCII)
-      byte m + 1           = ';'
-      byte m + 2 ... byte z= External IP Address (ASCII)
-      final byte           = ';'
+    Portable sampler built on psutil (the original sampling path).
+    sample() returns (mem_percent, avg_temp, max_temp, per_core), the values
+    build_stats_frame consumes. cpu_ids holds the CPU number of each per_core
+    entry (the online CPUs, in /proc/stat order).
     """
-    name = socket.gethostname() or "unknown"
-    lan = get_lan_ip()
-    external = get_external_ip()
-    payload = f"{name};{lan};{external};"
-    return bytes([1]) + payload.encode("ascii", errors="ignore")
 
+    name = "psutil"
 
-def build_stats_frame(mem_percent: float, avg_temp: float, max_temp: float, per_core: List[float]) -> bytes:
+    def __init__(self):
+        self.cpu_ids: List[int] = []
+
+    def sample(self) -> Tuple[float, float, float, List[float]]:
+        t0 = time.perf_counter()
+        mem_percent = psutil.virtual_memory().percent
+        t1 = time.perf_counter()
+        per_core = psutil.cpu_percent(interval=None, percpu=True)
+        t2 = time.perf_counter()
+        avg_t, max_t = get_cpu_temperatures()
+        t3 = time.perf_counter()
+        observe_sample_durations(t1 - t0, t2 - t1, t3 - t2)
+        if len(self.cpu_ids) != len(per_core):
+            # First sample, or CPUs went on/offline
+            with contextlib.suppress(ValueError):
+                self.cpu_ids = _parse_cpu_list(_read_sysfs_text(os.path.join(SYSFS_CPU_ROOT, "online")))
+            if len(self.cpu_ids) != len(per_core):
+                self.cpu_ids = list(range(len(per_core)))
+        return mem_percent, avg_t, max_t, per_core
+
+    def close(self):
+        pass
+
+
+class ProcSampler:
     """
-    Stats frame layout (VB comment):
-      byte 0 = 2 (temperature and CPU data stream)
-      byte 1 = percent of memory used whole number
-      byte 2 = percent of memory used decimal
-      byte 3 = average temp whole number
-      byte 4 = average temp decimal
-      byte 5 = max temp whole number
-      byte 6 = max temp decimal
-      byte 7 = number of CPUs
-      byte 8 and on = CPU busy of each CPU (0..100, rounded)
+    Native Linux sampler.
+
+    /proc/stat, /proc/meminfo and the indexed CPU temperature inputs are opened once
+    and re-read in place with pread() at offset 0 into a preallocated buffer,
+    so a sample costs a handful of syscalls and no per-core namedtuples. The
+    values match psutil's: per-core busy percent is computed from the clamped
+    per-field deltas of /proc/stat with psutil's exact float arithmetic and
+    rounded to one decimal; memory percent is
+    (MemTotal - MemAvailable) / MemTotal rounded to one decimal; temperatures
+    come from a ThermalSensorIndex.
+
+    sample() returns (mem_percent, avg_temp, max_temp, per_core). The per_core
+    list is reused between calls; copy it if it must outlive the next sample.
+    cpu_ids holds the CPU number of each per_core entry (from the "cpuN"
+    lines, so it also follows CPUs going on/offline).
     """
-    m_whole, m_dec = _whole_dec(mem_percent)
-    a_whole, a_dec = _whole_dec(avg_temp)
-    x_whole, x_dec = _whole_dec(max_temp)
-
-    # Per VB: use logical CPUs; clamp values to [0, 100] and round
-    cores = [max(0, min(100, int(round(c)))) for c in per_core]
-    n = max(0, min(255, len(cores)))
-
-    frame = bytearray(8 + n)
-    frame[0] = 2
-    frame[1] = m_whole
-    frame[2] = m_dec
-    frame[3] = a_whole
-    frame[4] = a_dec
-    frame[5] = x_whole
-    frame[6] = x_dec
-    frame[7] = n
-    for i, v in enumerate(cores[:n]):
-        frame[8 + i] = v
-    return bytes(frame)
 
+    name = "proc"
 
-# -----------------------------------------------------------------------------
-# UDP discovery handler
-# -----------------------------------------------------------------------------
-class UDPDiscoveryProtocol(asyncio.DatagramProtocol):
-    def __init__(self, on_ip):
-        self.on_ip = on_ip
-        self.logger = logging.getLogger("CPUMonitorJr")
+    def __init__(self, proc_root: str = "/proc", hwmon_root: str = "/sys/class/hwmon",
+                 thermal_root: str = "/sys/class/thermal"):
+        self._stat_fd = os.open(os.path.join(proc_root, "stat"), os.O_RDONLY)
+        self._meminfo_fd = os.open(os.path.join(proc_root, "meminfo"), os.O_RDONLY)
+        self._buf = bytearray(64 * 1024)
+        self._clock_ticks = os.sysconf("SC_CLK_TCK")
+        self._prev: List[float] = []
+        self._per_core: List[float] = []
+        self._cpu_names: List[bytes] = []
+        self.cpu_ids: List[int] = []
+        self._thermal = ThermalSensorIndex(hwmon_root, thermal_root)
 
-    def datagram_received(self, data, addr):
-        try:
-            msg = data.decode("ascii", errors="ignore").strip()
-        except Exception:
-            return
-        
-        # The ESP32 sends "CPUMonitorJr;<IP>;<PORT>"
-        if msg.startswith("CPUMonitorJr"):
-            parts = msg.split(";")
-            if len(parts) >= 2:
-                ip = parts[1].strip()
-                self.logger.info(f"UDP discovery from {addr}: ESP32 IP={ip}")
-                asyncio.create_task(self.on_ip(ip))
+    def _read(self, fd: int) -> bytes:
+        """Re-read a whole procfs file from offset 0, growing the buffer if it fills."""
+        while True:
+            n = os.preadv(fd, [self._buf], 0)
+            if n < len(self._buf):
+                return bytes(memoryview(self._buf)[:n])
+            self._buf = bytearray(len(self._buf) * 2)
 
+    def _sample_cpu(self) -> List[float]:
+        data = self._read(self._stat_fd)
+        out = self._per_core
+        # The per-cpu "cpuN ..." lines follow the aggregate "cpu  ..." line
+        start = data.find(b"\ncpu") + 1
+        if not start:
+            out.clear()
+            self.cpu_ids = []
+            return out
+        end = data.find(b"\n", data.rfind(b"\ncpu") + 1)
+        fields = len(data[start:data.find(b"\n", start)].split()) - 1
+        ticks = self._clock_ticks
+        tokens = data[start:end].split()
+        names = tokens[::fields + 1]
+        cur = [int(t) / ticks for t in tokens if t[:1] != b"c"]
+        prev = self._prev
+        if names != self._cpu_names or len(prev) != len(cur):
+            # First sample, or CPUs went on/offline
+            self._cpu_names = names
+            self.cpu_ids = [int(name[3:]) for name in names]
+            prev = [0.0] * len(cur)
+        self._prev = cur
+        deltas = [c - p if c > p else 0 for c, p in zip(cur, prev)]
 
-async def _active_discovery_broadcast():
+        # Same arithmetic, in the same order, as psutil.cpu_percent(percpu=True)
+        out.clear()
+        for base in range(0, len(deltas), fields):
+            d = deltas[base:base + fields]
+            total = sum(d)
+            if fields > 8:
+                total -= d[8]  # guest (already counted in user)
+            if fields > 9:
+                total -= d[9]  # guest_nice (already counted in nice)
+            busy = total - d[3] - d[4]  # idle, iowait
+            out.append(round(busy / total * 100, 1) if total else 0.0)
+        return out
+
+    def _sample_memory(self) -> float:
+        data = self._read(self._meminfo_fd)
+
+        def field(key: bytes) -> Optional[int]:
+            i = data.find(key)
+            if i < 0:
+                return None
+            i += len(key)
+            return int(data[i:data.index(b"\n", i)].split()[0])
+
+        total = field(b"MemTotal:")
+        if not total:
+            return 0.0
+        avail = field(b"MemAvailable:")
+        if avail is None:
+            # Pre-3.14 kernels: approximate as psutil does
+            avail = (field(b"MemFree:") or 0) + (field(b"Buffers:") or 0) + (field(b"Cached:") or 0)
+        return round((total - avail) / total * 100, 1)
+
+    def sample(self) -> Tuple[float, float, float, List[float]]:
+        t0 = time.perf_counter()
+        mem_percent = self._sample_memory()
+        t1 = time.perf_counter()
+        per_core = self._sample_cpu()
+        t2 = time.perf_counter()
+        avg_t, max_t = aggregate_temperatures(self._thermal.read())
+        t3 = time.perf_counter()
+        observe_sample_durations(t1 - t0, t2 - t1, t3 - t2)
+        return mem_percent, avg_t, max_t, per_core
+
+    def close(self):
+        for fd in (self._stat_fd, self._meminfo_fd):
+            with contextlib.suppress(OSError):
+                os.close(fd)
+        self._thermal.close()
+
+
+def make_sampler(kind: str = SAMPLER_KIND):
     """
-    Optional: send a small UDP broadcast periodically to prompt the ESP32
-    to identify itself. Disabled by default; enable with CPUMONITORJR_SEND_DISCOVERY=1.
+    Create the configured sampler. "auto" uses the native /proc sampler on
+    Linux and falls back to psutil anywhere it cannot be opened.
     """
     logger = logging.getLogger("CPUMonitorJr")
-    msg = f"CPUMonitorJr-PC;{get_lan_ip()}"
-    data = msg.encode("ascii", errors="ignore")
-    
-    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    sock.setblocking(False)
-    
-    try:
-        while not SHUTDOWN.is_set():
-            try:
-                sock.sendto(data, ("255.255.255.255", UDP_LISTEN_PORT))
-                logger.debug("Sent active discovery broadcast")
-            except Exception as e:
-                logger.debug(f"Active discovery send failed: {e}")
-            # Send every 5 seconds
-            try:
-                await asyncio.wait_for(SHUTDOWN.wait(), timeout=5.0)
-            except asyncio.TimeoutError:
-                pass
-    finally:
-        sock.close()
+    if kind in ("auto", "proc") and sys.platform.startswith("linux"):
+        try:
+            return ProcSampler(proc_root=PROC_ROOT)
+        except OSError as e:
+            logger.warning(f"Native /proc sampler unavailable, using psutil: {e}")
+    return PsutilSampler()
 
 
 # -----------------------------------------------------------------------------
-# Send one data cycle (matching VB.NET's SendTimer_Elapsed logic)
+# CPU topology (folds per-CPU loads into physical core / CCX / socket groups)
 # -----------------------------------------------------------------------------
-async def send_one_cycle():
+def _parse_cpu_list(text: str) -> List[int]:
+    """Parse a sysfs CPU list such as "0-3,8-11" into [0, 1, 2, 3, 8, 9, 10, 11]."""
+    cpus: List[int] = []
+    for part in text.strip().split(","):
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        cpus.extend(range(int(lo), int(hi or lo) + 1))
+    return cpus
+
+
+class CpuTopology:
     """
-    Mimics VB.NET's SendTimer_Elapsed function:
-    - Opens WebSocket
-    - Sends appropriate data (time, info, or stats)
-    - Closes WebSocket
+    CPU topology read once from sysfs, with a precomputed index that folds the
+    per-logical-CPU loads (in /proc/stat order) into groups:
+      cpu    - no grouping (one bar per logical CPU)
+      core   - one bar per physical core (SMT siblings, thread_siblings_list)
+      ccx    - one bar per shared L3 cache (AMD CCX / Intel die)
+      socket - one bar per physical package
+    Groups are ordered by their lowest logical CPU and show the average load
+    of their members.
+
+    The group of every online CPU is read once, by load(); the index is
+    built for the CPU numbers passed to apply() (the sampler's cpu_ids, or
+    just a container's cpuset) and only rebuilt when they change. sysfs is
+    only read again when a CPU that was not online before shows up. The
+    SamplerThread does all of this, so no sysfs read blocks the event loop.
     """
-    logger = logging.getLogger("CPUMonitorJr")
-    global SEND_TIME_NOW, SEND_NAME_AND_IPS_NOW, LAST_TIME_SENT_AT, FIRST_CONNECTION_TO_IP
-    
-    # Ensure a persistent websocket is connected to the current target IP
-    ws = await ensure_ws_connected()
-    if ws is None:
-        return
 
-    try:
-        now = datetime.now()
+    MODES = ("cpu", "core", "ccx", "socket")
+
+    def __init__(self, mode: str = "cpu", sysfs_root: str = "/sys/devices/system/cpu"):
+        if mode not in self.MODES:
+            logging.getLogger("CPUMonitorJr").warning(f"Unknown core grouping {mode!r}, using cpu")
+            mode = "cpu"
+        self.mode = mode
+        self._root = sysfs_root
+        self._keys: Dict[int, object] = {}  # CPU number -> group key
+        self._cpu_ids: List[int] = []  # the CPU numbers the index is built for
+        self.index: List[int] = []
+        self.counts: List[int] = []
+        self._np_index = None
+        self._np_counts = None
+
+    def load(self):
+        """Read the topology from sysfs (falls back to no grouping when it cannot be read)."""
+        if self.mode == "cpu":
+            return
+        logger = logging.getLogger("CPUMonitorJr")
+        try:
+            self._load()
+            logger.info(f"Grouping {len(self._keys)} CPUs into {len(set(self._keys.values()))} {self.mode} groups")
+        except (OSError, ValueError) as e:
+            logger.warning(f"CPU topology unavailable, not grouping CPUs: {e}")
+            self.mode = "cpu"
+
+    def _group_key(self, cpu: int):
+        base = os.path.join(self._root, f"cpu{cpu}")
+        package = _read_sysfs_text(os.path.join(base, "topology", "physical_package_id")) or "0"
+        if self.mode == "socket":
+            return package
+        if self.mode == "ccx":
+            cache_dir = os.path.join(base, "cache")
+            for index in sorted(os.listdir(cache_dir)):
+                if _read_sysfs_text(os.path.join(cache_dir, index, "level")) == "3":
+                    return _read_sysfs_text(os.path.join(cache_dir, index, "shared_cpu_list")) or package
+            return package
+        siblings = _read_sysfs_text(os.path.join(base, "topology", "thread_siblings_list"))
+        return siblings or (package, _read_sysfs_text(os.path.join(base, "topology", "core_id")))
+
+    def _load(self):
+        online = _read_sysfs_text(os.path.join(self._root, "online"))
+        if not online:
+            raise OSError(f"cannot read {self._root}/online")
+        self._keys = {cpu: self._group_key(cpu) for cpu in _parse_cpu_list(online)}
+
+    def _build_index(self, cpu_ids: List[int]):
+        if any(cpu not in self._keys for cpu in cpu_ids):
+            # A CPU came online since the topology was read
+            with contextlib.suppress(OSError, ValueError):
+                self._load()
+        groups: Dict[object, int] = {}
+        index: List[int] = []
+        for cpu in cpu_ids:
+            # CPUs come in ascending order, so groups are numbered by their lowest CPU;
+            # one still unknown to sysfs is a group of its own
+            index.append(groups.setdefault(self._keys.get(cpu, ("cpu", cpu)), len(groups)))
+        counts = [0] * len(groups)
+        for g in index:
+            counts[g] += 1
+        self._cpu_ids = list(cpu_ids)
+        self.index = index
+        self.counts = counts
+        self._np_index = np.array(index) if np is not None else None
+        self._np_counts = np.array(counts, dtype=np.float64) if np is not None else None
+
+    def apply(self, per_core: List[float], cpu_ids: List[int]) -> List[float]:
+        """
+        Return the grouped loads (per_core itself when not grouping); cpu_ids
+        is the CPU number of each per_core entry.
+        """
+        if self.mode == "cpu" or len(cpu_ids) != len(per_core):
+            return per_core
+        if cpu_ids != self._cpu_ids:
+            self._build_index(cpu_ids)
+        if self._np_index is not None:
+            sums = np.bincount(self._np_index, weights=per_core, minlength=len(self.counts))
+            return (sums / self._np_counts).tolist()
+        sums = [0.0] * len(self.counts)
+        for g, load in zip(self.index, per_core):
+            sums[g] += load
+        return [total / count for total, count in zip(sums, self.counts)]
+
+
+# -----------------------------------------------------------------------------
+# cgroup v2 breakdown (top-N consumers, and the agent's own container limits)
+# -----------------------------------------------------------------------------
+def _read_cgroup_value(path: str) -> str:
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return ""
+
+
+def _cgroup_display_name(rel_path: str) -> str:
+    """A short name for a cgroup, e.g. "nginx" or "docker-3f2a9c1b7e44"."""
+    name = rel_path.rsplit("/", 1)[-1]
+    for suffix in (".service", ".scope"):
+        if name.endswith(suffix):
+            name = name[:-len(suffix)]
+    prefix, dash, ident = name.rpartition("-")
+    if dash and len(ident) == 64:
+        name = f"{prefix}-{ident[:12]}"  # container ids, as docker ps shows them
+    return name.encode("ascii", errors="replace").decode("ascii")[:CGROUP_NAME_LENGTH]
+
+
+class CgroupMonitor:
+    """
+    Reads the CPU time and memory of the cgroups under a cgroup v2 mount:
+    every cgroup CGROUP_DEPTH levels down (e.g. system.slice/nginx.service,
+    system.slice/docker-<id>.scope, user.slice/user-1000.slice) and any
+    shallower one without children, so no usage is counted twice. The tree
+    is rescanned every CGROUP_RESCAN_SEC; in between each cgroup's cpu.stat
+    and memory.current stay open and are re-read with pread(), and the CPU
+    load is the usage_usec delta since the previous read.
+
+    When the agent runs inside a container (the mount's root is itself a
+    non-root cgroup, i.e. has memory.current; CPUMONITORJR_CGROUP_LIMITS=auto)
+    percentages are of the container's own limits: memory.current against
+    memory.max replaces the host memory percent, and the root's own
+    usage_usec against its capacity (cpu.max, or the CPUs in
+    cpuset.cpus.effective) replaces the host CPU bars, see adjust().
+    """
+
+    def __init__(self, root: str = "/sys/fs/cgroup", depth: int = 2, top_n: int = 5,
+                 limits: str = "auto"):
+        self.root = root
+        self.depth = max(1, depth)
+        self.top_n = top_n
+        self.limits = limits == "on" or (limits == "auto" and os.path.exists(os.path.join(root, "memory.current")))
+        # relative path -> [cpu.stat fd, memory.current fd, last usage_usec, last read time]
+        self._groups: Dict[str, list] = {}
+        self._scanned_at = float("-inf")
+        self._mem_total = 0
+        self._cpu_capacity = 1.0
+        self._cpus: Optional[List[int]] = None
+        self._cpu_set: frozenset = frozenset()
+        self._own_memory_fd = -1
+        self._own_cpu_fd = -1
+        self._own_usage: Optional[int] = None
+        self._own_read_at = 0.0
+        self._own_used: Optional[float] = None  # CPUs the container kept busy between the last two samples
+
+    def _open(self, rel_path: str) -> Optional[list]:
+        path = os.path.join(self.root, rel_path)
+        try:
+            cpu_fd = os.open(os.path.join(path, "cpu.stat"), os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            mem_fd = os.open(os.path.join(path, "memory.current"), os.O_RDONLY)
+        except OSError:
+            mem_fd = -1  # memory controller not enabled for this subtree
+        return [cpu_fd, mem_fd, None, 0.0]
+
+    @staticmethod
+    def _close(entry: list):
+        for fd in entry[:2]:
+            if fd >= 0:
+                with contextlib.suppress(OSError):
+                    os.close(fd)
+
+    def _scan(self):
+        found: List[str] = []
+
+        def walk(rel_path: str, level: int):
+            try:
+                children = [e.name for e in os.scandir(os.path.join(self.root, rel_path)) if e.is_dir()]
+            except OSError:
+                return
+            for name in children:
+                child = f"{rel_path}/{name}" if rel_path else name
+                if level == self.depth:
+                    found.append(child)
+                else:
+                    before = len(found)
+                    walk(child, level + 1)
+                    if len(found) == before:
+                        found.append(child)
+
+        walk("", 1)
+        wanted = set(found)
+        for rel_path in [p for p in self._groups if p not in wanted]:
+            self._close(self._groups.pop(rel_path))
+        for rel_path in found:
+            if rel_path not in self._groups:
+                entry = self._open(rel_path)
+                if entry is not None:
+                    self._groups[rel_path] = entry
+
+    def _read_limits(self):
+        self._mem_total = psutil.virtual_memory().total
+        self._cpu_capacity = float(os.cpu_count() or 1)
+        self._cpus = None
+        self._cpu_set = frozenset()
+        if not self.limits:
+            return
+        mem_max = _read_cgroup_value(os.path.join(self.root, "memory.max"))
+        if mem_max.isdigit():
+            self._mem_total = min(self._mem_total, int(mem_max))
+        cpus = _read_cgroup_value(os.path.join(self.root, "cpuset.cpus.effective"))
+        with contextlib.suppress(ValueError):
+            self._cpus = _parse_cpu_list(cpus) if cpus else None
+        if self._cpus:
+            self._cpu_set = frozenset(self._cpus)
+            self._cpu_capacity = float(len(self._cpus))
+        quota, _, period = _read_cgroup_value(os.path.join(self.root, "cpu.max")).partition(" ")
+        if quota.isdigit() and period.isdigit() and int(period):
+            self._cpu_capacity = min(self._cpu_capacity, int(quota) / int(period))
+        if self._own_memory_fd < 0:
+            with contextlib.suppress(OSError):
+                self._own_memory_fd = os.open(os.path.join(self.root, "memory.current"), os.O_RDONLY)
+        if self._own_cpu_fd < 0:
+            with contextlib.suppress(OSError):
+                self._own_cpu_fd = os.open(os.path.join(self.root, "cpu.stat"), os.O_RDONLY)
+
+    def _read_own_usage(self, now: float):
+        try:
+            usage = int(os.pread(self._own_cpu_fd, 256, 0).split(b"\n", 1)[0].split()[1])
+        except (OSError, ValueError, IndexError):
+            self._own_usage = self._own_used = None
+            return
+        previous, previous_at = self._own_usage, self._own_read_at
+        self._own_usage, self._own_read_at = usage, now
+        if previous is not None and now > previous_at:
+            self._own_used = max(0.0, (usage - previous) / ((now - previous_at) * 1e6))
+        else:
+            self._own_used = None
+
+    @property
+    def cpu_set(self) -> frozenset:
+        """The CPU numbers of the container's cpuset (empty when not limited to one)."""
+        return self._cpu_set
+
+    def adjust(self, mem_percent: float, per_core: List[float],
+               cpu_ids: List[int]) -> Tuple[float, List[float], Optional[List[int]]]:
+        """
+        Apply the container's own limits to a host sample (unchanged when not
+        limited); call after sample(). cpu_ids is the CPU number of each
+        per_core entry (the sampler's cpu_ids).
+
+        The loads become the container's own: one bar per CPU of its
+        capacity (a partial CPU of a cpu.max quota is the last, shorter
+        bar), filled in turn with the CPUs it kept busy since the previous
+        sample. These are no host CPUs, so the returned cpu_ids is None.
+        Only when the root's cpu.stat cannot be read are the host loads of
+        the cpuset's CPUs returned, with their cpu_ids.
+        """
+        if not self.limits:
+            return mem_percent, per_core, cpu_ids
+        if self._own_memory_fd >= 0 and self._mem_total:
+            with contextlib.suppress(OSError, ValueError):
+                used = int(os.pread(self._own_memory_fd, 64, 0))
+                mem_percent = round(used / self._mem_total * 100, 1)
+        if self._own_used is not None:
+            capacity = self._cpu_capacity
+            loads = []
+            for i in range(max(1, math.ceil(capacity))):
+                share = min(1.0, capacity - i) if capacity > i else 1.0
+                loads.append(min(100.0, max(0.0, min(share, self._own_used - i)) / share * 100))
+            return mem_percent, loads, None
+        if self._cpus:
+            allowed = self._cpu_set
+            mine = [i for i, cpu in enumerate(cpu_ids) if cpu in allowed]
+            if mine and len(cpu_ids) == len(per_core):
+                per_core = [per_core[i] for i in mine]
+                cpu_ids = [cpu_ids[i] for i in mine]
+        return mem_percent, per_core, cpu_ids
+
+    def sample(self) -> List[Tuple[str, float, float]]:
+        """Return the busiest top_n cgroups as (name, CPU %, memory %) since the previous call."""
+        now = time.monotonic()
+        if now - self._scanned_at >= CGROUP_RESCAN_SEC:
+            self._scanned_at = now
+            self._read_limits()
+            if self.top_n > 0:
+                self._scan()
+        if self._own_cpu_fd >= 0:
+            self._read_own_usage(now)
+        rows = []
+        gone = []
+        for rel_path, entry in self._groups.items():
+            try:
+                stat = os.pread(entry[0], 256, 0)
+                usage = int(stat.split(b"\n", 1)[0].split()[1])  # "usage_usec N" comes first
+                memory = int(os.pread(entry[1], 64, 0)) if entry[1] >= 0 else 0
+            except (OSError, ValueError):
+                gone.append(rel_path)  # removed since the last scan
+                continue
+            previous, previous_at = entry[2], entry[3]
+            entry[2], entry[3] = usage, now
+            if previous is None or now <= previous_at:
+                continue
+            cpu = (usage - previous) / ((now - previous_at) * 1e6 * self._cpu_capacity) * 100
+            mem = memory / self._mem_total * 100 if self._mem_total else 0.0
+            rows.append((cpu, mem, rel_path))
+        for rel_path in gone:
+            self._close(self._groups.pop(rel_path))
+        rows.sort(reverse=True)
+        return [(_cgroup_display_name(p), max(0.0, min(100.0, cpu)), min(100.0, mem))
+                for cpu, mem, p in rows[:self.top_n]]
+
+    def close(self):
+        for entry in self._groups.values():
+            self._close(entry)
+        self._groups.clear()
+        for fd in (self._own_memory_fd, self._own_cpu_fd):
+            if fd >= 0:
+                with contextlib.suppress(OSError):
+                    os.close(fd)
+        self._own_memory_fd = self._own_cpu_fd = -1
+
+
+def make_cgroup_monitor() -> Optional[CgroupMonitor]:
+    """A CgroupMonitor when CPUMONITORJR_CGROUP_TOP or container limits are wanted, otherwise None."""
+    if CGROUP_TOP <= 0 and CGROUP_LIMITS != "on":
+        return None
+    if not os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers")):
+        logging.getLogger("CPUMonitorJr").warning(f"No cgroup v2 hierarchy at {CGROUP_ROOT}; "
+                                                  "cgroup breakdown disabled")
+        return None
+    monitor = CgroupMonitor(CGROUP_ROOT, CGROUP_DEPTH, CGROUP_TOP, CGROUP_LIMITS)
+    if monitor.limits:
+        logging.getLogger("CPUMonitorJr").info("Running in a container: showing its own memory and CPU limits")
+    return monitor
+
+
+# -----------------------------------------------------------------------------
+# CPU clock speed and thermal throttling (CPUMONITORJR_FREQ_FRAMES)
+# -----------------------------------------------------------------------------
+class FrequencyMonitor:
+    """
+    Per-CPU clock speed and thermal throttle events. The sysfs files are
+    found and opened once at startup and re-read with pread() each sample:
+      cpuN/cpufreq/scaling_cur_freq              (kHz, per logical CPU)
+      cpuN/thermal_throttle/core_throttle_count  (once per physical core)
+      cpuN/thermal_throttle/package_throttle_count (once per package)
+    SMT siblings share their core's throttle count, so it is only read for
+    the first logical CPU of each (physical_package_id, core_id) and the
+    siblings report 0 events. A missing file reads as 0, e.g. throttle
+    counts on AMD CPUs.
+
+    sample() returns (MHz per CPU, core throttle events per CPU, package
+    throttle events), the events counted since the previous sample. Given a
+    set of CPU numbers (a container's cpuset) it only returns those CPUs,
+    and a core's events go to the first of its CPUs that is kept.
+    """
+
+    def __init__(self, sysfs_root: str = "/sys/devices/system/cpu"):
+        online = _read_sysfs_text(os.path.join(sysfs_root, "online"))
+        if not online:
+            raise OSError(f"cannot read {sysfs_root}/online")
+        self.cpus = _parse_cpu_list(online)
+        self._freq_fds: List[int] = []
+        self._core_fds: List[int] = []
+        self._package_fds: List[int] = []
+        self._core_of: List[Tuple[str, str]] = []  # (package, core) of each CPU
+        packages = set()
+        cores = set()
+        for cpu in self.cpus:
+            base = os.path.join(sysfs_root, f"cpu{cpu}")
+            self._freq_fds.append(self._open(os.path.join(base, "cpufreq", "scaling_cur_freq")))
+            package = _read_sysfs_text(os.path.join(base, "topology", "physical_package_id")) or "0"
+            core = (package, _read_sysfs_text(os.path.join(base, "topology", "core_id")) or f"cpu{cpu}")
+            self._core_of.append(core)
+            if core not in cores:
+                cores.add(core)
+                self._core_fds.append(self._open(os.path.join(base, "thermal_throttle", "core_throttle_count")))
+            else:
+                self._core_fds.append(-1)
+            if package not in packages:
+                packages.add(package)
+                fd = self._open(os.path.join(base, "thermal_throttle", "package_throttle_count"))
+                if fd >= 0:
+                    self._package_fds.append(fd)
+        if all(fd < 0 for fd in self._freq_fds):
+            self.close()
+            raise OSError(f"no cpufreq/scaling_cur_freq under {sysfs_root}")
+        max_khz = _read_sysfs_text(os.path.join(sysfs_root, f"cpu{self.cpus[0]}", "cpufreq", "cpuinfo_max_freq"))
+        self.max_mhz = int(max_khz) // 1000 if max_khz.isdigit() else 0
+        self._core_prev: Optional[List[int]] = None
+        self._package_prev: Optional[int] = None
+        self._kept_for: Optional[frozenset] = None  # the CPU set _kept and _route were built for
+        self._kept: List[int] = []
+        self._route: List[int] = []
+
+    @staticmethod
+    def _open(path: str) -> int:
+        try:
+            return os.open(path, os.O_RDONLY)
+        except OSError:
+            return -1
+
+    @staticmethod
+    def _value(fd: int) -> int:
+        if fd < 0:
+            return 0
+        try:
+            return int(os.pread(fd, 32, 0))
+        except (OSError, ValueError):
+            return 0
+
+    def _keep(self, cpus: frozenset):
+        kept = [i for i, cpu in enumerate(self.cpus) if cpu in cpus]
+        first: Dict[Tuple[str, str], int] = {}
+        for position, i in enumerate(kept):
+            first.setdefault(self._core_of[i], position)
+        self._kept_for = cpus
+        self._kept = kept
+        self._route = [first.get(core, -1) for core in self._core_of]
+
+    def sample(self, cpus: Optional[frozenset] = None) -> Tuple[List[int], List[int], int]:
+        value = self._value
+        mhz = [value(fd) // 1000 for fd in self._freq_fds]
+        core = [value(fd) for fd in self._core_fds]
+        package = sum(value(fd) for fd in self._package_fds)
+        core_prev = self._core_prev if self._core_prev is not None else core
+        package_prev = self._package_prev if self._package_prev is not None else package
+        self._core_prev, self._package_prev = core, package
+        events = [max(0, c - p) for c, p in zip(core, core_prev)]
+        if cpus:
+            if cpus is not self._kept_for:
+                self._keep(cpus)
+            if self._kept:
+                kept_events = [0] * len(self._kept)
+                for i, count in enumerate(events):
+                    if count and self._route[i] >= 0:
+                        kept_events[self._route[i]] += count
+                mhz, events = [mhz[i] for i in self._kept], kept_events
+        return mhz, events, max(0, package - package_prev)
+
+    def close(self):
+        for fd in self._freq_fds + self._core_fds + self._package_fds:
+            if fd >= 0:
+                with contextlib.suppress(OSError):
+                    os.close(fd)
+        self._freq_fds, self._core_fds, self._package_fds = [], [], []
+
+
+def make_frequency_monitor() -> Optional[FrequencyMonitor]:
+    """A FrequencyMonitor when CPUMONITORJR_FREQ_FRAMES is set and cpufreq is available, otherwise None."""
+    if not FREQ_FRAMES:
+        return None
+    logger = logging.getLogger("CPUMonitorJr")
+    try:
+        monitor = FrequencyMonitor(SYSFS_CPU_ROOT)
+    except OSError as e:
+        logger.warning(f"CPU clock speeds unavailable, frequency frames disabled: {e}")
+        return None
+    logger.info(f"Sending clock speeds of {len(monitor.cpus)} CPUs (max {monitor.max_mhz} MHz)")
+    return monitor
+
+
+# -----------------------------------------------------------------------------
+# Sampler thread (keeps blocking procfs/sysfs reads off the event loop)
+# -----------------------------------------------------------------------------
+class Sample:
+    """One host sample: the values build_stats_frame consumes."""
+
+    __slots__ = ("taken_at", "mem_percent", "avg_temp", "max_temp", "per_core", "columns", "top", "freq")
+
+    def __init__(self):
+        self.taken_at = 0.0  # time.monotonic() of the newest raw sample folded in
+        self.mem_percent = 0.0
+        self.avg_temp = 0.0
+        self.max_temp = 0.0
+        self.per_core: List[float] = []
+        # What per_core holds: "cpu" (logical CPUs), "core", "ccx" or "socket" (CpuTopology groups)
+        # or "container" (a container's own CPU use, see CgroupMonitor.adjust)
+        self.columns = "cpu"
+        self.top: Optional[List[Tuple[str, float, float]]] = None  # busiest cgroups, when enabled
+        # (MHz per CPU, core throttle events per CPU, package throttle events) since the previous Sample, when enabled
+        self.freq: Optional[Tuple[List[int], List[int], int]] = None
+
+
+def parse_aggregate_mode(mode: str, strict: bool = False) -> Tuple[str, float]:
+    """
+    Parse CPUMONITORJR_AGGREGATE: "avg", "peak" or "p<NN>" (percentile, e.g. "p95").
+    Returns (kind, percentile); unknown values fall back to "avg", or raise
+    ValueError when strict.
+    """
+    mode = (mode or "avg").strip().lower()
+    if mode in ("avg", "peak"):
+        return mode, 0.0
+    if mode.startswith("p"):
+        try:
+            q = float(mode[1:])
+            if 0.0 <= q <= 100.0:
+                return "percentile", q
+        except ValueError:
+            pass
+    if strict:
+        raise ValueError(f"unknown aggregate mode {mode!r} (avg, peak or p<0-100>)")
+    logging.getLogger("CPUMonitorJr").warning(f"Unknown aggregate mode {mode!r}, using avg")
+    return "avg", 0.0
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """Linear-interpolated percentile (NumPy's default method)."""
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * q / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+class SampleRing:
+    """
+    Fixed-size ring of raw samples, one row per sample laid out as
+    [mem_percent, avg_temp, max_temp, core0, core1, ...].
+
+    The rows live in one preallocated NumPy array when NumPy is installed
+    (so a reduction is a single vectorized call across every core) and in
+    preallocated array('d') rows otherwise. reduce() folds the rows written
+    since the previous reduce() into one Sample using the average, the peak or
+    a percentile of each column.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = max(2, capacity)
+        self._width = 0
+        self._rows = None
+        self._written = 0
+        self._reduced = 0
+
+    def _reset(self, width: int):
+        self._width = width
+        if np is not None:
+            self._rows = np.zeros((self.capacity, width), dtype=np.float64)
+        else:
+            self._rows = [array("d", bytes(8 * width)) for _ in range(self.capacity)]
+        self._written = self._reduced = 0
+
+    def append(self, mem_percent: float, avg_temp: float, max_temp: float, per_core: List[float]):
+        width = 3 + len(per_core)
+        if width != self._width:
+            # First sample, or CPUs went on/offline
+            self._reset(width)
+        row = self._rows[self._written % self.capacity]
+        row[0] = mem_percent
+        row[1] = avg_temp
+        row[2] = max_temp
+        row[3:] = per_core if np is not None else array("d", per_core)
+        self._written += 1
+
+    def newest(self) -> Optional[List[float]]:
+        """The most recent row as a list, without reducing it (None before the first sample)."""
+        if self._written == 0:
+            return None
+        return list(self._rows[(self._written - 1) % self.capacity])
+
+    def reduce(self, kind: str, q: float, out: Sample) -> bool:
+        """Reduce the unreduced rows into out. Returns False if there were none."""
+        n = min(self._written - self._reduced, self.capacity)
+        if n <= 0:
+            return False
+        self._reduced = self._written
+        first = (self._written - n) % self.capacity
+
+        if np is not None:
+            if first + n <= self.capacity:
+                window = self._rows[first:first + n]
+            else:
+                window = np.concatenate((self._rows[first:], self._rows[:first + n - self.capacity]))
+            if kind == "peak":
+                result = window.max(axis=0)
+            elif kind == "percentile":
+                result = np.percentile(window, q, axis=0)
+            else:
+                result = window.mean(axis=0)
+            values = result.tolist()
+        else:
+            window = [self._rows[(first + i) % self.capacity] for i in range(n)]
+            if kind == "peak":
+                values = [max(col) for col in zip(*window)]
+            elif kind == "percentile":
+                values = [_percentile(col, q) for col in zip(*window)]
+            else:
+                values = [sum(col) / n for col in zip(*window)]
+
+        out.mem_percent, out.avg_temp, out.max_temp = values[0], values[1], values[2]
+        out.per_core[:] = values[3:]
+        return True
+
+
+class SamplerThread(threading.Thread):
+    """
+    Runs a sampler in a background thread, SAMPLES_PER_INTERVAL times per send
+    interval, and writes every raw sample into a SampleRing.
+
+    latest() reduces the samples taken since the previous send into one
+    Sample (average, peak or percentile per column, see
+    CPUMONITORJR_AGGREGATE), so a spike shorter than the send interval still
+    reaches the display without raising the websocket frame rate. With one
+    sample per interval this is simply the latest sample. When nothing was
+    sampled since the previous send (a stalled read) it yields None rather
+    than the previous Sample again. The ring holds the samples of the
+    longest send period (max_period, e.g. CPUMONITORJR_ADAPTIVE_MAX) at the
+    shortest one's sampling rate, plus one period for a late tick.
+
+    With a CgroupMonitor the thread also reads the busiest cgroups (the
+    latest reading is passed on as Sample.top, not aggregated) and applies
+    the container's own limits to each sample. With a CpuTopology it groups
+    the host CPUs' loads (a container's own bars are not CPUs and stay as
+    they are) before they are stored, so the ring holds one column per bar. With a FrequencyMonitor it
+    reads the clock speeds (latest reading) and adds up the throttle events
+    until latest() hands them on as Sample.freq.
+
+    The samples are taken on a grid that follow() keeps in phase with the
+    send ticks: the last sample of each interval finishes just before its
+    tick (by the time a read takes plus SAMPLE_LEAD_SEC), so every frame
+    carries the interval that just ended.
+
+    The ring is only touched under a lock, by the thread to append a row and
+    by latest() to reduce it. A stalled hwmon or procfs read therefore only
+    delays the next sample, never the event loop or the websocket sends.
+    """
+
+    def __init__(self, sampler, interval: float, samples_per_interval: int = 1, aggregate: str = "avg",
+                 cgroups: Optional[CgroupMonitor] = None, frequencies: Optional[FrequencyMonitor] = None,
+                 max_period: float = 0.0, topology: Optional[CpuTopology] = None):
+        super().__init__(name="CPUMonitorJr-sampler", daemon=True)
+        self.sampler = sampler
+        self.cgroups = cgroups
+        self.frequencies = frequencies
+        self.topology = topology
+        self._top: Optional[List[Tuple[str, float, float]]] = None
+        self._columns = "cpu"
+        self._mhz: List[int] = []
+        self._core_events: List[int] = []
+        self._package_events = 0
+        self.samples_per_interval = max(1, samples_per_interval)
+        self.interval = interval / self.samples_per_interval
+        self.aggregate, self.percentile = parse_aggregate_mode(aggregate)
+        self._ring_periods = math.ceil(max(max_period, interval) / interval) + 1
+        self._ring = SampleRing(self._ring_periods * self.samples_per_interval)
+        self._next_sampler = None
+        self._out = Sample()
+        self._sampled_at = 0.0
+        self._anchor = time.monotonic()  # a send tick deadline; the sampling grid ends its intervals there
+        self._read_time = 0.0  # how long a sample takes (rises at once, decays slowly)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+
+    @property
+    def sampled_at(self) -> float:
+        """time.monotonic() of the last successful sample (0.0 before the first one)."""
+        return self._sampled_at
+
+    @property
+    def aggregate_mode(self) -> str:
+        return f"p{self.percentile:g}" if self.aggregate == "percentile" else self.aggregate
+
+    def follow(self, deadline: float, period: float):
+        """
+        Keep the sampling grid in phase with the send ticks: spread the
+        samples over each period so the last one finishes just before the
+        tick at deadline (and at every period after it).
+        """
+        with self._lock:
+            interval = period / self.samples_per_interval
+            drift = (deadline - self._anchor) % interval
+            if interval == self.interval and min(drift, interval - drift) < 0.001:
+                return
+            self._anchor, self.interval = deadline, interval
+        self._wake.set()
+
+    def _next_sample_time(self, after: float) -> float:
+        """The first point of the sampling grid after the given time."""
+        interval = self.interval
+        start = self._anchor - min(self._read_time + SAMPLE_LEAD_SEC, interval / 2)
+        return start + (math.floor((after - start) / interval) + 1) * interval
+
+    def set_sampling(self, samples_per_interval: int, aggregate: str):
+        """
+        Change the samples per send interval and how they are aggregated
+        (see parse_aggregate_mode; ValueError for an unknown mode). Samples
+        not yet aggregated are dropped.
+        """
+        kind, percentile = parse_aggregate_mode(aggregate, strict=True)
+        with self._lock:
+            period = self.interval * self.samples_per_interval
+            self.samples_per_interval = max(1, samples_per_interval)
+            self.interval = period / self.samples_per_interval
+            self.aggregate, self.percentile = kind, percentile
+            self._ring = SampleRing(self._ring_periods * self.samples_per_interval)
+        self._wake.set()
+
+    def set_sampler(self, sampler):
+        """Switch to another sampler; the thread primes it and uses it from its next sample on."""
+        with self._lock:
+            previous, self._next_sampler = self._next_sampler, sampler
+        if previous is not None:
+            previous.close()
+
+    def peek(self) -> Optional[Tuple[float, str, List[float]]]:
+        """
+        (time.monotonic() taken, what the loads are (see Sample.columns),
+        [mem_percent, avg_temp, max_temp, load0, ...]) of the newest raw
+        sample, without consuming it; None before the first.
+        """
+        with self._lock:
+            row = self._ring.newest()
+            return (self._sampled_at, self._columns, row) if row is not None else None
+
+    def run(self):
+        logger = logging.getLogger("CPUMonitorJr")
+        try:
+            if self.topology is not None:
+                self.topology.load()
+            # Prime CPU monitoring so the first sample has a real delta
+            self.sampler.sample()
+            if self.cgroups is not None:
+                self.cgroups.sample()
+            if self.frequencies is not None:
+                self.frequencies.sample()
+            next_at = self._next_sample_time(time.monotonic())
+            while True:
+                if self._wake.wait(max(0.0, next_at - time.monotonic())):
+                    if self._stop.is_set():
+                        break
+                    # Interval or phase changed: continue on the new grid
+                    self._wake.clear()
+                    next_at = self._next_sample_time(time.monotonic())
+                    continue
+                self._sample_once(logger)
+                # A read that stalled past whole grid points does not try to catch up
+                next_at = self._next_sample_time(max(time.monotonic(), next_at + self.interval / 2))
+        finally:
+            self.sampler.close()
+            if self._next_sampler is not None:
+                self._next_sampler.close()
+            if self.cgroups is not None:
+                self.cgroups.close()
+            if self.frequencies is not None:
+                self.frequencies.close()
+
+    def _sample_once(self, logger: logging.Logger):
+        if self._next_sampler is not None:
+            with self._lock:
+                sampler, self._next_sampler = self._next_sampler, None
+            self.sampler.close()
+            self.sampler = sampler
+            try:
+                # Prime it, as at startup
+                sampler.sample()
+            except Exception as e:
+                logger.warning("Sampling failed: %s", e)
+            return
+        started = time.monotonic()
+        try:
+            mem_percent, avg_t, max_t, per_core = self.sampler.sample()
+            cpu_ids = self.sampler.cpu_ids
+            top = None
+            if self.cgroups is not None:
+                top = self.cgroups.sample()
+                mem_percent, per_core, cpu_ids = self.cgroups.adjust(mem_percent, per_core, cpu_ids)
+            columns = "container" if cpu_ids is None else self.topology.mode if self.topology is not None else "cpu"
+            if self.topology is not None and cpu_ids is not None:
+                per_core = self.topology.apply(per_core, cpu_ids)
+            freq = None
+            if self.frequencies is not None:
+                freq = self.frequencies.sample(self.cgroups.cpu_set if self.cgroups is not None else None)
+        except Exception as e:
+            logger.warning("Sampling failed: %s", e)
+            return
+        sampled_at = time.monotonic()
+        self._read_time = max(sampled_at - started, self._read_time * 0.9)
+        with self._lock:
+            self._ring.append(mem_percent, avg_t, max_t, per_core)
+            self._columns = columns
+            self._top = top
+            if freq is not None:
+                mhz, core_events, package_events = freq
+                if len(self._core_events) != len(core_events):
+                    self._core_events = [0] * len(core_events)
+                self._mhz = mhz
+                self._core_events = [a + b for a, b in zip(self._core_events, core_events)]
+                self._package_events += package_events
+            self._sampled_at = sampled_at
+
+    @contextlib.contextmanager
+    def latest(self):
+        """Yield the Sample aggregated since the previous call (None if nothing new was sampled)."""
+        with self._lock:
+            if not self._ring.reduce(self.aggregate, self.percentile, self._out):
+                yield None
+                return
+            self._out.taken_at = self._sampled_at
+            self._out.columns = self._columns
+            self._out.top = self._top if self.cgroups is not None and self.cgroups.top_n > 0 else None
+            if self.frequencies is not None:
+                self._out.freq = (self._mhz, self._core_events, self._package_events)
+                self._core_events = [0] * len(self._core_events)
+                self._package_events = 0
+            yield self._out
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+
+# -----------------------------------------------------------------------------
+# Load history (refills a display's line graph after it reconnects)
+# -----------------------------------------------------------------------------
+class HistoryRing:
+    """
+    The average CPU load of the most recent frames and how long each was
+    shown for, oldest overwritten first. Both live in preallocated arrays
+    (one byte and one u16 per frame), HISTORY_LENGTH frames deep: one per
+    pixel of the display's line graph, the most it can ever show.
+    """
+
+    def __init__(self, capacity: int = HISTORY_LENGTH):
+        self.capacity = capacity
+        self._loads = array("B", bytes(capacity))
+        self._spans_ms = array("H", bytes(2 * capacity))
+        self._written = 0
+
+    def __len__(self) -> int:
+        return min(self._written, self.capacity)
+
+    def append(self, average_load: float, seconds: float):
+        i = self._written % self.capacity
+        self._loads[i] = max(0, min(100, int(average_load + 0.5)))
+        self._spans_ms[i] = max(1, min(0xFFFF, int(seconds * 1000 + 0.5)))
+        self._written += 1
+
+    def snapshot(self) -> Tuple[List[int], List[int]]:
+        """Return (loads, spans in ms), oldest first."""
+        n = len(self)
+        first = (self._written - n) % self.capacity
+        order = [(first + i) % self.capacity for i in range(n)]
+        return [self._loads[i] for i in order], [self._spans_ms[i] for i in order]
+
+
+HISTORY = HistoryRing()
+
+
+# -----------------------------------------------------------------------------
+# Frame builders (match VB's byte-level protocol)
+# -----------------------------------------------------------------------------
+def build_time_frame(now: datetime) -> bytes:
+    """
+    Time frame layout (VB comment):
+      byte 0 = 0 (time stream)
+      byte 1 = year (current year - 2000)
+      byte 2 = month
+      byte 3 = day
+      byte 4 = day of week (Sunday = 0)
+      byte 5 = hour
+      byte 6 = minute
+      byte 7 = second
+    """
+    dow = (now.weekday() + 1) % 7  # Python Mon=0..Sun=6 -> Sunday=0
+    y = max(0, min(255, now.year - 2000))
+    return bytes([0, y, now.month, now.day, dow, now.hour, now.minute, now.second])
+
+
+def build_computer_info_frame(name: str, lan: str, external: str) -> bytes:
+    """
+    Computer info frame layout (VB comment):
+      byte 0               = 1 (Computer name and IP address stream)
+      byte 1 ... byte n    = Computer name (ASCII)
+      byte n + 1           = ';'
+      byte n + 2 ... byte m= LAN IP Address (ASCII)
+      byte m + 1           = ';'
+      byte m + 2 ... byte z= External IP Address (ASCII)
+      final byte           = ';'
+    """
+    payload = f"{name};{lan};{external};"
+    return bytes([1]) + payload.encode("ascii", errors="ignore")
+
+
+class StatsEncoder:
+    """
+    Builds stats frames (see build_stats_frame and build_stats_frames) in
+    preallocated buffers that are reused from frame to frame; the only
+    allocation per frame is the bytes object handed to the send queues.
+    Per-CPU loads are clamped and rounded straight into the buffer, with
+    NumPy for hosts of NUMPY_MIN_CPUS or more when it is installed.
+    Not thread safe: the agent encodes on the event loop only.
+    """
+
+    NUMPY_MIN_CPUS = 64
+
+    def __init__(self):
+        self._frame = bytearray(8 + 255)
+        self._cores = bytearray(255)
+        self._chunk = bytearray(12 + 255)
+
+    def _write_header(self, buf: bytearray, mem_percent: float, avg_temp: float, max_temp: float):
+        buf[1], buf[2] = _whole_dec(mem_percent)
+        buf[3], buf[4] = _whole_dec(avg_temp)
+        buf[5], buf[6] = _whole_dec(max_temp)
+
+    def _write_cores(self, buf: bytearray, offset: int, per_core: List[float], n: int):
+        """Write the first n loads (0..100, rounded half to even as round() does) at buf[offset]."""
+        if np is not None and n >= self.NUMPY_MIN_CPUS:
+            loads = np.asarray(per_core[:n], dtype=float)
+            if np.isfinite(loads).all():
+                buf[offset:offset + n] = np.clip(np.rint(loads), 0, 100).astype(np.uint8).tobytes()
+                return
+        i = offset
+        for c in per_core[:n] if len(per_core) > n else per_core:
+            v = round(c)
+            buf[i] = 0 if v < 0 else 100 if v > 100 else v
+            i += 1
+
+    def stats_frame(self, mem_percent: float, avg_temp: float, max_temp: float, per_core: List[float]) -> bytes:
+        buf = self._frame
+        n = min(255, len(per_core))
+        buf[0] = 2
+        self._write_header(buf, mem_percent, avg_temp, max_temp)
+        buf[7] = n
+        self._write_cores(buf, 8, per_core, n)
+        return bytes(memoryview(buf)[:8 + n])
+
+    def stats_frames(self, mem_percent: float, avg_temp: float, max_temp: float,
+                     per_core: List[float]) -> List[bytes]:
+        if len(per_core) <= 255:
+            return [self.stats_frame(mem_percent, avg_temp, max_temp, per_core)]
+
+        total = min(len(per_core), 0xFFFF)
+        if len(self._cores) < total:
+            self._cores = bytearray(total)
+        self._write_cores(self._cores, 0, per_core, total)
+        cores = memoryview(self._cores)
+        buf = self._chunk
+        buf[0] = 4
+        self._write_header(buf, mem_percent, avg_temp, max_temp)
+        buf[7], buf[8] = total & 0xFF, total >> 8
+        frames = []
+        for first in range(0, total, MAX_CORES_PER_FRAME):
+            count = min(MAX_CORES_PER_FRAME, total - first)
+            buf[9], buf[10], buf[11] = first & 0xFF, first >> 8, count
+            buf[12:12 + count] = cores[first:first + count]
+            frames.append(bytes(memoryview(buf)[:12 + count]))
+        return frames
+
+
+STATS_ENCODER = StatsEncoder()
+
+
+def build_stats_frame(mem_percent: float, avg_temp: float, max_temp: float, per_core: List[float]) -> bytes:
+    """
+    Stats frame layout (VB comment):
+      byte 0 = 2 (temperature and CPU data stream)
+      byte 1 = percent of memory used whole number
+      byte 2 = percent of memory used decimal
+      byte 3 = average temp whole number
+      byte 4 = average temp decimal
+      byte 5 = max temp whole number
+      byte 6 = max temp decimal
+      byte 7 = number of CPUs
+      byte 8 and on = CPU busy of each CPU (0..100, rounded)
+    """
+    return STATS_ENCODER.stats_frame(mem_percent, avg_temp, max_temp, per_core)
+
+
+def build_stats_frames(mem_percent: float, avg_temp: float, max_temp: float, per_core: List[float]) -> List[bytes]:
+    """
+    Returns the frame(s) for one stats sample: a single stats frame for up to
+    255 CPUs (unchanged protocol), otherwise a series of chunked stats frames.
+
+    Chunked stats frame layout (hosts with more than 255 CPUs):
+      byte 0  = 4 (chunked temperature and CPU data stream)
+      byte 1 ... byte 6 = as the stats frame (memory, average temp, max temp)
+      byte 7  = total number of CPUs, low byte
+      byte 8  = total number of CPUs, high byte
+      byte 9  = index of the first CPU in this chunk, low byte
+      byte 10 = index of the first CPU in this chunk, high byte
+      byte 11 = number of CPUs in this chunk
+      byte 12 and on = CPU busy of each CPU in this chunk (0..100, rounded)
+    Chunks are sent in CPU order and hold at most MAX_CORES_PER_FRAME CPUs
+    each, so every frame fits comfortably in the ESP32's websocket buffer.
+    """
+    return STATS_ENCODER.stats_frames(mem_percent, avg_temp, max_temp, per_core)
+
+
+def build_delta_frame(stats_frame: bytes, previous_cores: bytes) -> bytes:
+    """
+    Delta stats frame layout (optional, CPUMONITORJR_DELTA_FRAMES=1):
+      byte 0 = 3 (delta temperature and CPU data stream)
+      byte 1 ... byte 7 = as the stats frame (memory, temps, number of CPUs)
+      byte 8 ... byte 8 + b - 1 = changed-CPU bitmap, b = (number of CPUs + 7) / 8;
+               bit (i % 8) of byte 8 + i / 8 is set when CPU i changed
+      following bytes = CPU busy of each changed CPU, in CPU order
+    The number of CPUs always matches the last full stats frame (keyframe).
+    """
+    cores = stats_frame[8:]
+    n = len(cores)
+    bitmap = bytearray((n + 7) // 8)
+    changed = bytearray()
+    for i in range(n):
+        if cores[i] != previous_cores[i]:
+            bitmap[i >> 3] |= 1 << (i & 7)
+            changed.append(cores[i])
+    return bytes([3]) + stats_frame[1:8] + bytes(bitmap) + bytes(changed)
+
+
+def build_history_frame(loads: List[int], spans_ms: List[int]) -> bytes:
+    """
+    History frame layout (sent once after each (re)connect):
+      byte 0 = 5 (average CPU load history)
+      byte 1 = number of readings, low byte
+      byte 2 = number of readings, high byte
+      then for each reading, oldest first:
+        byte 0 = average CPU busy (0..100)
+        byte 1 = milliseconds the reading was shown for, low byte
+        byte 2 = milliseconds the reading was shown for, high byte
+    The display stretches each reading across as many line graph pixels as
+    it would have drawn while the reading was current.
+    """
+    n = min(len(loads), 0xFFFF)
+    frame = bytearray(3 + 3 * n)
+    frame[0] = 5
+    frame[1] = n & 0xFF
+    frame[2] = n >> 8
+    for i in range(n):
+        frame[3 + 3 * i] = loads[i]
+        frame[4 + 3 * i] = spans_ms[i] & 0xFF
+        frame[5 + 3 * i] = spans_ms[i] >> 8
+    return bytes(frame)
+
+
+def build_cgroup_frame(top: List[Tuple[str, float, float]]) -> bytes:
+    """
+    Top cgroups frame layout (optional, CPUMONITORJR_CGROUP_TOP, sent after each stats frame):
+      byte 0 = 6 (busiest cgroups stream)
+      byte 1 = number of cgroups, busiest first
+      then for each cgroup:
+        byte 0 = CPU busy whole number (percent of all CPUs, or of the container's CPU limit)
+        byte 1 = CPU busy decimal
+        byte 2 = percent of memory used whole number (of the host's, or of the container's limit)
+        byte 3 = percent of memory used decimal
+        byte 4 = length of the name, followed by the name (ASCII, at most 24 characters)
+    """
+    frame = bytearray([6, min(255, len(top))])
+    for name, cpu, mem in top[:255]:
+        label = name.encode("ascii", errors="replace")[:CGROUP_NAME_LENGTH]
+        frame += bytes(_whole_dec(cpu) + _whole_dec(mem) + (len(label),)) + label
+    return bytes(frame)
+
+
+def build_frequency_frames(mhz: List[int], core_events: List[int], package_events: int,
+                           max_mhz: int = 0) -> List[bytes]:
+    """
+    Frequency frame layout (optional, CPUMONITORJR_FREQ_FRAMES=1, sent after each stats frame):
+      byte 0  = 7 (cpu clock speed and thermal throttling stream)
+      byte 1  = total number of CPUs, low byte
+      byte 2  = total number of CPUs, high byte
+      byte 3  = index of the first CPU in this frame, low byte
+      byte 4  = index of the first CPU in this frame, high byte
+      byte 5  = number of CPUs in this frame
+      byte 6  = maximum clock speed in MHz, low byte (0 when unknown)
+      byte 7  = maximum clock speed in MHz, high byte
+      byte 8  = package throttle events since the previous frame, low byte
+      byte 9  = package throttle events since the previous frame, high byte
+      byte 10 and on = three bytes per CPU: clock speed in MHz (low byte,
+               high byte), then core throttle events since the previous
+               frame (0..255)
+    Like chunked stats frames, hosts with more CPUs than
+    MAX_CORES_PER_FRAME get a series of frames, in CPU order; bytes 6 to 9
+    are the same in each.
+    """
+    total = min(len(mhz), 0xFFFF)
+    max_mhz = max(0, min(0xFFFF, max_mhz))
+    package_events = max(0, min(0xFFFF, package_events))
+    frames = []
+    for first in range(0, max(total, 1), MAX_CORES_PER_FRAME):
+        count = min(MAX_CORES_PER_FRAME, total - first)
+        frame = bytearray(10 + 3 * count)
+        frame[0:10] = bytes([7, total & 0xFF, total >> 8, first & 0xFF, first >> 8, count,
+                             max_mhz & 0xFF, max_mhz >> 8, package_events & 0xFF, package_events >> 8])
+        for i in range(count):
+            speed = max(0, min(0xFFFF, mhz[first + i]))
+            frame[10 + 3 * i] = speed & 0xFF
+            frame[11 + 3 * i] = speed >> 8
+            frame[12 + 3 * i] = max(0, min(255, core_events[first + i]))
+        frames.append(bytes(frame))
+    return frames
+
+
+# -----------------------------------------------------------------------------
+# Sample recorder (CPUMONITORJR_RECORD_FILE)
+# -----------------------------------------------------------------------------
+RECORD_MAGIC = b"CMJREC1\0"
+RECORD_VERSION = 1
+RECORD_HEADER = struct.Struct("<8sHHIQQ16s")  # magic, version, CPUs, slot size, slots, next slot, columns
+RECORD_HEADER_SIZE = 64
+RECORD_STAMP = struct.Struct("<Q")
+
+
+def join_stats_frames(stats_frames: List[bytes]) -> bytes:
+    """
+    One sample in stats frame layout (see build_stats_frame), whatever the
+    number of CPUs: chunked samples (more than 255 CPUs) are joined back into
+    one stats frame whose byte 7 is 255 and whose length gives the number of
+    CPUs.
+    """
+    first = stats_frames[0]
+    if first[0] == 2:
+        return first
+    return b"\x02" + first[1:7] + b"\xff" + b"".join(f[12:] for f in stats_frames)
+
+
+def _decode_record(frame: bytes, cpus: int) -> Tuple[float, float, float, List[int]]:
+    """(memory %, average temp, max temp, per-CPU loads) of a joined stats frame."""
+    return (frame[1] + frame[2] / 10, frame[3] + frame[4] / 10, frame[5] + frame[6] / 10,
+            list(frame[8:8 + cpus]))
+
+
+def build_record(stats_frames: List[bytes], wall_time: float) -> bytes:
+    """
+    One recorder slot: the sample's wall clock time in milliseconds (u64,
+    little-endian) followed by the sample (see join_stats_frames); the number
+    of CPUs is kept in the file header.
+    """
+    return RECORD_STAMP.pack(int(wall_time * 1000)) + join_stats_frames(stats_frames)
+
+
+class SampleRecorder:
+    """
+    Ring file of recorded samples:
+      bytes 0..63 = header: magic "CMJREC1\\0", version (u16), number of CPUs
+                    (u16), slot size (u32), number of slots (u64), next slot
+                    to write (u64), what the loads are (16 bytes, "cpu",
+                    "core", "ccx", "socket" or "container", see Sample.columns;
+                    zeros read as "cpu"), zero padded
+      then the slots, 16 + number of CPUs bytes each (see build_record)
+    The file is created at its full size, so it never grows; once every slot
+    has been used the oldest is overwritten. A slot whose time is 0 is unused.
+
+    append() only buffers the record. write() is run from a worker thread
+    every RECORD_FLUSH_SEC and close() at shutdown; only close() fsyncs. A
+    change in the number of CPUs or in what they are starts a new recording;
+    the previous one is renamed to <path>.1 (replacing an older one there),
+    not overwritten.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.cpus = -1
+        self.columns = "cpu"
+        self.slot_size = 0
+        self.slots = 0
+        self.next_slot = 0
+        self._fd = -1
+        self._pending: List[Tuple[bytes, str]] = []
+        self._lock = threading.Lock()
+        self._failed = False
+
+    def append(self, record: bytes, columns: str = "cpu"):
+        self._pending.append((record, columns))
+
+    def take_pending(self) -> List[Tuple[bytes, str]]:
+        pending, self._pending = self._pending, []
+        return pending
+
+    def _open(self, slot_size: int, columns: str):
+        logger = logging.getLogger("CPUMonitorJr")
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+        cpus = slot_size - 16
+        slots = max(1, (self.max_bytes - RECORD_HEADER_SIZE) // slot_size)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o640)
+        header = os.pread(fd, RECORD_HEADER.size, 0)
+        next_slot = -1
+        if len(header) == RECORD_HEADER.size:
+            magic, version, old_cpus, old_slot_size, old_slots, old_next, old_columns = RECORD_HEADER.unpack(header)
+            old_columns = old_columns.rstrip(b"\0").decode("ascii", errors="replace") or "cpu"
+            if (magic, version, old_cpus, old_slot_size, old_slots, old_columns) == (
+                    RECORD_MAGIC, RECORD_VERSION, cpus, slot_size, slots, columns) and old_next < slots:
+                next_slot = old_next
+            elif magic == RECORD_MAGIC:
+                # Recorded with other settings: keep it (it may hold the very incident that
+                # took a CPU offline) and start a new file
+                os.close(fd)
+                os.replace(self.path, self.path + ".1")
+                fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o640)
+                logger.info(f"Previous recording kept as {self.path}.1")
+        if next_slot < 0:
+            # New file, or one recorded with other settings: start over
+            os.ftruncate(fd, 0)
+            os.ftruncate(fd, RECORD_HEADER_SIZE + slots * slot_size)
+            next_slot = 0
+            logger.info(f"Recording samples to {self.path} ({cpus} {columns} loads, {slots} samples)")
+        else:
+            logger.info(f"Appending samples to {self.path} ({cpus} {columns} loads, {slots} samples)")
+        self._fd = fd
+        self.cpus = cpus
+        self.columns = columns
+        self.slot_size = slot_size
+        self.slots = slots
+        self.next_slot = next_slot
+        self._write_header()
+
+    def _write_header(self):
+        header = RECORD_HEADER.pack(RECORD_MAGIC, RECORD_VERSION, self.cpus, self.slot_size,
+                                    self.slots, self.next_slot, self.columns.encode("ascii"))
+        os.pwrite(self._fd, header.ljust(RECORD_HEADER_SIZE, b"\0"), 0)
+
+    def _write_run(self, run: List[bytes]):
+        """Write consecutive records starting at next_slot (the caller stops a run at the end of the file)."""
+        if run:
+            os.pwrite(self._fd, b"".join(run), RECORD_HEADER_SIZE + self.next_slot * self.slot_size)
+            self.next_slot = (self.next_slot + len(run)) % self.slots
+
+    def write(self, records: List[Tuple[bytes, str]]):
+        with self._lock:
+            try:
+                run: List[bytes] = []
+                for record, columns in records:
+                    if len(record) != self.slot_size or columns != self.columns:
+                        self._write_run(run)
+                        run = []
+                        self._open(len(record), columns)
+                    run.append(record)
+                    if self.next_slot + len(run) == self.slots:
+                        self._write_run(run)
+                        run = []
+                self._write_run(run)
+                if self._fd >= 0:
+                    self._write_header()
+                self._failed = False
+            except OSError as e:
+                # Keep sampling and sending; say so once per run of failures
+                if not self._failed:
+                    logging.getLogger("CPUMonitorJr").warning(f"Could not record samples to {self.path}: {e}")
+                self._failed = True
+
+    def close(self):
+        self.write(self.take_pending())
+        with self._lock:
+            if self._fd >= 0:
+                with contextlib.suppress(OSError):
+                    os.fsync(self._fd)
+                os.close(self._fd)
+                self._fd = -1
+
+
+RECORDER = SampleRecorder(RECORD_FILE, int(RECORD_MAX_MB * 1024 * 1024)) if RECORD_FILE else None
+
+
+async def record_loop(recorder: SampleRecorder):
+    """Writes the buffered samples every RECORD_FLUSH_SEC, off the event loop."""
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            await asyncio.sleep(RECORD_FLUSH_SEC)
+            records = recorder.take_pending()
+            if records:
+                await loop.run_in_executor(None, recorder.write, records)
+    finally:
+        recorder.close()
+
+
+def read_recording(path: str) -> Tuple[int, str, List[Tuple[float, bytes]]]:
+    """
+    Return (number of CPUs, what they are (see Sample.columns), [(wall clock
+    time, stats frame)]) from a recording, oldest first.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < RECORD_HEADER_SIZE:
+        raise ValueError(f"{path} is not a CPUMonitorJr recording")
+    magic, version, cpus, slot_size, slots, next_slot, columns = RECORD_HEADER.unpack_from(data)
+    if magic != RECORD_MAGIC or version != RECORD_VERSION or slot_size != 16 + cpus:
+        raise ValueError(f"{path} is not a CPUMonitorJr recording")
+    slots = min(slots, (len(data) - RECORD_HEADER_SIZE) // slot_size)
+    samples = []
+    for i in range(slots):
+        offset = RECORD_HEADER_SIZE + ((next_slot + i) % slots) * slot_size
+        (stamp,) = RECORD_STAMP.unpack_from(data, offset)
+        if stamp:
+            samples.append((stamp / 1000.0, data[offset + 8:offset + slot_size]))
+    samples.sort(key=lambda s: s[0])  # the wall clock can step back
+    return cpus, columns.rstrip(b"\0").decode("ascii", errors="replace") or "cpu", samples
+
+
+# -----------------------------------------------------------------------------
+# Address service (cached computer name, LAN IP and external IP)
+# -----------------------------------------------------------------------------
+class AddressService:
+    """
+    Keeps the computer info frame ready so the handshake never waits on a
+    lookup.
+
+    run() polls the local interfaces every ADDRESS_POLL_SEC (a cheap
+    psutil.net_if_addrs call in the default executor) and recomputes the LAN
+    IP only when the IPv4 address set changes. The external IP is resolved in
+    the background and cached for EXTERNAL_IP_TTL_SEC; a failed lookup is
+    cached for EXTERNAL_IP_RETRY_SEC so unreachable hosts are not hammered.
+    An interface change also triggers a fresh external lookup. Whenever a
+    value changes the info frame is rebuilt and on_change() is called.
+    """
+
+    def __init__(self, on_change=None):
+        self.on_change = on_change
+        self.host_name = "unknown"
+        self.lan_ip = "0.0.0.0"
+        self.external_ip = EXTERNAL_IP_UNAVAILABLE
+        self._if_signature = None
+        self._external_due = 0.0
+        self._external_task: Optional[asyncio.Future] = None
+        self._frame = build_computer_info_frame(self.host_name, self.lan_ip, self.external_ip)
+
+    def info_frame(self) -> bytes:
+        """Return the cached computer info frame (never blocks)."""
+        return self._frame
+
+    def _update(self, host_name: str, lan_ip: str, external_ip: str):
+        if (host_name, lan_ip, external_ip) == (self.host_name, self.lan_ip, self.external_ip):
+            return
+        logging.getLogger("CPUMonitorJr").info(f"Computer info: name={host_name}, LAN={lan_ip}, external={external_ip}")
+        self.host_name, self.lan_ip, self.external_ip = host_name, lan_ip, external_ip
+        self._frame = build_computer_info_frame(host_name, lan_ip, external_ip)
+        if self.on_change:
+            self.on_change()
+
+    @staticmethod
+    def _read_local() -> Tuple[str, object, Dict]:
+        addrs = psutil.net_if_addrs()
+        signature = tuple(sorted(
+            (iface, a.address) for iface, entries in addrs.items() for a in entries
+            if getattr(a, "family", None) == socket.AF_INET
+        ))
+        return socket.gethostname() or "unknown", signature, addrs
+
+    async def refresh(self):
+        """Re-check the local addresses and start an external lookup if one is due."""
+        loop = asyncio.get_running_loop()
+        try:
+            host_name, signature, addrs = await loop.run_in_executor(None, self._read_local)
+        except Exception as e:
+            logging.getLogger("CPUMonitorJr").debug("Interface scan failed: %s", e)
+            return
+
+        lan_ip = self.lan_ip
+        if signature != self._if_signature:
+            if self._if_signature is not None:
+                # Network changed; the external address may have too
+                self._external_due = 0.0
+            self._if_signature = signature
+            lan_ip = await loop.run_in_executor(None, get_lan_ip, addrs)
+        self._update(host_name, lan_ip, self.external_ip)
+
+        if EXTERNAL_IP_URL and self._external_task is None and time.monotonic() >= self._external_due:
+            self._external_task = loop.run_in_executor(None, get_external_ip)
+            self._external_task.add_done_callback(self._external_done)
+
+    def _external_done(self, fut: asyncio.Future):
+        self._external_task = None
+        external_ip = EXTERNAL_IP_UNAVAILABLE if fut.cancelled() or fut.exception() else fut.result()
+        if external_ip == EXTERNAL_IP_UNAVAILABLE:
+            self._external_due = time.monotonic() + EXTERNAL_IP_RETRY_SEC
+        else:
+            self._external_due = time.monotonic() + EXTERNAL_IP_TTL_SEC
+        self._update(self.host_name, self.lan_ip, external_ip)
+
+    async def run(self):
+        """Periodic refresh; call refresh() once first so the cache starts populated."""
+        while not SHUTDOWN.is_set():
+            try:
+                await asyncio.wait_for(SHUTDOWN.wait(), timeout=ADDRESS_POLL_SEC)
+            except asyncio.TimeoutError:
+                pass
+            await self.refresh()
+
+
+def _resend_computer_info():
+    """Flag every connected display to receive the updated computer info frame."""
+    for target in TARGETS.values():
+        if not target.first_connection_to_ip:
+            target.send_name_and_ips_now = True
+
+
+ADDRESSES = AddressService(on_change=_resend_computer_info)
+
+
+# -----------------------------------------------------------------------------
+# UDP discovery handler
+# -----------------------------------------------------------------------------
+class TokenBucket:
+    """Allows rate events per second on average and up to burst at once."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+
+    def take(self) -> bool:
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        if self._tokens < 1.0:
+            return False
+        self._tokens -= 1.0
+        return True
+
+
+class UDPDiscoveryProtocol(asyncio.DatagramProtocol):
+    """
+    Receives the ESP32 advertisements. A datagram must get a token from the
+    rate limiter, must not repeat the sender's previous advertisement within
+    DISCOVERY_DEDUP_SEC and, unless CPUMONITORJR_DISCOVERY_CHECK_SOURCE=0,
+    must come from the address it advertises. Accepted advertisements are
+    coalesced per display and handed to on_ip in one batch per event loop
+    pass, so a storm of packets costs neither a task nor a log line each.
+    """
+
+    WARNING_EVERY_SEC = 60.0
+
+    def __init__(self, on_ip):
+        self.on_ip = on_ip
+        self.logger = logging.getLogger("CPUMonitorJr")
+        self._bucket = TokenBucket(DISCOVERY_RATE, DISCOVERY_BURST)
+        # sender address -> (last seen, last advertisement)
+        self.sources: Dict[str, Tuple[float, bytes]] = {}
+        self._pending: Dict[str, int] = {}
+        self._flush: Optional[asyncio.Task] = None
+        self._dropped = 0
+        self._warned_at = 0.0
+
+    def _drop(self, result: str):
+        METRICS.discovery_packets[result] += 1
+        if result not in ("rate_limited", "wrong_source"):
+            # Repeats, and other agents' "CPUMonitorJr-PC" probes, are routine
+            return
+        self._dropped += 1
+        now = time.monotonic()
+        if now - self._warned_at >= self.WARNING_EVERY_SEC:
+            self._warned_at = now
+            self.logger.warning("Ignoring a discovery storm or misaddressed advertisements: "
+                                "%d packet(s) dropped so far (%s)", self._dropped, dict(METRICS.discovery_packets))
+
+    def datagram_received(self, data, addr):
+        if not self._bucket.take():
+            self._drop("rate_limited")
+            return
+
+        sender = addr[0]
+        now = time.monotonic()
+        seen = self.sources.get(sender)
+        if seen is not None and seen[1] == data and now - seen[0] < DISCOVERY_DEDUP_SEC:
+            self.sources[sender] = (now, data)
+            self._drop("duplicate")
+            return
+
+        # The ESP32 sends "CPUMonitorJr;<IP>;" (optionally "CPUMonitorJr;<IP>;<PORT>")
+        msg = data.decode("ascii", errors="ignore").strip()
+        parts = msg.split(";")
+        if parts[0].strip() != "CPUMonitorJr" or len(parts) < 2 or not parts[1].strip():
+            self._drop("malformed")
+            return
+        ip = parts[1].strip()
+        port = DEFAULT_WS_PORT
+        if len(parts) >= 3 and parts[2].strip().isdigit():
+            port = int(parts[2].strip())
+            if not 0 < port < 65536:
+                port = DEFAULT_WS_PORT
+        if DISCOVERY_CHECK_SOURCE and ip != sender:
+            self.logger.debug("UDP discovery from %s advertises another address (%s), ignored", addr, ip)
+            self._drop("wrong_source")
+            return
+
+        if seen is None and len(self.sources) >= DISCOVERY_MAX_SOURCES:
+            self.prune(now - DISCOVERY_DEDUP_SEC)
+        if seen is not None or len(self.sources) < DISCOVERY_MAX_SOURCES:
+            self.sources[sender] = (now, data)
+        METRICS.discovery_packets["accepted"] += 1
+        self.logger.debug("UDP discovery from %s: ESP32 IP=%s", addr, ip)
+
+        self._pending[ip] = port
+        if self._flush is None:
+            self._flush = asyncio.get_running_loop().create_task(self._apply_pending())
+
+    async def _apply_pending(self):
+        """Hand every advertisement received since the last batch to on_ip, once per display."""
+        try:
+            while self._pending:
+                pending, self._pending = self._pending, {}
+                for ip, port in pending.items():
+                    await self.on_ip(ip, port)
+        finally:
+            self._flush = None
+
+    def prune(self, older_than: float):
+        """Forget sources not heard from since older_than (time.monotonic())."""
+        for sender in [k for k, (seen, _msg) in self.sources.items() if seen < older_than]:
+            del self.sources[sender]
+
+
+async def _active_discovery_broadcast():
+    """
+    Optional: send a small UDP broadcast periodically to prompt the ESP32
+    to identify itself. Disabled by default; enable with CPUMONITORJR_SEND_DISCOVERY=1.
+    """
+    logger = logging.getLogger("CPUMonitorJr")
+    
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.setblocking(False)
+    
+    try:
+        while not SHUTDOWN.is_set():
+            try:
+                data = f"CPUMonitorJr-PC;{ADDRESSES.lan_ip}".encode("ascii", errors="ignore")
+                sock.sendto(data, ("255.255.255.255", UDP_LISTEN_PORT))
+                logger.debug("Sent active discovery broadcast")
+            except Exception as e:
+                logger.debug("Active discovery send failed: %s", e)
+            # Send every 5 seconds
+            try:
+                await asyncio.wait_for(SHUTDOWN.wait(), timeout=5.0)
+            except asyncio.TimeoutError:
+                pass
+    finally:
+        sock.close()
+
+
+# -----------------------------------------------------------------------------
+# Multi-host aggregation (nodes relay their samples to one aggregator)
+# -----------------------------------------------------------------------------
+NODE_MAGIC = b"CMJN"
+NODE_VERSION = 1
+NODE_TAG_BYTES = 16
+
+
+def _node_tag(key: bytes, data: bytes) -> bytes:
+    return hmac.new(key, data, hashlib.sha256).digest()[:NODE_TAG_BYTES]
+
+
+def build_node_packet(name: str, lan: str, stats_frames: List[bytes], key: bytes = b"") -> bytes:
+    """
+    Node sample packet layout (one UDP datagram per tick, node -> aggregator):
+      bytes 0..3 = "CMJN"
+      byte 4     = version (1)
+      byte 5     = length of the host name, followed by the host name (UTF-8)
+      next byte  = length of the LAN IP, followed by the LAN IP (ASCII)
+      then the sample in stats frame layout (see join_stats_frames)
+      last 16 bytes = HMAC-SHA256 of all of the above, truncated; only when
+                      CPUMONITORJR_NODE_KEY is set
+    """
+    name_bytes = name.encode("utf-8", errors="ignore")[:255]
+    lan_bytes = lan.encode("ascii", errors="ignore")[:255]
+    packet = (NODE_MAGIC + bytes([NODE_VERSION, len(name_bytes)]) + name_bytes
+              + bytes([len(lan_bytes)]) + lan_bytes + join_stats_frames(stats_frames))
+    return packet + _node_tag(key, packet) if key else packet
+
+
+def parse_node_packet(data: bytes, key: bytes = b"") -> Tuple[str, str, bytes]:
+    """Return (host name, LAN IP, stats frame) of a node packet; raises ValueError if it is not one."""
+    if key:
+        data, tag = data[:-NODE_TAG_BYTES], data[-NODE_TAG_BYTES:]
+        if not hmac.compare_digest(tag, _node_tag(key, data)):
+            raise ValueError("bad signature")
+    if data[:4] != NODE_MAGIC or len(data) < 7 or data[4] != NODE_VERSION:
+        raise ValueError("not a node packet")
+    end = 6 + data[5]
+    name = data[6:end].decode("utf-8", errors="replace")
+    lan_end = end + 1 + data[end] if end < len(data) else len(data)
+    lan = data[end + 1:lan_end].decode("ascii", errors="replace")
+    frame = data[lan_end:]
+    if not name or len(frame) < 8 or frame[0] != 2:
+        raise ValueError("truncated node packet")
+    return name, lan, frame
+
+
+class NodeLink(asyncio.DatagramProtocol):
+    """A node's UDP link to its aggregator (CPUMONITORJR_AGGREGATOR)."""
+
+    def __init__(self, key: bytes = b""):
+        self.key = key
+        self.transport: Optional[asyncio.DatagramTransport] = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def error_received(self, exc):
+        # e.g. ECONNREFUSED while the aggregator is restarting; keep sending
+        logging.getLogger("CPUMonitorJr").debug("Aggregator link: %s", exc)
+
+    def send(self, stats_frames: List[bytes]):
+        if self.transport is not None:
+            self.transport.sendto(build_node_packet(ADDRESSES.host_name, ADDRESSES.lan_ip, stats_frames, self.key))
+
+
+class NodeState:
+    """The latest sample of one node."""
+
+    __slots__ = ("name", "lan", "source", "mem_percent", "avg_temp", "max_temp", "per_core", "seen")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.lan = ""
+        self.source = ""
+        self.mem_percent = 0.0
+        self.avg_temp = 0.0
+        self.max_temp = 0.0
+        self.per_core: List[int] = []
+        self.seen = 0.0
+
+
+class NodeAggregator(asyncio.DatagramProtocol):
+    """
+    Receives node packets (CPUMONITORJR_AGGREGATOR_PORT), keeps the latest
+    sample of every node and decides each tick what the displays show:
+    - "rotate": one host at a time (this one included), each for
+      ROTATE_SEC, with its own name and LAN IP in the info frame
+    - "summary": one bar per host (its average CPU load), the hosts' average
+      memory and temperatures and the maximum of their max temperatures,
+      named "<N> hosts"
+    Both use the existing frame types, so the ESP32 sketch is unchanged.
+    Nodes not heard from for NODE_EXPIRY_SEC are dropped. A node is keyed
+    by its name and source address, so two hosts that report the same name
+    are shown as two hosts (the conflict is logged) rather than overwriting
+    each other.
+    """
+
+    VIEWS = ("rotate", "summary")
+    RESULTS = ("accepted", "malformed", "unauthenticated", "too_many_nodes")
+
+    def __init__(self, view: str = "rotate", rotate_sec: float = 10.0, key: bytes = b""):
+        if view not in self.VIEWS:
+            raise ValueError(f"CPUMONITORJR_AGGREGATOR_VIEW must be one of {', '.join(self.VIEWS)}, not {view!r}")
+        self.view = view
+        self.rotate_sec = rotate_sec
+        self.key = key
+        self.logger = logging.getLogger("CPUMonitorJr")
+        self.nodes: Dict[Tuple[str, str], NodeState] = {}  # keyed by (name, source address)
+        self.packets = {result: 0 for result in self.RESULTS}
+        self._shown: Optional[Tuple[str, str]] = None  # node key, or None for this host
+        self.local_shown = True  # this host's own stats are on the displays
+        self._shown_since = 0.0
+        self._info: Optional[bytes] = None
+
+    def datagram_received(self, data, addr):
+        try:
+            name, lan, frame = parse_node_packet(data, self.key)
+        except ValueError as e:
+            self.packets["unauthenticated" if str(e) == "bad signature" else "malformed"] += 1
+            self.logger.debug("Ignored node packet from %s: %s", addr, e)
+            return
+        key = (name, addr[0])
+        node = self.nodes.get(key)
+        if node is None:
+            if len(self.nodes) >= MAX_NODES:
+                self.packets["too_many_nodes"] += 1
+                return
+            others = [source for n, source in self.nodes if n == name]
+            node = self.nodes[key] = NodeState(name)
+            node.source = addr[0]
+            self.logger.info(f"Node added: {name} ({addr[0]}, {len(self.nodes)} node(s))")
+            if others:
+                self.logger.warning(f"Node name {name} is also used by {', '.join(others)}; "
+                                    f"give the hosts different names to tell them apart")
+        cpus = len(frame) - 8
+        node.lan = lan or addr[0]
+        node.mem_percent, node.avg_temp, node.max_temp, node.per_core = _decode_record(frame, cpus)
+        node.seen = time.monotonic()
+        self.packets["accepted"] += 1
+
+    def prune(self, now: float):
+        for key in [k for k, node in self.nodes.items() if now - node.seen > NODE_EXPIRY_SEC]:
+            del self.nodes[key]
+            self.logger.info(f"Node expired: {key[0]} ({key[1]}, {len(self.nodes)} node(s))")
+
+    def info_frame(self) -> bytes:
+        return self._info if self._info is not None else ADDRESSES.info_frame()
+
+    def _set_info(self, frame: Optional[bytes]):
+        if frame != self._info:
+            self._info = frame
+            _resend_computer_info()
+
+    def select(self, mem_percent: float, avg_temp: float, max_temp: float,
+               per_core: List[float]) -> Tuple[float, float, float, List[float]]:
+        """Return the (memory, average temp, max temp, per-CPU loads) to show this tick, given this host's."""
+        now = time.monotonic()
+        self.prune(now)
+        if self.view == "summary":
+            hosts = [(mem_percent, avg_temp, max_temp, per_core)]
+            hosts += [(n.mem_percent, n.avg_temp, n.max_temp, n.per_core) for _, n in sorted(self.nodes.items())]
+            temps = [h[1] for h in hosts if h[1] > 0]
+            self.local_shown = False
+            self._set_info(build_computer_info_frame(f"{len(hosts)} hosts", ADDRESSES.lan_ip, ADDRESSES.external_ip))
+            return (sum(h[0] for h in hosts) / len(hosts),
+                    sum(temps) / len(temps) if temps else 0.0,
+                    max(h[2] for h in hosts),
+                    [sum(h[3]) / len(h[3]) if h[3] else 0.0 for h in hosts])
+
+        # Rotate: None stands for this host and comes first
+        order: List[Optional[Tuple[str, str]]] = [None] + sorted(self.nodes)
+        if self._shown not in order:
+            self._shown, self._shown_since = None, now
+        elif now - self._shown_since >= self.rotate_sec:
+            self._shown = order[(order.index(self._shown) + 1) % len(order)]
+            self._shown_since = now
+        node = self.nodes.get(self._shown) if self._shown is not None else None
+        self.local_shown = node is None
+        if node is None:
+            self._set_info(None)
+            return mem_percent, avg_temp, max_temp, per_core
+        self._set_info(build_computer_info_frame(node.name, node.lan, ADDRESSES.external_ip))
+        return node.mem_percent, node.avg_temp, node.max_temp, node.per_core
+
+
+# This agent's role: a node relaying to an aggregator, an aggregator, or neither
+NODE_LINK: Optional[NodeLink] = None
+NODE_AGGREGATOR: Optional[NodeAggregator] = None
+
+
+def current_info_frame() -> bytes:
+    """The computer info frame for the displays: the shown host's when aggregating."""
+    return NODE_AGGREGATOR.info_frame() if NODE_AGGREGATOR is not None else ADDRESSES.info_frame()
+
+
+def _parse_host_port(value: str, default_port: int) -> Tuple[str, int]:
+    host, sep, port = value.strip().rpartition(":")
+    if not sep or not port.isdigit():
+        return value.strip(), default_port
+    return host.strip("[]"), int(port)
+
+
+# -----------------------------------------------------------------------------
+# Send one data cycle (matching VB.NET's SendTimer_Elapsed logic)
+# -----------------------------------------------------------------------------
+async def send_one_cycle(sampler_thread: SamplerThread, cadence: Optional["AdaptiveCadence"] = None):
+    """
+    Mimics VB.NET's SendTimer_Elapsed function, fanned out to every display:
+    - Takes the latest sample from the sampler thread (CPUs already grouped)
+    - Retunes the send period from the change since the last tick (adaptive mode)
+    - Records the sample (if recording) and relays it to the aggregator (node mode)
+    - Picks the host to show from the nodes' samples (aggregator mode)
+    - Adds the busiest cgroups frame (CPUMONITORJR_CGROUP_TOP) and the
+      clock speed frame(s) (CPUMONITORJR_FREQ_FRAMES)
+    - Records the average load for the line graph backfill
+    - Hands the resulting stats frame(s) to each display's send queue
+    Each display's own send loop then decides what to send (time, info, or stats).
+    """
+    logger = logging.getLogger("CPUMonitorJr")
+    with sampler_thread.latest() as sample:
+        if sample is None:
+            # Nothing sampled since the last tick: skip it rather than resend old data
+            return
+        started = time.perf_counter()
+        per_core = sample.per_core
+        stats_frames = build_stats_frames(sample.mem_percent, sample.avg_temp, sample.max_temp, per_core)
+        METRICS.encode_seconds.observe(time.perf_counter() - started)
+        taken_at = sample.taken_at
+        if RECORDER is not None:
+            RECORDER.append(build_record(stats_frames, time.time() - (time.monotonic() - taken_at)), sample.columns)
+        if NODE_LINK is not None:
+            NODE_LINK.send(stats_frames)
+        loads = sample.per_core
+        if NODE_AGGREGATOR is not None:
+            shown = NODE_AGGREGATOR.select(sample.mem_percent, sample.avg_temp, sample.max_temp, per_core)
+            loads = per_core = shown[3]
+            stats_frames = build_stats_frames(*shown)
+        if NODE_AGGREGATOR is None or NODE_AGGREGATOR.local_shown:
+            if sample.top is not None:
+                stats_frames = stats_frames + [build_cgroup_frame(sample.top)]
+            if sample.freq is not None:
+                stats_frames = stats_frames + build_frequency_frames(*sample.freq, sampler_thread.frequencies.max_mhz)
+        if loads:
+            HISTORY.append(sum(loads) / len(loads), SCHEDULER.period)
+        if cadence is not None:
+            period = cadence.next_period(SCHEDULER.period, sample, per_core)
+            if period != SCHEDULER.period:
+                # The sampler follows once the tick is done, in phase with the new deadline
+                SCHEDULER.set_period(period)
+                logger.debug("Send interval now %.3fs", period)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Sampled stats: mem=%.1f%%, avg_temp=%.1f°C, max_temp=%.1f°C",
+                         sample.mem_percent, sample.avg_temp, sample.max_temp)
+
+    for target in list(TARGETS.values()):
+        # Displays that are not connected skip the tick; their connection
+        # supervisor reconnects them in the background
+        if target.can_send():
+            target.offer(stats_frames, taken_at)
+
+
+async def send_to_target(target: DisplayTarget, stats_frames: List[bytes], taken_at: float = 0.0):
+    """
+    Sends one frame to one display:
+    - Skips it if the display's WebSocket is down (connection_supervisor reconnects it)
+    - Sends appropriate data (time, info, or stats)
+    """
+    logger = logging.getLogger("CPUMonitorJr")
+
+    if not target.can_send():
+        return
+    ws = target.ws
+
+    try:
+        now = datetime.now()
 
         # VB.NET logic: send time on first connection or every 24 hours
-        if SEND_TIME_NOW or FIRST_CONNECTION_TO_IP or (now - LAST_TIME_SENT_AT) >= timedelta(hours=24):
-            logger.debug("Sending time frame")
+        if target.send_time_now or target.first_connection_to_ip or (now - target.last_time_sent_at) >= timedelta(hours=24):
+            logger.debug("Sending time frame to %s", target.ip)
             await ws.send(build_time_frame(now))
-            SEND_TIME_NOW = False
-            LAST_TIME_SENT_AT = now
-            if FIRST_CONNECTION_TO_IP:
+            target.send_time_now = False
+            target.last_time_sent_at = now
+            if target.first_connection_to_ip:
                 # After first time send, next cycle should send name/IPs
-                SEND_NAME_AND_IPS_NOW = True
-                FIRST_CONNECTION_TO_IP = False
+                target.send_name_and_ips_now = True
+                target.first_connection_to_ip = False
         # Send computer info if flagged
-        elif SEND_NAME_AND_IPS_NOW:
-            logger.debug("Sending computer info frame")
-            await ws.send(build_computer_info_frame())
-            SEND_NAME_AND_IPS_NOW = False
+        elif target.send_name_and_ips_now:
+            logger.debug("Sending computer info frame to %s", target.ip)
+            await ws.send(current_info_frame())
+            target.send_name_and_ips_now = False
+            # After a (re)connect, refill the display's line graph in one frame
+            if target.send_history_now:
+                target.send_history_now = False
+                if HISTORY_BACKFILL and len(HISTORY):
+                    logger.debug("Sending %d history readings to %s", len(HISTORY), target.ip)
+                    await ws.send(build_history_frame(*HISTORY.snapshot()))
         # Otherwise send stats
         else:
-            mem_percent = psutil.virtual_memory().percent
-            per_core = psutil.cpu_percent(interval=None, percpu=True)
-            avg_t, max_t = get_cpu_temperatures()
-            await ws.send(build_stats_frame(mem_percent, avg_t, max_t, per_core))
-            logger.debug(f"Sent stats: mem={mem_percent:.1f}%, avg_temp={avg_t:.1f}\u00b0C, max_temp={max_t:.1f}\u00b0C")
+            started = time.monotonic()
+            stamp = int(taken_at * 1e9).to_bytes(8, "little") if FRAME_TIMESTAMPS else b""
+            for frame in stats_frames:
+                await ws.send(target.encode_stats(frame) + stamp)
+            took = time.monotonic() - started
+            METRICS.send_seconds.observe(took)
+            if ADAPTIVE:
+                transport = getattr(ws, "transport", None)
+                buffered = transport.get_write_buffer_size() if transport is not None else 0
+                target.note_send(took, buffered, SCHEDULER.period)
 
     except Exception as e:
-        logger.debug(f"Send cycle error, dropping websocket: {e}")
-        # Drop WS so that next cycle will reconnect
-        await drop_ws()
+        logger.debug("Send to %s failed, dropping websocket: %s", target.ip, e)
+        # Drop WS so that its connection supervisor reconnects it
+        await drop_ws(target)
+
+
+async def target_send_loop(target: DisplayTarget):
+    """
+    Per-display sender: waits for the latest stats frame and sends it.
+    Runs concurrently for every display, so a slow connect or send on one
+    display only delays that display.
+    """
+    while not SHUTDOWN.is_set():
+        stats_frames, taken_at = await target.queue.get()
+        await send_to_target(target, stats_frames, taken_at)
+
+
+# -----------------------------------------------------------------------------
+# Tick scheduler (drift-free send cadence)
+# -----------------------------------------------------------------------------
+class TickScheduler:
+    """
+    Drives the send timer on absolute time.monotonic() deadlines
+    (start + k * period), so sampling, send and connect time never add to the
+    period and the cadence does not drift under load.
+
+    When a tick's work overruns one or more later deadlines those ticks are
+    not queued up: they are counted as missed and the schedule resumes at the
+    next deadline still in the future.
+
+    Each tick records its lateness (wake-up time minus deadline), its jitter
+    (change in lateness from the previous tick) and its work duration; stats()
+    summarises them over the last STATS_WINDOW ticks plus lifetime counters.
+    """
+
+    STATS_WINDOW = 256
+
+    def __init__(self, period: float):
+        self.period = period
+        self.ticks = 0
+        self.missed = 0
+        self._deadline: Optional[float] = None
+        self._retimed = asyncio.Event()  # set when the deadline moves while wait() sleeps
+        self._in_tick = False
+        self._started_at = 0.0
+        self.last_done = 0.0  # time.monotonic() when the last tick's work finished
+        self._last_lateness = 0.0
+        self._lateness: Deque[float] = deque(maxlen=self.STATS_WINDOW)
+        self._jitter: Deque[float] = deque(maxlen=self.STATS_WINDOW)
+        self._work: Deque[float] = deque(maxlen=self.STATS_WINDOW)
+
+    @property
+    def next_deadline(self) -> float:
+        """The deadline of the next tick (now, before the first one)."""
+        return self._deadline if self._deadline is not None else time.monotonic()
+
+    def set_period(self, period: float):
+        """Change the period; the next deadline is one new period after the last one."""
+        if self._deadline is not None and not self._in_tick:
+            self._deadline += period - self.period
+            self._retimed.set()
+        self.period = period
+
+    async def wait(self) -> bool:
+        """
+        Sleep until the next deadline, following it if set_period() moves it
+        meanwhile. Returns False if shutdown was requested.
+        """
+        if self._deadline is None:
+            self._deadline = time.monotonic()
+        while not SHUTDOWN.is_set():
+            self._retimed.clear()
+            delay = self._deadline - time.monotonic()
+            if delay <= 0:
+                break
+            waiters = [asyncio.ensure_future(SHUTDOWN.wait()), asyncio.ensure_future(self._retimed.wait())]
+            try:
+                await asyncio.wait(waiters, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+        if SHUTDOWN.is_set():
+            return False
+
+        self._started_at = time.monotonic()
+        lateness = self._started_at - self._deadline
+        self._lateness.append(lateness)
+        self._jitter.append(abs(lateness - self._last_lateness))
+        self._last_lateness = lateness
+        METRICS.tick_lateness_seconds.observe(max(0.0, lateness))
+        self.ticks += 1
+        self._in_tick = True
+        return True
+
+    def done(self):
+        """Mark the current tick's work finished and schedule the next deadline."""
+        now = time.monotonic()
+        self._in_tick = False
+        self.last_done = now
+        self._work.append(now - self._started_at)
+        self._deadline += self.period
+        if now >= self._deadline:
+            # Overran: skip (coalesce) every deadline that has already passed
+            skipped = int((now - self._deadline) // self.period) + 1
+            self.missed += skipped
+            self._deadline += skipped * self.period
+
+    @staticmethod
+    def _summary(values) -> Dict[str, float]:
+        if not values:
+            return {"avg_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+        ordered = sorted(values)
+        return {
+            "avg_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+            "p99_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] * 1000, 3),
+            "max_ms": round(ordered[-1] * 1000, 3),
+        }
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "period_s": self.period,
+            "ticks": self.ticks,
+            "missed": self.missed,
+            "lateness": self._summary(self._lateness),
+            "jitter": self._summary(self._jitter),
+            "work": self._summary(self._work),
+        }
+
+
+SCHEDULER = TickScheduler(WS_INTERVAL_SEC)
+
+
+def log_tick_stats():
+    """Log the send timer and display connection statistics (triggered by SIGUSR1)."""
+    logger = logging.getLogger("CPUMonitorJr")
+    logger.info(f"Send timer stats: {SCHEDULER.stats()}")
+    for target in list(TARGETS.values()):
+        logger.info(f"Display {target.ip} connection stats: {target.connection_stats()}")
+
+
+# -----------------------------------------------------------------------------
+# Adaptive send cadence (CPUMONITORJR_ADAPTIVE)
+# -----------------------------------------------------------------------------
+class AdaptiveCadence:
+    """
+    Picks the send period from how much the stats move between frames.
+
+    Each tick compares memory, temperatures and every core load with the
+    previous tick. If any of them moved by ADAPTIVE_THRESHOLD or more the
+    period drops straight to the minimum, so an incident shows up at full
+    rate; otherwise it stretches by SLOWDOWN towards the maximum, so an idle
+    host samples and sends rarely. A sample that is not newer than the
+    previous one tells nothing about change and leaves the period as it is.
+    """
+
+    SLOWDOWN = 1.5
+
+    def __init__(self, min_interval: float, max_interval: float, threshold: float):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.threshold = threshold
+        self._last: List[float] = []
+        self._taken_at = 0.0
+
+    def next_period(self, period: float, sample: Sample, per_core: List[float]) -> float:
+        if sample.taken_at <= self._taken_at:
+            return period
+        self._taken_at = sample.taken_at
+        last = self._last
+        changed = len(last) != 3 + len(per_core)
+        if not changed:
+            threshold = self.threshold
+            changed = (abs(sample.mem_percent - last[0]) >= threshold
+                       or abs(sample.avg_temp - last[1]) >= threshold
+                       or abs(sample.max_temp - last[2]) >= threshold
+                       or any(abs(a - b) >= threshold for a, b in zip(per_core, last[3:])))
+        last[:] = (sample.mem_percent, sample.avg_temp, sample.max_temp)
+        last.extend(per_core)
+        if changed:
+            return self.min_interval
+        return min(self.max_interval, period * self.SLOWDOWN)
 
 
 # -----------------------------------------------------------------------------
 # Send timer loop (replaces VB.NET's timer)
 # -----------------------------------------------------------------------------
+# The running send timer's sampler thread and adaptive cadence (changed through the control socket)
+SAMPLER_THREAD: Optional[SamplerThread] = None
+CADENCE: Optional[AdaptiveCadence] = None
+
+
 async def send_timer_loop():
     """
     Mimics VB.NET's SendTimer with Interval setting.
-    Periodically calls send_one_cycle.
+    Calls send_one_cycle on SCHEDULER's fixed-rate deadlines.
     """
+    global SAMPLER_THREAD, CADENCE
     logger = logging.getLogger("CPUMonitorJr")
-    logger.info(f"Starting send timer with interval {WS_INTERVAL_SEC}s")
+    cadence = None
+    if ADAPTIVE:
+        cadence = AdaptiveCadence(ADAPTIVE_MIN_INTERVAL_SEC, ADAPTIVE_MAX_INTERVAL_SEC, ADAPTIVE_THRESHOLD)
+        SCHEDULER.set_period(ADAPTIVE_MIN_INTERVAL_SEC)
+        logger.info(f"Starting adaptive send timer, interval {ADAPTIVE_MIN_INTERVAL_SEC}s to "
+                    f"{ADAPTIVE_MAX_INTERVAL_SEC}s, threshold {ADAPTIVE_THRESHOLD}")
+    else:
+        logger.info(f"Starting send timer with interval {WS_INTERVAL_SEC}s")
     
-    # Prime CPU monitoring
-    psutil.cpu_percent(interval=None, percpu=True)
+    sampler_thread = SamplerThread(make_sampler(), SCHEDULER.period, SAMPLES_PER_INTERVAL, AGGREGATE_MODE,
+                                   make_cgroup_monitor(), make_frequency_monitor(),
+                                   max_period=ADAPTIVE_MAX_INTERVAL_SEC if ADAPTIVE else 0.0,
+                                   topology=CpuTopology(CORE_GROUPING))
+    logger.info(f"Using {sampler_thread.sampler.name} sampler, {sampler_thread.samples_per_interval} sample(s) "
+                f"per interval, {AGGREGATE_MODE} aggregation")
+    sampler_thread.start()
+    SAMPLER_THREAD, CADENCE = sampler_thread, cadence
+    watchdog_task = asyncio.create_task(systemd_watchdog(sampler_thread)) if SYSTEMD.enabled else None
     
-    while not SHUTDOWN.is_set():
-        # Only send if we have a target IP
-        async with IP_LOCK:
-            has_ip = TARGET_ESP32_IP is not None
-            
-        if has_ip:
-            await send_one_cycle()
-            
-        # Wait for interval
-        try:
-            await asyncio.wait_for(SHUTDOWN.wait(), timeout=WS_INTERVAL_SEC)
-        except asyncio.TimeoutError:
-            pass
+    try:
+        # Wait for each interval deadline
+        while await SCHEDULER.wait():
+            # Only sample if at least one display has advertised itself,
+            # samples are being recorded or this is an aggregator's node
+            if TARGETS or RECORDER is not None or NODE_LINK is not None:
+                await send_one_cycle(sampler_thread, cadence)
+            SCHEDULER.done()
+            sampler_thread.follow(SCHEDULER.next_deadline, SCHEDULER.period)
+    finally:
+        if watchdog_task is not None:
+            watchdog_task.cancel()
+        SAMPLER_THREAD = CADENCE = None
+        sampler_thread.stop()
 
 
 # -----------------------------------------------------------------------------
 # WebSocket connection management (persistent connection like VB.NET)
 # -----------------------------------------------------------------------------
-async def drop_ws():
-    global WS, WS_IP
-    if WS is not None:
+async def drop_ws(target: DisplayTarget):
+    if target.ws is not None:
         try:
-            await WS.close()
+            await target.ws.close()
         except Exception:
             pass
-    WS = None
-    WS_IP = None
+    target.ws = None
 
 
-async def ensure_ws_connected() -> Optional[websockets.WebSocketClientProtocol]:
-    """Ensure we have a persistent websocket connected to TARGET_ESP32_IP.
-    On first connect or after reconnect, set flags so time/name/IP get resent.
+async def ensure_ws_connected(target: DisplayTarget) -> Optional[websockets.WebSocketClientProtocol]:
+    """Make one attempt to connect a persistent websocket to the display.
+    Only connection_supervisor calls this, so a slow or failing connect never
+    holds up sampling or the sends to other displays.
+    On connect, set flags so time/name/IP get resent.
     """
     logger = logging.getLogger("CPUMonitorJr")
-    global WS, WS_IP, SEND_TIME_NOW, SEND_NAME_AND_IPS_NOW, FIRST_CONNECTION_TO_IP
 
-    async with IP_LOCK:
-        ip = TARGET_ESP32_IP
+    if target.ws is not None and not target.ws.closed:
+        return target.ws
 
-    if not ip:
-        await drop_ws()
+    # Close any prior
+    await drop_ws(target)
+
+    host = target.ip if target.port == DEFAULT_WS_PORT else f"{target.ip}:{target.port}"
+    url = f"ws://{host}/cpumonitorjr{UDP_LISTEN_PORT}"
+    target.connect_attempts += 1
+    started = time.monotonic()
+    try:
+        # Use defaults for ping_interval to keep the connection alive
+        ws = await asyncio.wait_for(
+            websockets.connect(
+                url,
+                max_size=None,
+                ping_interval=None,  # disable pings; ESP32 server may not respond
+                close_timeout=2,
+            ),
+            timeout=CONNECT_TIMEOUT_SEC,
+        )
+    except Exception as e:
+        retry_in = target.connect_failed()
+        if target.consecutive_failures == 1:
+            logger.info("WebSocket connect failed to %s: %r; retrying with backoff", url, e)
+        logger.debug("WebSocket connect to %s failed %d time(s) in a row, next attempt in %.1fs",
+                     url, target.consecutive_failures, retry_in)
         return None
 
-    # Reconnect if no WS or IP changed
-    if WS is None or WS_IP != ip or WS.closed:
-        # Close any prior
-        if WS is not None and not WS.closed:
-            try:
-                await WS.close()
-            except Exception:
-                pass
-        WS = None
-        WS_IP = None
+    # On (re)connect, schedule time and computer info to be resent
+    target.send_time_now = True
+    target.send_name_and_ips_now = False  # will be set True after time is sent
+    target.first_connection_to_ip = True
+    # A new connection starts from a keyframe and an empty line graph
+    target.last_cores = None
+    target.send_history_now = True
+    target.ws = ws
+    took = time.monotonic() - started
+    target.connect_succeeded(took)
+    METRICS.connect_seconds.observe(took)
+    logger.info(f"WebSocket connected to {url}")
+    return ws
 
-        url = f"ws://{ip}/cpumonitorjr{UDP_LISTEN_PORT}"
-        try:
-            # Use defaults for ping_interval to keep the connection alive
-            WS = await asyncio.wait_for(
-                websockets.connect(
-                    url,
-                    max_size=None,
-                    ping_interval=None,  # disable pings; ESP32 server may not respond
-                    close_timeout=2,
-                ),
-                timeout=5.0,
-            )
-            WS_IP = ip
-            # On (re)connect, schedule time and computer info to be resent
-            SEND_TIME_NOW = True
-            SEND_NAME_AND_IPS_NOW = False  # will be set True after time is sent
-            FIRST_CONNECTION_TO_IP = True
-            logger.info(f"WebSocket connected to {url}")
-        except Exception as e:
-            logger.debug(f"WebSocket connect failed to {url}: {e}")
-            WS = None
-            WS_IP = None
-            return None
 
-    return WS
+async def connection_supervisor(target: DisplayTarget):
+    """
+    Keeps one display connected, in the background: connects, waits for the
+    websocket to close (the display went away or a send failed), and
+    reconnects. After a failed attempt the circuit opens for a jittered,
+    exponentially growing delay, then one half-open trial attempt either
+    closes it again or reopens it for longer.
+    """
+    while not SHUTDOWN.is_set():
+        if target.circuit == CIRCUIT_OPEN:
+            # Wait out the backoff, unless the display advertises itself again
+            try:
+                await asyncio.wait_for(target.wake.wait(), timeout=target.retry_in)
+            except asyncio.TimeoutError:
+                pass
+            target.circuit = CIRCUIT_HALF_OPEN
+        target.wake.clear()
+        ws = await ensure_ws_connected(target)
+        if ws is not None:
+            await ws.wait_closed()
+            logging.getLogger("CPUMonitorJr").debug("WebSocket to %s closed", target.ip)
 
 
 # -----------------------------------------------------------------------------
 # UDP discovery callback
 # -----------------------------------------------------------------------------
-async def set_target_ip(ip: str):
+async def set_target_ip(ip: str, port: int = DEFAULT_WS_PORT):
     """
     Called when UDP discovery is received.
-    Sets the target IP and flags for first connection.
+    Registers the display (with first connection flags) and starts its sender.
+    Displays that are already registered keep their connection, unless they
+    now advertise a different websocket port; one whose reconnects are
+    backing off is retried at once.
     """
-    global TARGET_ESP32_IP, FIRST_CONNECTION_TO_IP, SEND_TIME_NOW, SEND_NAME_AND_IPS_NOW
     logger = logging.getLogger("CPUMonitorJr")
     
     if not ip:
         return
 
-    async with IP_LOCK:
-        old_ip = TARGET_ESP32_IP
-        TARGET_ESP32_IP = ip
+    if ip in TARGETS:
+        target = TARGETS[ip]
+        if target.readvertised():
+            logger.debug("Target %s re-advertised while backing off; reconnecting now", ip)
+        if target.port != port:
+            # Moved to another port; the connection supervisor reconnects there
+            logger.info(f"Target {ip} now uses websocket port {port}")
+            target.port = port
+            await drop_ws(target)
+        else:
+            logger.debug("Target IP re-advertised: %s", ip)
+        return
+
+    target = DisplayTarget(ip, port)
+    target.connector = asyncio.create_task(connection_supervisor(target))
+    target.task = asyncio.create_task(target_send_loop(target))
+    TARGETS[ip] = target
+    logger.info(f"Target IP added: {ip} ({len(TARGETS)} display(s))")
 
-    if old_ip != ip:
-        logging.getLogger("CPUMonitorJr").info(f"Target IP changed from {old_ip} to {ip}")
-        # Trigger reconnect to the new IP; flags will be set on connect
-        await drop_ws()
-    else:
-        logging.getLogger("CPUMonitorJr").info(f"Target IP re-advertised: {ip}")
+
+async def expire_targets(protocol: UDPDiscoveryProtocol):
+    """
+    Forgets displays that are not connected and have not advertised
+    themselves for TARGET_EXPIRY_SEC (a connected display never re-advertises,
+    so it is never expired, and neither is a pinned one), and discovery
+    sources not heard from for as long.
+    """
+    logger = logging.getLogger("CPUMonitorJr")
+    while True:
+        await asyncio.sleep(TARGET_EXPIRY_CHECK_SEC)
+        cutoff = time.monotonic() - TARGET_EXPIRY_SEC
+        protocol.prune(cutoff)
+        expired = [t for t in TARGETS.values()
+                   if not t.pinned and not t.can_send() and t.last_advertised < cutoff]
+        for target in expired:
+            del TARGETS[target.ip]
+            logger.info(f"Target IP expired: {target.ip} ({len(TARGETS)} display(s))")
+        await stop_targets(expired)
+
+
+async def drop_all_targets():
+    """Stop every display's sender and connection supervisor and close its websocket."""
+    targets = list(TARGETS.values())
+    TARGETS.clear()
+    await stop_targets(targets)
+
+
+async def stop_targets(targets: List[DisplayTarget]):
+    """Stop the given displays' tasks and close their websockets."""
+    tasks = [t for target in targets for t in (target.task, target.connector) if t]
+    for task in tasks:
+        task.cancel()
+    for task in tasks:
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+    for target in targets:
+        await drop_ws(target)
 
 
 def install_signals():
@@ -559,55 +3557,616 @@ def install_signals():
     with contextlib.suppress(Exception):
         signal.signal(signal.SIGTERM, handle)
 
+    # SIGUSR1 logs the send timer statistics
+    def dump(_sig, _frm):
+        asyncio.get_event_loop().call_soon_threadsafe(log_tick_stats)
+    with contextlib.suppress(Exception):
+        signal.signal(signal.SIGUSR1, dump)
+
+
+# -----------------------------------------------------------------------------
+# Metrics endpoint (CPUMONITORJR_METRICS_PORT / CPUMONITORJR_METRICS_SOCKET)
+# -----------------------------------------------------------------------------
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Answer one HTTP GET with the OpenMetrics text, then close the connection."""
+    try:
+        request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout=5.0)
+        parts = request.split(b" ", 2)
+        path = parts[1].split(b"?", 1)[0] if len(parts) > 2 else b""
+        if parts[0] == b"GET" and path in (b"/", b"/metrics"):
+            status = b"200 OK"
+            body = METRICS.render().encode("utf-8")
+        else:
+            status = b"404 Not Found"
+            body = b"Not found\n"
+        writer.write(b"HTTP/1.0 " + status + b"\r\n"
+                     b"Content-Type: application/openmetrics-text; version=1.0.0; charset=utf-8\r\n"
+                     b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+                     b"Connection: close\r\n\r\n" + body)
+        await writer.drain()
+    except Exception as e:
+        logging.getLogger("CPUMonitorJr").debug("Metrics request failed: %s", e)
+    finally:
+        writer.close()
+
+
+async def start_metrics_servers() -> List[asyncio.AbstractServer]:
+    """Start the configured metrics endpoints; a failure to bind is logged, not fatal."""
+    logger = logging.getLogger("CPUMonitorJr")
+    servers = []
+    if METRICS_PORT:
+        try:
+            servers.append(await asyncio.start_server(_serve_metrics, METRICS_ADDRESS, METRICS_PORT))
+            logger.info(f"Serving metrics on http://{METRICS_ADDRESS}:{METRICS_PORT}/metrics")
+        except OSError as e:
+            logger.warning(f"Metrics endpoint not available on {METRICS_ADDRESS}:{METRICS_PORT}: {e}")
+    if METRICS_SOCKET:
+        try:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(METRICS_SOCKET)  # stale socket from a previous run
+            servers.append(await asyncio.start_unix_server(_serve_metrics, METRICS_SOCKET))
+            logger.info(f"Serving metrics on unix socket {METRICS_SOCKET}")
+        except OSError as e:
+            logger.warning(f"Metrics endpoint not available on {METRICS_SOCKET}: {e}")
+    return servers
+
+
+# -----------------------------------------------------------------------------
+# Control socket (CPUMONITORJR_CONTROL_SOCKET; python3 cpumonitorjr.py ctl ...)
+# -----------------------------------------------------------------------------
+CONTROL_USAGE = """commands:
+  status                         settings and displays
+  sample                         the newest raw sample
+  stats                          send timer and display connection statistics
+  interval <seconds>             change the send interval (the minimum in adaptive mode)
+  sampling <n> [avg|peak|p<NN>]  change the samples per interval and their aggregation
+  sampler auto|proc|psutil       switch the sampler
+  pin <ip>[:port]                add a display (if new) and never expire it
+  unpin <ip>                     let a pinned display expire again
+  resend [<ip>]                  resend the time and computer info to all displays (or one)"""
+
+
+def _control_sampler_thread() -> SamplerThread:
+    if SAMPLER_THREAD is None:
+        raise ValueError("the send timer is not running")
+    return SAMPLER_THREAD
+
+
+def _control_target(ip: str) -> DisplayTarget:
+    target = TARGETS.get(ip)
+    if target is None:
+        raise ValueError(f"unknown display {ip}")
+    return target
+
+
+def _control_status() -> Dict[str, object]:
+    sampler_thread = _control_sampler_thread()
+    return {
+        "interval_s": round(SCHEDULER.period, 6),
+        "adaptive": {"min_s": CADENCE.min_interval, "max_s": CADENCE.max_interval} if CADENCE else None,
+        "sampler": sampler_thread.sampler.name,
+        "samples_per_interval": sampler_thread.samples_per_interval,
+        "aggregate": sampler_thread.aggregate_mode,
+        "role": "node" if NODE_LINK is not None else "aggregator" if NODE_AGGREGATOR is not None else "host",
+        "displays": {ip: {"port": t.port, "pinned": t.pinned, "connected": t.can_send(), "circuit": t.circuit}
+                     for ip, t in TARGETS.items()},
+    }
+
+
+async def run_control_command(words: List[str]) -> object:
+    """
+    Run one control command (see CONTROL_USAGE) and return its result.
+    Raises ValueError for an unknown command or bad arguments. Nothing here
+    restarts the agent or drops a display's connection.
+    """
+    logger = logging.getLogger("CPUMonitorJr")
+    command, args = (words[0].lower(), words[1:]) if words else ("help", [])
+
+    if command == "help":
+        return CONTROL_USAGE
+    if command == "status":
+        return _control_status()
+    if command == "stats":
+        return {"send_timer": SCHEDULER.stats(),
+                "displays": {ip: t.connection_stats() for ip, t in TARGETS.items()}}
+    if command == "sample":
+        sample = _control_sampler_thread().peek()
+        if sample is None:
+            raise ValueError("no sample taken yet")
+        taken_at, columns, values = sample
+        return {"age_s": round(time.monotonic() - taken_at, 3), "mem_percent": round(values[0], 1),
+                "avg_temp": round(values[1], 1), "max_temp": round(values[2], 1),
+                columns: [round(v, 1) for v in values[3:]]}
+
+    if command == "interval" and len(args) == 1:
+        try:
+            seconds = float(args[0])
+        except ValueError:
+            raise ValueError(f"not a number of seconds: {args[0]!r}") from None
+        if not MIN_INTERVAL_SEC <= seconds <= 3600:
+            raise ValueError(f"the interval must be between {MIN_INTERVAL_SEC} and 3600 seconds")
+        sampler_thread = _control_sampler_thread()
+        if CADENCE is not None:
+            CADENCE.min_interval = seconds
+            CADENCE.max_interval = max(CADENCE.max_interval, seconds)
+        SCHEDULER.set_period(seconds)
+        sampler_thread.follow(SCHEDULER.next_deadline, seconds)
+        logger.info(f"Send interval set to {seconds}s")
+        return _control_status()
+    if command == "sampling" and len(args) in (1, 2):
+        sampler_thread = _control_sampler_thread()
+        if not args[0].isdigit() or not 1 <= int(args[0]) <= 1000:
+            raise ValueError(f"samples per interval must be 1 to 1000, not {args[0]!r}")
+        sampler_thread.set_sampling(int(args[0]), args[1] if len(args) > 1 else sampler_thread.aggregate_mode)
+        logger.info(f"Sampling set to {sampler_thread.samples_per_interval} sample(s) per interval, "
+                    f"{sampler_thread.aggregate_mode} aggregation")
+        return _control_status()
+    if command == "sampler" and len(args) == 1 and args[0].lower() in ("auto", "proc", "psutil"):
+        sampler_thread = _control_sampler_thread()
+        # make_sampler() opens and reads /proc and sysfs, which can stall, so it runs off the event loop
+        sampler = await asyncio.get_running_loop().run_in_executor(None, make_sampler, args[0].lower())
+        sampler_thread.set_sampler(sampler)
+        logger.info(f"Switching to the {sampler.name} sampler")
+        return f"switching to the {sampler.name} sampler"
+
+    if command == "pin" and len(args) == 1:
+        if NODE_LINK is not None:
+            raise ValueError("this agent is a node; it does not serve displays")
+        ip, port = _parse_host_port(args[0], DEFAULT_WS_PORT)
+        try:
+            socket.inet_aton(ip)
+        except OSError:
+            raise ValueError(f"not an IPv4 address: {ip!r}") from None
+        await set_target_ip(ip, port)
+        TARGETS[ip].pinned = True
+        logger.info(f"Target IP pinned: {ip}")
+        return _control_status()["displays"]
+    if command == "unpin" and len(args) == 1:
+        target = _control_target(args[0])
+        target.pinned = False
+        # It now expires like a discovered display, counting from now
+        target.last_advertised = time.monotonic()
+        logger.info(f"Target IP unpinned: {target.ip}")
+        return _control_status()["displays"]
+    if command == "resend" and len(args) <= 1:
+        targets = [_control_target(args[0])] if args else list(TARGETS.values())
+        for target in targets:
+            target.send_time_now = True
+            if not target.first_connection_to_ip:
+                target.send_name_and_ips_now = True
+        return f"time and computer info are sent with the next frame to {len(targets)} display(s)"
+
+    raise ValueError(f"unknown command or wrong arguments: {' '.join(words)!r}\n{CONTROL_USAGE}")
+
+
+async def _serve_control(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    """Run one control command line and answer with one JSON line, then close the connection."""
+    logger = logging.getLogger("CPUMonitorJr")
+    try:
+        line = await asyncio.wait_for(reader.readline(), timeout=5.0)
+        words = line.decode("utf-8", errors="replace").split()
+        try:
+            reply = {"ok": True, "result": await run_control_command(words)}
+        except ValueError as e:
+            reply = {"ok": False, "error": str(e)}
+        except Exception as e:
+            # A bug or an I/O error in the command: still answer, so ctl can show it
+            logger.warning(f"Control command {' '.join(words)!r} failed: {e!r}")
+            reply = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+        writer.write(json.dumps(reply).encode("utf-8") + b"\n")
+        await writer.drain()
+    except Exception as e:
+        logger.debug("Control request failed: %s", e)
+    finally:
+        writer.close()
+
+
+async def start_control_server() -> Optional[asyncio.AbstractServer]:
+    """Start the control socket if configured; a failure to bind is logged, not fatal."""
+    logger = logging.getLogger("CPUMonitorJr")
+    if not CONTROL_SOCKET:
+        return None
+    try:
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(CONTROL_SOCKET)  # stale socket from a previous run
+        server = await asyncio.start_unix_server(_serve_control, CONTROL_SOCKET)
+        # The agent's own user and group only (and root)
+        os.chmod(CONTROL_SOCKET, 0o660)
+        logger.info(f"Accepting control commands on unix socket {CONTROL_SOCKET}")
+        return server
+    except OSError as e:
+        logger.warning(f"Control socket not available on {CONTROL_SOCKET}: {e}")
+        return None
+
+
+def ctl_main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="cpumonitorjr.py ctl", description="Change or inspect a running agent",
+                                     epilog=CONTROL_USAGE, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", default=CONTROL_SOCKET or DEFAULT_CONTROL_SOCKET,
+                        help=f"the agent's control socket (default $CPUMONITORJR_CONTROL_SOCKET or {DEFAULT_CONTROL_SOCKET})")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="command and its arguments")
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.error("no command given")
+
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(10.0)
+            sock.connect(args.socket)
+            sock.sendall(" ".join(args.command).encode("utf-8") + b"\n")
+            data = b""
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                data += chunk
+        reply = json.loads(data)
+    except (OSError, ValueError) as e:
+        print(f"cpumonitorjr.py ctl: {args.socket}: {e}", file=sys.stderr)
+        return 1
+
+    if not reply.get("ok"):
+        print(f"cpumonitorjr.py ctl: {reply.get('error')}", file=sys.stderr)
+        return 1
+    result = reply.get("result")
+    print(result if isinstance(result, str) else json.dumps(result, indent=1))
+    return 0
+
+
+# -----------------------------------------------------------------------------
+# Export subcommand (python3 cpumonitorjr.py export ...)
+# -----------------------------------------------------------------------------
+def _parse_duration(text: str) -> float:
+    """Seconds in "90", "90s", "15m", "2h" or "1d"."""
+    units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+    text = text.strip().lower()
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def _parse_time(text: str) -> float:
+    """Epoch seconds of an ISO 8601 date/time (local time unless it has an offset)."""
+    return datetime.fromisoformat(text).timestamp()
+
+
+def downsample(rows: List[Tuple[float, float, float, float, List[int]]], every: float,
+               mode: str = "avg") -> List[Tuple[float, float, float, float, List[float]]]:
+    """
+    Folds rows of (time, mem, avg temp, max temp, loads) into one row per
+    `every` seconds, stamped with the start of its bucket. "avg" averages
+    every column, "peak" keeps each column's maximum.
+    """
+    buckets: Dict[int, list] = {}
+    for row in rows:
+        buckets.setdefault(int(row[0] // every), []).append(row)
+    out = []
+    for key in sorted(buckets):
+        group = buckets[key]
+        fold = max if mode == "peak" else (lambda values: sum(values) / len(values))
+        columns = [fold([row[i] for row in group]) for i in (1, 2, 3)]
+        loads = [fold(values) for values in zip(*(row[4] for row in group))]
+        out.append((key * every, round(columns[0], 1), round(columns[1], 1), round(columns[2], 1),
+                    [round(v, 1) for v in loads]))
+    return out
+
+
+def export_main(argv: List[str]) -> int:
+    parser = argparse.ArgumentParser(prog="cpumonitorjr.py export",
+                                     description="Export samples recorded with CPUMONITORJR_RECORD_FILE")
+    parser.add_argument("--file", default=RECORD_FILE, required=not RECORD_FILE,
+                        help="recording to read (default $CPUMONITORJR_RECORD_FILE)")
+    parser.add_argument("--from", dest="start", help="first time to export, ISO 8601 (e.g. 2025-06-01T14:30)")
+    parser.add_argument("--to", dest="end", help="last time to export, ISO 8601")
+    parser.add_argument("--last", help="export only this much before --to or now (e.g. 90s, 15m, 2h, 1d)")
+    parser.add_argument("--every", default="0",
+                        help="downsample to one row per this many seconds (e.g. 60, 5m; default every sample)")
+    parser.add_argument("--agg", choices=("avg", "peak"), default="avg", help="how --every folds samples (default avg)")
+    parser.add_argument("--format", choices=("csv", "json"), default="csv", help="output format (default csv)")
+    parser.add_argument("--output", default="-", help="file to write (default standard output)")
+    args = parser.parse_args(argv)
+
+    try:
+        end = _parse_time(args.end) if args.end else float("inf")
+        start = _parse_time(args.start) if args.start else float("-inf")
+        if args.last:
+            start = max(start, min(end, time.time()) - _parse_duration(args.last))
+        every = _parse_duration(args.every)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        cpus, columns, samples = read_recording(args.file)
+    except (OSError, ValueError) as e:
+        print(f"cpumonitorjr.py export: {e}", file=sys.stderr)
+        return 1
+
+    rows = [(stamp,) + _decode_record(frame, cpus) for stamp, frame in samples if start <= stamp <= end]
+    if every > 0:
+        rows = downsample(rows, every, args.agg)
+
+    def iso(stamp: float) -> str:
+        return datetime.fromtimestamp(stamp).astimezone().isoformat(timespec="milliseconds")
+
+    out = sys.stdout if args.output == "-" else open(args.output, "w", newline="")
+    try:
+        if args.format == "json":
+            json.dump([{"time": iso(r[0]), "mem_percent": r[1], "avg_temp": r[2], "max_temp": r[3],
+                        columns: r[4]} for r in rows], out, indent=1)
+            out.write("\n")
+        else:
+            writer = csv.writer(out)
+            writer.writerow(["time", "mem_percent", "avg_temp", "max_temp"] + [f"{columns}{i}" for i in range(cpus)])
+            for r in rows:
+                writer.writerow([iso(r[0]), r[1], r[2], r[3]] + r[4])
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 0
+
+
+# -----------------------------------------------------------------------------
+# systemd integration (sd_notify readiness, watchdog and status; socket activation)
+# -----------------------------------------------------------------------------
+class SystemdNotifier:
+    """
+    Sends sd_notify(3) messages ("READY=1", "WATCHDOG=1", "STATUS=...") as
+    plain datagrams to $NOTIFY_SOCKET. Does nothing when the agent was not
+    started by a Type=notify unit; send errors are only logged at debug level.
+    """
+
+    def __init__(self):
+        path = os.getenv("NOTIFY_SOCKET", "")
+        # A leading "@" names a socket in the abstract namespace
+        self.address = "\0" + path[1:] if path.startswith("@") else path
+        usec = os.getenv("WATCHDOG_USEC", "")
+        pid = os.getenv("WATCHDOG_PID", "")
+        watched = usec.isdigit() and (not pid or pid == str(os.getpid()))
+        self.watchdog_sec = int(usec) / 1e6 if watched else 0.0  # 0.0: no WatchdogSec= set
+        self._status = ""
+        self._sock: Optional[socket.socket] = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.address)
+
+    def notify(self, message: str):
+        if not self.address:
+            return
+        try:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM | socket.SOCK_CLOEXEC)
+            self._sock.sendto(message.encode("utf-8", errors="replace"), self.address)
+        except OSError as e:
+            logging.getLogger("CPUMonitorJr").debug("sd_notify %r failed: %s", message, e)
+
+    def status(self, text: str):
+        """Publish a STATUS= line (shown by systemctl status) when it changed."""
+        if text != self._status:
+            self._status = text
+            self.notify(f"STATUS={text}")
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+SYSTEMD = SystemdNotifier()
+
+
+def _status_line(rate: float, problem: Optional[str]) -> str:
+    """The STATUS= text: who the frames go to and at what rate (or why they don't)."""
+    if problem:
+        return f"Stalled: {problem}"
+    if NODE_LINK is not None:
+        return f"Sending samples to aggregator {AGGREGATOR_ADDRESS}, {rate:.1f} samples/s"
+    targets = list(TARGETS.values())
+    if not targets:
+        text = f"Waiting for a display on UDP port {UDP_LISTEN_PORT}"
+    else:
+        connected = [t.ip for t in targets if t.can_send()]
+        shown = ", ".join(connected[:4]) + (", ..." if len(connected) > 4 else "")
+        text = f"{len(connected)}/{len(targets)} display(s) connected"
+        text += f" ({shown}), {rate:.1f} frames/s" if connected else ""
+    if NODE_AGGREGATOR is not None:
+        text += f", {len(NODE_AGGREGATOR.nodes)} node(s)"
+    return text
+
+
+async def systemd_watchdog(sampler_thread: SamplerThread):
+    """
+    Pings the systemd watchdog at half of WatchdogSec=, but only while the
+    send timer keeps completing ticks and the sampler thread keeps delivering
+    samples; a hung connect or a wedged sensor read then withholds the ping
+    and systemd restarts the service. Also keeps STATUS= current.
+    """
+    logger = logging.getLogger("CPUMonitorJr")
+    every = STATUS_EVERY_SEC
+    if SYSTEMD.watchdog_sec:
+        every = min(every, SYSTEMD.watchdog_sec / 2)
+        logger.info(f"systemd watchdog enabled ({SYSTEMD.watchdog_sec:g}s)")
+    started = last_at = time.monotonic()
+    last_ticks = SCHEDULER.ticks
+    stalled = False
+    while True:
+        await asyncio.sleep(every)
+        now = time.monotonic()
+        # Allow a few periods (the adaptive cadence may have stretched it) plus a slow send
+        limit = WATCHDOG_STALL_TICKS * SCHEDULER.period + 1.0
+        problem = None
+        tick_age = now - (SCHEDULER.last_done or started)
+        sample_age = now - (sampler_thread.sampled_at or started)
+        if tick_age > limit:
+            problem = f"no send tick completed for {tick_age:.1f}s"
+        elif sample_age > limit:
+            problem = f"no new sample for {sample_age:.1f}s"
+        if problem is None:
+            if SYSTEMD.watchdog_sec:
+                SYSTEMD.notify("WATCHDOG=1")
+            if stalled:
+                stalled = False
+                logger.info("Send loop recovered; systemd watchdog pings resumed")
+        elif not stalled:
+            stalled = True
+            logger.warning(f"Send loop stalled ({problem}); withholding the systemd watchdog ping")
+        rate = (SCHEDULER.ticks - last_ticks) / max(1e-9, now - last_at)
+        last_ticks, last_at = SCHEDULER.ticks, now
+        SYSTEMD.status(_status_line(rate, problem))
+
+
+def inherited_discovery_socket() -> Optional[socket.socket]:
+    """
+    The UDP discovery socket handed over by systemd socket activation
+    (cpumonitorjr.socket), or None. Takes the datagram socket named
+    "discovery" in $LISTEN_FDNAMES, else the first datagram socket passed.
+    """
+    if os.getenv("LISTEN_PID") != str(os.getpid()):
+        return None
+    count = int(os.getenv("LISTEN_FDS", "0") or 0)
+    names = os.getenv("LISTEN_FDNAMES", "").split(":")
+    for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+        # Not for any child process
+        os.environ.pop(name, None)
+    chosen = None
+    for i in range(count):
+        fd = SD_LISTEN_FDS_START + i
+        try:
+            sock = socket.socket(fileno=fd)
+        except OSError:
+            continue
+        os.set_inheritable(fd, False)
+        if sock.type != socket.SOCK_DGRAM or sock.family != socket.AF_INET:
+            sock.detach()
+            continue
+        if chosen is None or (i < len(names) and names[i] == "discovery"):
+            if chosen is not None:
+                chosen.detach()
+            chosen = sock
+        else:
+            sock.detach()
+    if chosen is not None:
+        chosen.setblocking(False)
+    return chosen
+
 
 # -----------------------------------------------------------------------------
 # Main
 # -----------------------------------------------------------------------------
 async def main_async(no_logging: bool = False):
+    global NODE_LINK, NODE_AGGREGATOR
     logger = setup_logging(enabled=not no_logging)
     install_signals()
     logger.info(f"Starting CPUMonitorJr (UDP port {UDP_LISTEN_PORT}, interval {WS_INTERVAL_SEC:.3f}s)")
-    
-    # Start UDP discovery listener
     loop = asyncio.get_running_loop()
-    transport, _protocol = await loop.create_datagram_endpoint(
-        lambda: UDPDiscoveryProtocol(set_target_ip),
-        local_addr=("0.0.0.0", UDP_LISTEN_PORT),
-        allow_broadcast=True,
-    )
-    logger.info(f"Listening for UDP discovery on port {UDP_LISTEN_PORT}")
-    
+    transport = protocol = node_transport = None
+
+    if AGGREGATOR_ADDRESS:
+        # Node mode: relay samples to the aggregator instead of serving displays
+        host, port = _parse_host_port(AGGREGATOR_ADDRESS, DEFAULT_AGGREGATOR_PORT)
+        node_transport, NODE_LINK = await loop.create_datagram_endpoint(
+            lambda: NodeLink(NODE_KEY), remote_addr=(host, port))
+        logger.info(f"Sending samples to aggregator {host}:{port}")
+    else:
+        # Start UDP discovery listener, on the socket systemd passed in if socket activated
+        sock = inherited_discovery_socket()
+        if sock is not None:
+            port = sock.getsockname()[1]
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: UDPDiscoveryProtocol(set_target_ip), sock=sock)
+            logger.info(f"Listening for UDP discovery on port {port} (socket activated)")
+            if port != UDP_LISTEN_PORT:
+                logger.warning(f"cpumonitorjr.socket listens on port {port}, not CPUMONITORJR_UDP_PORT "
+                               f"({UDP_LISTEN_PORT})")
+        else:
+            transport, protocol = await loop.create_datagram_endpoint(
+                lambda: UDPDiscoveryProtocol(set_target_ip),
+                local_addr=("0.0.0.0", UDP_LISTEN_PORT),
+                allow_broadcast=True,
+            )
+            logger.info(f"Listening for UDP discovery on port {UDP_LISTEN_PORT}")
+
+        # Start the optional aggregator listener
+        if AGGREGATOR_PORT:
+            node_transport, NODE_AGGREGATOR = await loop.create_datagram_endpoint(
+                lambda: NodeAggregator(AGGREGATOR_VIEW, ROTATE_SEC, NODE_KEY),
+                local_addr=("0.0.0.0", AGGREGATOR_PORT),
+            )
+            logger.info(f"Aggregating nodes on UDP port {AGGREGATOR_PORT} ({AGGREGATOR_VIEW} view)")
+
+    # The UDP endpoints are bound: tell systemd (Type=notify) the service is up
+    SYSTEMD.notify("READY=1")
+    SYSTEMD.status(_status_line(0.0, None))
+
+    # Resolve computer name / addresses in the background
+    await ADDRESSES.refresh()
+    address_task = asyncio.create_task(ADDRESSES.run())
+
     # Start optional active discovery
     discovery_task = None
-    if ACTIVE_DISCOVERY:
+    if ACTIVE_DISCOVERY and protocol is not None:
         discovery_task = asyncio.create_task(_active_discovery_broadcast())
         
     # Start send timer loop (replaces VB.NET's timer)
     send_task = asyncio.create_task(send_timer_loop())
+
+    # Forget displays that went away
+    expiry_task = asyncio.create_task(expire_targets(protocol)) if protocol is not None else None
+
+    # Start the optional metrics endpoints and control socket
+    metrics_servers = await start_metrics_servers()
+    control_server = await start_control_server()
+
+    # Start the optional sample recorder
+    record_task = asyncio.create_task(record_loop(RECORDER)) if RECORDER is not None else None
     
     # Run until shutdown
     await SHUTDOWN.wait()
     logger.info("Shutting down...")
+    SYSTEMD.notify("STOPPING=1")
     
     # Cleanup
     send_task.cancel()
-    if discovery_task:
-        discovery_task.cancel()
-    try:
-        await send_task
-    except asyncio.CancelledError:
-        pass
-    if discovery_task:
+    address_task.cancel()
+    for task in (send_task, address_task):
         try:
-            await discovery_task
+            await task
         except asyncio.CancelledError:
             pass
-    transport.close()
+    for task in (expiry_task, discovery_task, record_task):
+        if task:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+    for server in metrics_servers:
+        server.close()
+        await server.wait_closed()
+    if METRICS_SOCKET and metrics_servers:
+        with contextlib.suppress(OSError):
+            os.unlink(METRICS_SOCKET)
+    if control_server is not None:
+        control_server.close()
+        await control_server.wait_closed()
+        with contextlib.suppress(OSError):
+            os.unlink(CONTROL_SOCKET)
+    await drop_all_targets()
+    for t in (transport, node_transport):
+        if t is not None:
+            t.close()
+    SYSTEMD.close()
     logger.info("Stopped.")
 
 
 def main():
-    asyncio.run(main_async(no_logging=_is_nologging_flag_present()))
+    if sys.argv[1:2] == ["export"]:
+        sys.exit(export_main(sys.argv[2:]))
+    if sys.argv[1:2] == ["ctl"]:
+        sys.exit(ctl_main(sys.argv[2:]))
+    try:
+        asyncio.run(main_async(no_logging=_is_nologging_flag_present()))
+    finally:
+        stop_logging()
 
 
 if __name__ == "__main__":
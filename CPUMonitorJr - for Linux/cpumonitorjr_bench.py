@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# =============================================================================
+#
+# CPUMonitorJr (for Linux) - benchmarks
+# Copyright Rob Latour, 2025
+# License MIT
+#
+# =============================================================================
+#
+# Development tool, not needed to run CPUMonitorJr. Run it from the folder that
+# contains cpumonitorjr.py:
+#
+#   python3 cpumonitorjr_bench.py sampler                # this machine's /proc
+#   python3 cpumonitorjr_bench.py sampler --cores 384    # synthetic 384 CPU host
+#   python3 cpumonitorjr_bench.py conformance            # frame encoder vs reference, exit 1 on mismatch
+#   python3 cpumonitorjr_bench.py encode                 # encode cost per frame by CPU count
+#
+# =============================================================================
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Callable, List
+
+import psutil
+
+import cpumonitorjr as cmj
+
+
+# -----------------------------------------------------------------------------
+# Helpers
+# -----------------------------------------------------------------------------
+def _cpu_time_per_call(fn: Callable[[], object], samples: int, between: Callable[[], None] = None) -> float:
+    """Return the average process CPU time (seconds) of one fn() call."""
+    fn()  # warm up / prime deltas
+    spent = 0.0
+    for _ in range(samples):
+        if between:
+            between()
+        start = time.process_time()
+        fn()
+        spent += time.process_time() - start
+    return spent / samples
+
+
+def write_synthetic_procfs(root: str, cores: int, ticks: List[int]):
+    """Write /proc/stat and /proc/meminfo files for a host with the given number of CPUs."""
+    for i in range(len(ticks)):
+        ticks[i] += random.randint(0, 100)
+    lines = ["cpu  %d 0 %d %d 0 0 0 0 0 0" % (sum(ticks), sum(ticks) // 4, cores * 1000)]
+    for i in range(cores):
+        lines.append("cpu%d %d 0 %d %d 0 0 0 0 0 0" % (i, ticks[i], ticks[i] // 4, 1000 + ticks[i] // 2))
+    lines.append("intr 0")
+    lines.append("ctxt 0")
+    with open(os.path.join(root, "stat"), "w") as f:
+        f.write("\n".join(lines) + "\n")
+    with open(os.path.join(root, "meminfo"), "w") as f:
+        f.write("MemTotal:       263859276 kB\n"
+                "MemFree:        101234567 kB\n"
+                "MemAvailable:   198765432 kB\n"
+                "Buffers:          1234567 kB\n"
+                "Cached:          87654321 kB\n")
+
+
+# -----------------------------------------------------------------------------
+# sampler: native /proc sampler vs psutil
+# -----------------------------------------------------------------------------
+def bench_sampler(args) -> int:
+    if args.cores:
+        # Point both samplers at the same synthetic procfs. psutil reads
+        # temperatures from the real /sys, so this compares cpu + memory only.
+        root = tempfile.mkdtemp(prefix="cpumonitorjr-bench-")
+        ticks = [0] * args.cores
+        write_synthetic_procfs(root, args.cores, ticks)
+        psutil.PROCFS_PATH = root
+        native = cmj.ProcSampler(proc_root=root, hwmon_root=os.path.join(root, "none"),
+                                 thermal_root=os.path.join(root, "none"))
+
+        def via_psutil():
+            psutil.virtual_memory()
+            psutil.cpu_percent(interval=None, percpu=True)
+
+        def refresh():
+            write_synthetic_procfs(root, args.cores, ticks)
+
+        cores = args.cores
+        label = f"synthetic host, {cores} CPUs, cpu + memory"
+    else:
+        native = cmj.ProcSampler()
+        via_psutil = cmj.PsutilSampler().sample
+        refresh = None
+        cores = psutil.cpu_count() or 0
+        label = f"this host, {cores} CPUs, cpu + memory + temperatures"
+
+    if args.cores:
+        # Both paths must agree before their cost is worth comparing
+        native.sample()
+        psutil.cpu_percent(interval=None, percpu=True)
+        refresh()
+        if list(native.sample()[3]) != psutil.cpu_percent(interval=None, percpu=True):
+            print("WARNING: native and psutil per-core values differ", file=sys.stderr)
+
+    t_native = _cpu_time_per_call(native.sample, args.samples, refresh)
+    t_psutil = _cpu_time_per_call(via_psutil, args.samples, refresh)
+    native.close()
+
+    print(f"Sampler benchmark ({label}, {args.samples} samples)")
+    print(f"  psutil : {t_psutil * 1e6:10.1f} us CPU per sample")
+    print(f"  native : {t_native * 1e6:10.1f} us CPU per sample")
+    if t_native > 0:
+        print(f"  speedup: {t_psutil / t_native:10.1f}x")
+    return 0
+
+
+# -----------------------------------------------------------------------------
+# Reference frame encoder: the original Decimal based builders, kept verbatim
+# so the fast encoder in cpumonitorjr.py can be checked byte for byte
+# -----------------------------------------------------------------------------
+def ref_round_half_up_1dp(x: float) -> float:
+    return float(Decimal(str(x)).quantize(Decimal("0.1"), rounding=ROUND_HALF_UP))
+
+
+def ref_whole_dec(x: float):
+    x1 = ref_round_half_up_1dp(x)
+    whole = int(x1) % 256
+    dec = int(round(x1 * 10)) - whole * 10
+    dec = (dec + 10) % 10
+    return whole, dec
+
+
+def ref_build_stats_frame(mem_percent: float, avg_temp: float, max_temp: float, per_core: List[float]) -> bytes:
+    m_whole, m_dec = ref_whole_dec(mem_percent)
+    a_whole, a_dec = ref_whole_dec(avg_temp)
+    x_whole, x_dec = ref_whole_dec(max_temp)
+    cores = [max(0, min(100, int(round(c)))) for c in per_core]
+    n = max(0, min(255, len(cores)))
+    frame = bytearray(8 + n)
+    frame[0] = 2
+    frame[1] = m_whole
+    frame[2] = m_dec
+    frame[3] = a_whole
+    frame[4] = a_dec
+    frame[5] = x_whole
+    frame[6] = x_dec
+    frame[7] = n
+    for i, v in enumerate(cores[:n]):
+        frame[8 + i] = v
+    return bytes(frame)
+
+
+def ref_build_stats_frames(mem_percent: float, avg_temp: float, max_temp: float,
+                           per_core: List[float]) -> List[bytes]:
+    if len(per_core) <= 255:
+        return [ref_build_stats_frame(mem_percent, avg_temp, max_temp, per_core)]
+    header = ref_build_stats_frame(mem_percent, avg_temp, max_temp, [])
+    total = min(len(per_core), 0xFFFF)
+    cores = bytes(max(0, min(100, int(round(c)))) for c in per_core[:total])
+    frames = []
+    for first in range(0, total, cmj.MAX_CORES_PER_FRAME):
+        chunk = cores[first:first + cmj.MAX_CORES_PER_FRAME]
+        frames.append(bytes([4]) + header[1:7]
+                      + bytes([total & 0xFF, total >> 8, first & 0xFF, first >> 8, len(chunk)]) + chunk)
+    return frames
+
+
+def _outcome(fn, *args):
+    """fn(*args), or the type of exception it raised (both encoders must fail alike)."""
+    try:
+        return fn(*args)
+    except Exception as e:
+        return type(e)
+
+
+# -----------------------------------------------------------------------------
+# conformance: fast frame encoder vs the reference encoder
+# -----------------------------------------------------------------------------
+def _edge_values() -> List[float]:
+    values = [0.0, -0.0, 0.05, 0.15, 0.25, 0.35, 0.45, 1.05, 2.25, 2.675, 1.005, 99.95, 100.0, 100.05,
+              254.95, 255.0, 255.05, 255.95, 256.0, 300.5, 511.96, 1000.25, 65535.55, 999999.95,
+              1e7 + 0.05, 1e12, 1e300, 5e-324, float("inf"), float("-inf"), float("nan")]
+    values += [-v for v in values]
+    # Exact .x5 midpoints and their floating point neighbours
+    for k in range(-2001, 2001, 2):
+        mid = k / 20
+        values += [mid, math.nextafter(mid, math.inf), math.nextafter(mid, -math.inf)]
+    return values
+
+
+def bench_conformance(args) -> int:
+    rng = random.Random(args.seed)
+    values = _edge_values()
+    values += [rng.uniform(-300, 300) for _ in range(args.random)]
+    values += [round(rng.uniform(-300, 300), 2) for _ in range(args.random)]
+    values += [rng.randint(0, 2000) / 1000 for _ in range(args.random)]
+
+    failures = 0
+
+    def check(what: str, expected, actual):
+        nonlocal failures
+        if expected != actual and repr(expected) != repr(actual):  # nan != nan
+            failures += 1
+            if failures <= 20:
+                print(f"MISMATCH {what}: reference {expected!r}, encoder {actual!r}")
+
+    for v in values:
+        check(f"round_half_up_1dp({v!r})", _outcome(ref_round_half_up_1dp, v), _outcome(cmj.round_half_up_1dp, v))
+        check(f"_whole_dec({v!r})", _outcome(ref_whole_dec, v), _outcome(cmj._whole_dec, v))
+
+    core_values = [-5.0, -0.5, -0.4, 0.0, 0.4999, 0.5, 1.5, 2.5, 49.5, 50.5, 99.4, 99.5, 100.0, 100.4,
+                   100.5, 150.0, 255.9, 1e9]
+    checked_frames = 0
+    for cores in (0, 1, 2, 16, 63, 64, 65, 128, 255, 256, 300, 479, 480, 481, 1024, 4096):
+        for _ in range(args.frames):
+            per_core = [rng.choice(core_values) if rng.random() < 0.3 else rng.uniform(-10, 110)
+                        for _ in range(cores)]
+            mem, avg, mx = rng.choice(values), rng.choice(values), rng.choice(values)
+            check(f"build_stats_frames({mem!r}, {avg!r}, {mx!r}, <{cores} CPUs>)",
+                  _outcome(ref_build_stats_frames, mem, avg, mx, per_core),
+                  _outcome(cmj.build_stats_frames, mem, avg, mx, per_core))
+            checked_frames += 1
+    for bad in (float("nan"), float("inf")):
+        for cores in (4, 100):
+            per_core = [1.0] * (cores - 1) + [bad]
+            check(f"build_stats_frames(<{cores} CPUs with {bad}>)",
+                  _outcome(ref_build_stats_frames, 1.0, 1.0, 1.0, per_core),
+                  _outcome(cmj.build_stats_frames, 1.0, 1.0, 1.0, per_core))
+            checked_frames += 1
+
+    print(f"Encoder conformance: {len(values)} values, {checked_frames} frames, {failures} mismatch(es)")
+    return 1 if failures else 0
+
+
+# -----------------------------------------------------------------------------
+# encode: encode cost per frame as the CPU count grows
+# -----------------------------------------------------------------------------
+def _wall_time_per_call(fn: Callable[[], object], seconds: float) -> float:
+    """Return the best-of-3 average wall time (seconds) of one fn() call."""
+    fn()
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        if time.perf_counter() - start >= seconds / 3:
+            break
+        calls *= 2
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        for _ in range(calls):
+            fn()
+        best = min(best, (time.perf_counter() - start) / calls)
+    return best
+
+
+def bench_encode(args) -> int:
+    rng = random.Random(1)
+    print(f"Stats frame encode cost per sample (NumPy {'on' if cmj.np is not None else 'off'})")
+    print(f"  {'CPUs':>6} {'reference':>12} {'encoder':>12} {'speedup':>8}")
+    for cores in args.cores:
+        per_core = [rng.uniform(0, 100) for _ in range(cores)]
+        mem, avg, mx = rng.uniform(0, 100), rng.uniform(30, 90), rng.uniform(30, 90)
+        t_ref = _wall_time_per_call(lambda: ref_build_stats_frames(mem, avg, mx, per_core), args.seconds)
+        t_new = _wall_time_per_call(lambda: cmj.build_stats_frames(mem, avg, mx, per_core), args.seconds)
+        print(f"  {cores:>6} {t_ref * 1e6:9.1f} us {t_new * 1e6:9.1f} us {t_ref / t_new:7.1f}x")
+    return 0
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+def main() -> int:
+    parser = argparse.ArgumentParser(description="CPUMonitorJr benchmarks")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("sampler", help="CPU time per sample: native /proc sampler vs psutil")
+    p.add_argument("--cores", type=int, default=0, help="use a synthetic procfs with this many CPUs")
+    p.add_argument("--samples", type=int, default=500, help="samples per sampler (default 500)")
+    p.set_defaults(func=bench_sampler)
+
+    p = sub.add_parser("conformance", help="check the frame encoder byte for byte against the reference encoder")
+    p.add_argument("--random", type=int, default=20000, help="random values per distribution (default 20000)")
+    p.add_argument("--frames", type=int, default=50, help="random frames per CPU count (default 50)")
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=bench_conformance)
+
+    p = sub.add_parser("encode", help="stats frame encode cost per sample: reference vs encoder")
+    p.add_argument("--cores", type=int, nargs="+", default=[4, 16, 64, 128, 255, 256, 1024, 4096],
+                   help="CPU counts to measure (default 4 16 64 128 255 256 1024 4096)")
+    p.add_argument("--seconds", type=float, default=0.5, help="measuring time per encoder and CPU count")
+    p.set_defaults(func=bench_encode)
+
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
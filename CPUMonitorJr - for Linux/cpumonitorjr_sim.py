@@ -0,0 +1,537 @@
+#!/usr/bin/env python3
+# =============================================================================
+#
+# CPUMonitorJr (for Linux) - simulated ESP32 displays and fleet benchmark
+# Copyright Rob Latour, 2025
+# License MIT
+#
+# =============================================================================
+#
+# Development tool, not needed to run CPUMonitorJr. Run it from the folder that
+# contains cpumonitorjr.py.
+#
+# Each simulated display advertises itself over UDP discovery as
+# "CPUMonitorJr;<IP>;<PORT>", serves the websocket at /cpumonitorjr<UDP port>
+# and decodes every frame the way the ESP32 sketch does. The displays listen
+# on their own loopback addresses (127.0.1.1, 127.0.1.2, ...), so no real
+# hardware or network is needed.
+#
+#   python3 cpumonitorjr_sim.py run --devices 4
+#       simulate 4 displays for an agent that is already running
+#
+#   python3 cpumonitorjr_sim.py bench --devices 1,16 --intervals 1,0.2 --cores 0,384
+#       start the agent for every combination of display count, send interval
+#       and (synthetic) CPU count and report stats frames per second,
+#       sample-to-receive latency, and the agent's CPU% and RSS. Exits with 1
+#       when a --max-* / --min-delivery threshold is exceeded, so it can gate
+#       performance changes.
+#
+# =============================================================================
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+import psutil
+import websockets
+
+from cpumonitorjr_bench import write_synthetic_procfs
+
+AGENT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cpumonitorjr.py")
+
+ADVERTISE_THRESHOLD_SEC = 15  # as the sketch: re-advertise after this long without data
+GRAPH_READINGS = 316  # pixels across the sketch's line graph
+GRAPH_MS_PER_READING = 35  # the sketch's line graph moves one pixel per ~35 ms loop
+MAX_NUMBER_OF_PROCESSORS = 96  # bars the sketch can show
+TIMESTAMP_BYTES = 8  # CPUMONITORJR_FRAME_TIMESTAMPS trailer
+
+
+# -----------------------------------------------------------------------------
+# Display state (decodes frames as the sketch's onWsEvent does)
+# -----------------------------------------------------------------------------
+class DisplayState:
+    """What the ESP32 sketch would hold and show after the frames received so far."""
+
+    def __init__(self):
+        self.clock: Optional[tuple] = None  # (year, month, day, day of week, hour, minute, second)
+        self.computer_name = ""
+        self.lan_address = ""
+        self.external_address = ""
+        self.readings_available = False
+        self.memory = 0.0
+        self.average_temp = 0.0
+        self.maximum_temp = 0.0
+        self.cpu_values: List[float] = []
+        self.cpu_average = 0.0
+        self.graph: List[int] = [0] * GRAPH_READINGS
+        self._chunk_total: List[float] = []
+        self._chunk_count: List[int] = []
+        self._chunk_next = 0
+        self._chunk_series_total = 0
+        self.top_cgroups: List[tuple] = []  # (name, CPU %, memory %), busiest first
+        self.cpu_mhz: List[int] = []
+        self.maximum_mhz = 0
+        self.throttle_events = 0  # since connected
+        self.rejected = 0  # frames the sketch would have ignored
+
+    def apply(self, data: bytes) -> bool:
+        """Decode one frame. Returns True when it completed a set of CPU readings."""
+        if not data:
+            self.rejected += 1
+            return False
+        handler = {0: self._time, 1: self._info, 2: self._stats, 3: self._delta,
+                   4: self._chunked, 5: self._history, 6: self._top_cgroups,
+                   7: self._frequency}.get(data[0])
+        if handler is None:
+            self.rejected += 1
+            return False
+        return handler(data)
+
+    def _header(self, data: bytes):
+        self.memory = data[1] + data[2] / 10
+        self.average_temp = data[3] + data[4] / 10
+        self.maximum_temp = data[5] + data[6] / 10
+
+    def _time(self, data: bytes) -> bool:
+        if len(data) < 8:
+            self.rejected += 1
+            return False
+        self.clock = (data[1] + 2000, data[2], data[3], data[4], data[5], data[6], data[7])
+        return False
+
+    def _info(self, data: bytes) -> bool:
+        fields = ["", "", ""]
+        index = 0
+        for ch in data[1:].decode("ascii", errors="replace"):
+            if ch == ";":
+                index += 1
+            elif index < 3:
+                fields[index] += ch
+        self.computer_name, self.lan_address, self.external_address = fields
+        return False
+
+    def _stats(self, data: bytes) -> bool:
+        if len(data) < 8 or len(data) < 8 + data[7]:
+            self.rejected += 1
+            return False
+        self._header(data)
+        n = data[7]
+        self.cpu_values = list(data[8:8 + n])
+        self.cpu_average = sum(self.cpu_values) / n if n else 0.0
+        self.readings_available = True
+        return True
+
+    def _delta(self, data: bytes) -> bool:
+        n = len(self.cpu_values)
+        bitmap_length = (n + 7) // 8
+        if not self.readings_available or len(data) < 8 or data[7] != n or len(data) < 8 + bitmap_length:
+            self.rejected += 1
+            return False
+        self._header(data)
+        value_index = 8 + bitmap_length
+        for i in range(n):
+            if value_index >= len(data):
+                break
+            if data[8 + i // 8] & (1 << (i % 8)):
+                self.cpu_values[i] = data[value_index]
+                value_index += 1
+        self.cpu_average = sum(self.cpu_values) / n if n else 0.0
+        return True
+
+    def _chunked(self, data: bytes) -> bool:
+        if len(data) < 12:
+            self.rejected += 1
+            return False
+        total = data[7] + (data[8] << 8)
+        first = data[9] + (data[10] << 8)
+        count = data[11]
+        if total == 0 or len(data) < 12 + count or first + count > total:
+            self.rejected += 1
+            return False
+        bars = min(total, MAX_NUMBER_OF_PROCESSORS)
+        if first == 0:
+            self._chunk_total = [0.0] * bars
+            self._chunk_count = [0] * bars
+            self._chunk_next = 0
+            self._chunk_series_total = total
+        if first != self._chunk_next or total != self._chunk_series_total:
+            # A chunk went missing or belongs to another series; wait for the start of the next one
+            self.rejected += 1
+            return False
+        for i in range(count):
+            b = (first + i) * bars // total
+            self._chunk_total[b] += data[12 + i]
+            self._chunk_count[b] += 1
+        self._chunk_next = first + count
+        if self._chunk_next < total:
+            return False
+        self._header(data)
+        self.cpu_values = [t / c if c else 0.0 for t, c in zip(self._chunk_total, self._chunk_count)]
+        self.cpu_average = sum(self._chunk_total) / total
+        self.readings_available = True
+        return True
+
+    def _history(self, data: bytes) -> bool:
+        if len(data) < 3:
+            self.rejected += 1
+            return False
+        n = data[1] + (data[2] << 8)
+        if len(data) < 3 + 3 * n:
+            self.rejected += 1
+            return False
+        pixel = 0
+        for r in range(n - 1, -1, -1):
+            if pixel >= GRAPH_READINGS:
+                break
+            load = data[3 + 3 * r]
+            ms = data[4 + 3 * r] + (data[5 + 3 * r] << 8)
+            pixels = max(1, (ms + GRAPH_MS_PER_READING // 2) // GRAPH_MS_PER_READING)
+            for _ in range(min(pixels, GRAPH_READINGS - pixel)):
+                self.graph[pixel] = load
+                pixel += 1
+        return False
+
+    def _top_cgroups(self, data: bytes) -> bool:
+        if len(data) < 2:
+            self.rejected += 1
+            return False
+        top = []
+        i = 2
+        for _ in range(data[1]):
+            if i + 5 > len(data) or i + 5 + data[i + 4] > len(data):
+                break
+            name = data[i + 5:i + 5 + data[i + 4]].decode("ascii", errors="replace")
+            top.append((name, data[i] + data[i + 1] / 10, data[i + 2] + data[i + 3] / 10))
+            i += 5 + data[i + 4]
+        self.top_cgroups = top
+        return False
+
+    def _frequency(self, data: bytes) -> bool:
+        if len(data) < 10 or len(data) < 10 + 3 * data[5]:
+            self.rejected += 1
+            return False
+        total = data[1] + (data[2] << 8)
+        first = data[3] + (data[4] << 8)
+        if len(self.cpu_mhz) != total:
+            self.cpu_mhz = [0] * total
+        self.maximum_mhz = data[6] + (data[7] << 8)
+        if first == 0:
+            self.throttle_events += data[8] + (data[9] << 8)
+        for i in range(data[5]):
+            if first + i < total:
+                self.cpu_mhz[first + i] = data[10 + 3 * i] + (data[11 + 3 * i] << 8)
+            self.throttle_events += data[12 + 3 * i]
+        return False
+
+
+# -----------------------------------------------------------------------------
+# Simulated display
+# -----------------------------------------------------------------------------
+class SimulatedDisplay:
+    """One simulated ESP32: UDP advertisement plus the websocket server."""
+
+    def __init__(self, ip: str, ws_port: int, udp_port: int, agent_host: str = "127.0.0.1",
+                 timestamps: bool = False):
+        self.ip = ip
+        self.ws_port = ws_port
+        self.udp_port = udp_port
+        self.agent_host = agent_host
+        self.timestamps = timestamps
+        self.state = DisplayState()
+        self.frames: Dict[int, int] = {}
+        self.updates = 0  # completed sets of CPU readings
+        self.latencies: List[float] = []
+        self.connections = 0
+        self.last_data_at = 0.0
+        self._server = None
+
+    def reset_counters(self):
+        self.frames.clear()
+        self.updates = 0
+        self.latencies.clear()
+
+    async def start(self):
+        self._server = await websockets.serve(self._handler, self.ip, self.ws_port, max_size=None)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    def advertise(self):
+        message = f"CPUMonitorJr;{self.ip};{self.ws_port}".encode("ascii")
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.bind((self.ip, 0))
+            sock.sendto(message, (self.agent_host, self.udp_port))
+        # As the sketch: advertising counts as activity for the next threshold
+        self.last_data_at = time.monotonic()
+
+    async def _handler(self, ws, path: str = None):
+        if path is None:
+            path = ws.request.path if hasattr(ws, "request") else ws.path
+        if path != f"/cpumonitorjr{self.udp_port}":
+            await ws.close(code=1008)
+            return
+        self.connections += 1
+        try:
+            async for data in ws:
+                self.on_frame(data)
+        except websockets.ConnectionClosed:
+            pass
+
+    def on_frame(self, data: bytes):
+        received_at = time.monotonic()
+        self.last_data_at = received_at
+        if self.timestamps and data and data[0] in (2, 3, 4, 6, 7) and len(data) > TIMESTAMP_BYTES:
+            taken_at = int.from_bytes(data[-TIMESTAMP_BYTES:], "little") / 1e9
+            data = data[:-TIMESTAMP_BYTES]
+        else:
+            taken_at = 0.0
+        self.frames[data[0]] = self.frames.get(data[0], 0) + 1
+        if self.state.apply(data):
+            self.updates += 1
+            if taken_at:
+                self.latencies.append(received_at - taken_at)
+
+    async def run(self):
+        """Advertise now and again whenever no data has arrived for ADVERTISE_THRESHOLD_SEC."""
+        self.advertise()
+        while True:
+            await asyncio.sleep(1.0)
+            if time.monotonic() - self.last_data_at > ADVERTISE_THRESHOLD_SEC:
+                self.advertise()
+
+
+async def start_displays(devices: int, ws_port: int, udp_port: int, agent_host: str,
+                         timestamps: bool) -> List[SimulatedDisplay]:
+    displays = []
+    for i in range(devices):
+        display = SimulatedDisplay(f"127.0.{1 + i // 250}.{1 + i % 250}", ws_port, udp_port, agent_host, timestamps)
+        await display.start()
+        displays.append(display)
+    return displays
+
+
+# -----------------------------------------------------------------------------
+# run: simulated displays for an agent that is already running
+# -----------------------------------------------------------------------------
+async def run_displays(args) -> int:
+    displays = await start_displays(args.devices, args.ws_port, args.udp_port, args.agent_host, False)
+    tasks = [asyncio.create_task(d.run()) for d in displays]
+    print(f"Simulating {len(displays)} display(s) on {displays[0].ip}..{displays[-1].ip}, "
+          f"websocket port {args.ws_port}, agent UDP {args.agent_host}:{args.udp_port}")
+    started = time.monotonic()
+    try:
+        while not args.duration or time.monotonic() - started < args.duration:
+            await asyncio.sleep(args.report_every)
+            for d in displays:
+                s = d.state
+                print(f"  {d.ip}: {d.connections} connection(s), frames by type {dict(sorted(d.frames.items()))}, "
+                      f"{s.computer_name!r} mem {s.memory:.1f}% temps {s.average_temp:.1f}/{s.maximum_temp:.1f} "
+                      f"{len(s.cpu_values)} bar(s) avg {s.cpu_average:.1f}%, rejected {s.rejected}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        for d in displays:
+            await d.stop()
+    return 0
+
+
+# -----------------------------------------------------------------------------
+# bench: agent + simulated fleet, per scenario
+# -----------------------------------------------------------------------------
+def _free_udp_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class SyntheticProc(threading.Thread):
+    """Keeps a synthetic procfs with the given number of CPUs ticking."""
+
+    def __init__(self, cores: int):
+        super().__init__(daemon=True)
+        self.root = tempfile.mkdtemp(prefix="cpumonitorjr-sim-")
+        self.cores = cores
+        self._ticks = [0] * cores
+        self._stop = threading.Event()
+        write_synthetic_procfs(self.root, cores, self._ticks)
+
+    def run(self):
+        while not self._stop.wait(0.1):
+            write_synthetic_procfs(self.root, self.cores, self._ticks)
+
+    def stop(self):
+        self._stop.set()
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+async def bench_scenario(devices: int, interval: float, cores: int, args) -> Dict[str, object]:
+    udp_port = _free_udp_port()
+    env = dict(os.environ,
+               CPUMONITORJR_UDP_PORT=str(udp_port),
+               CPUMONITORJR_INTERVAL=str(interval),
+               CPUMONITORJR_FRAME_TIMESTAMPS="1",
+               CPUMONITORJR_EXTERNAL_IP_URL="",
+               CPUMONITORJR_METRICS_PORT="0",
+               CPUMONITORJR_METRICS_SOCKET="")
+    synthetic = None
+    if cores:
+        synthetic = SyntheticProc(cores)
+        synthetic.start()
+        env["CPUMONITORJR_PROC_ROOT"] = synthetic.root
+        env["CPUMONITORJR_SAMPLER"] = "proc"
+
+    agent = subprocess.Popen([sys.executable, AGENT, "-nologging"], env=env,
+                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    displays: List[SimulatedDisplay] = []
+    tasks: List[asyncio.Task] = []
+    try:
+        proc = psutil.Process(agent.pid)
+        await asyncio.sleep(args.startup)
+        displays = await start_displays(devices, args.ws_port, udp_port, "127.0.0.1", True)
+        tasks = [asyncio.create_task(d.run()) for d in displays]
+
+        # Let every display connect and finish its handshake, then measure
+        await asyncio.sleep(args.warmup)
+        for d in displays:
+            d.reset_counters()
+        cpu_before = sum(proc.cpu_times()[:2])
+        started = time.monotonic()
+        rss = 0
+        while time.monotonic() - started < args.duration:
+            rss = max(rss, proc.memory_info().rss)
+            await asyncio.sleep(0.25)
+        elapsed = time.monotonic() - started
+        cpu = (sum(proc.cpu_times()[:2]) - cpu_before) / elapsed * 100
+    finally:
+        for task in tasks:
+            task.cancel()
+        agent.terminate()
+        try:
+            agent.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            agent.kill()
+        for d in displays:
+            await d.stop()
+        if synthetic is not None:
+            synthetic.stop()
+
+    updates = sum(d.updates for d in displays)
+    latencies = [x for d in displays for x in d.latencies]
+    expected = devices * elapsed / interval
+    return {
+        "devices": devices,
+        "interval_s": interval,
+        "cores": cores or psutil.cpu_count(),
+        "updates_per_s": round(updates / elapsed, 2),
+        "delivery": round(updates / expected, 3) if expected else 0.0,
+        "latency_p50_ms": round(_percentile(latencies, 50) * 1000, 2),
+        "latency_p99_ms": round(_percentile(latencies, 99) * 1000, 2),
+        "latency_max_ms": round(max(latencies, default=0.0) * 1000, 2),
+        "agent_cpu_percent": round(cpu, 2),
+        "agent_rss_mb": round(rss / 2 ** 20, 1),
+        "rejected": sum(d.state.rejected for d in displays),
+    }
+
+
+def _failures(result: Dict[str, object], args) -> List[str]:
+    failures = []
+    if args.max_cpu is not None and result["agent_cpu_percent"] > args.max_cpu:
+        failures.append(f"agent CPU {result['agent_cpu_percent']}% > {args.max_cpu}%")
+    if args.max_rss_mb is not None and result["agent_rss_mb"] > args.max_rss_mb:
+        failures.append(f"agent RSS {result['agent_rss_mb']} MB > {args.max_rss_mb} MB")
+    if args.max_p99_ms is not None and result["latency_p99_ms"] > args.max_p99_ms:
+        failures.append(f"p99 latency {result['latency_p99_ms']} ms > {args.max_p99_ms} ms")
+    if args.min_delivery is not None and result["delivery"] < args.min_delivery:
+        failures.append(f"delivery {result['delivery']} < {args.min_delivery}")
+    if result["rejected"]:
+        failures.append(f"{result['rejected']} frame(s) the sketch would reject")
+    return failures
+
+
+async def bench_fleet(args) -> int:
+    results = []
+    failed = False
+    print(f"{'devices':>7} {'interval':>8} {'cores':>5} {'upd/s':>8} {'deliv':>6} "
+          f"{'p50 ms':>7} {'p99 ms':>7} {'max ms':>7} {'cpu %':>6} {'rss MB':>7}")
+    for devices in args.devices:
+        for interval in args.intervals:
+            for cores in args.cores:
+                r = await bench_scenario(devices, interval, cores, args)
+                problems = _failures(r, args)
+                failed = failed or bool(problems)
+                r["failures"] = problems
+                results.append(r)
+                print(f"{r['devices']:>7} {r['interval_s']:>8} {r['cores']:>5} {r['updates_per_s']:>8} "
+                      f"{r['delivery']:>6} {r['latency_p50_ms']:>7} {r['latency_p99_ms']:>7} "
+                      f"{r['latency_max_ms']:>7} {r['agent_cpu_percent']:>6} {r['agent_rss_mb']:>7}"
+                      + ("  FAIL: " + "; ".join(problems) if problems else ""))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 1 if failed else 0
+
+
+# -----------------------------------------------------------------------------
+# Main
+# -----------------------------------------------------------------------------
+def _int_list(text: str) -> List[int]:
+    return [int(x) for x in text.split(",") if x.strip()]
+
+
+def _float_list(text: str) -> List[float]:
+    return [float(x) for x in text.split(",") if x.strip()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="CPUMonitorJr simulated ESP32 displays")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("run", help="simulate displays for an agent that is already running")
+    p.add_argument("--devices", type=int, default=1, help="number of displays (default 1)")
+    p.add_argument("--ws-port", type=int, default=8080, help="websocket port of every display (default 8080)")
+    p.add_argument("--udp-port", type=int, default=44447, help="the agent's CPUMONITORJR_UDP_PORT (default 44447)")
+    p.add_argument("--agent-host", default="127.0.0.1", help="where to send discovery (default 127.0.0.1)")
+    p.add_argument("--duration", type=float, default=0, help="seconds to run (default: until interrupted)")
+    p.add_argument("--report-every", type=float, default=5.0, help="seconds between reports (default 5)")
+    p.set_defaults(func=run_displays)
+
+    p = sub.add_parser("bench", help="start the agent per scenario and measure it against a simulated fleet")
+    p.add_argument("--devices", type=_int_list, default=[1, 8], help="comma separated display counts (default 1,8)")
+    p.add_argument("--intervals", type=_float_list, default=[1.0, 0.2], help="comma separated send intervals (default 1,0.2)")
+    p.add_argument("--cores", type=_int_list, default=[0],
+                   help="comma separated CPU counts; 0 = this host's /proc, otherwise a synthetic procfs (default 0)")
+    p.add_argument("--duration", type=float, default=10.0, help="measured seconds per scenario (default 10)")
+    p.add_argument("--warmup", type=float, default=2.0, help="seconds to connect before measuring (default 2)")
+    p.add_argument("--startup", type=float, default=1.0, help="seconds for the agent to start (default 1)")
+    p.add_argument("--ws-port", type=int, default=18080, help="websocket port of every display (default 18080)")
+    p.add_argument("--max-cpu", type=float, help="fail above this agent CPU percent")
+    p.add_argument("--max-rss-mb", type=float, help="fail above this agent RSS")
+    p.add_argument("--max-p99-ms", type=float, help="fail above this p99 sample-to-receive latency")
+    p.add_argument("--min-delivery", type=float, help="fail below this fraction of the expected updates (e.g. 0.95)")
+    p.add_argument("--json", help="also write the results to this file")
+    p.set_defaults(func=bench_fleet)
+
+    args = parser.parse_args()
+    try:
+        return asyncio.run(args.func(args))
+    except KeyboardInterrupt:
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())